@@ -1,16 +1,26 @@
 import os
+import sys
 import uuid
 import airflow
 import logging
 from datetime import timedelta
-from pymongo import MongoClient
+from airflow.operators.dummy_operator import DummyOperator
 from airflow.operators import (SyncOperator,
+                               ExecutionModeOperator,
+                               LocalOperator,
                                SetupOperator,
-                               SleepOperator,
                                UnzipOperator,
                                WorkerOperator,
-                               CompletionOperator,
-                               BlockSensorOperator, )
+                               SpeculativeWorkerOperator,
+                               CompletionOperator, )
+
+
+PLUGINS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins')
+if PLUGINS_FOLDER not in sys.path:
+    sys.path.append(PLUGINS_FOLDER)
+import user_inputs
+import autoscale
+from constants import WORKER_QUEUE
 
 # -------------------------------------------------------
 
@@ -19,36 +29,20 @@ log = logging.getLogger(__name__)
 os.environ['AIRFLOW_HOME'] = os.getcwd()
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "{}/dags/auth.ansible.json".format(os.getcwd())
 
-# if os.environ.get('ENV') == "SERVER":
-try:
-    log.info("fetching user_inputs from database")
-
-    """
-    Required document structure for user input:
-        {
-            "NO_OF_INSTANCES": <int>,
-            "BIN_DATA_SOURCE_BLOB": <str> root blob name for the binary files
-            "ZIP_BLOB": <str> prefix of the root directory of bin files without trailing `/`
-        }
-    """
-    # MONGO_HOST = '127.0.0.1'
-    # MONGO_HOST = '172.17.0.1/'
-    # client = MongoClient(host=MONGO_HOST)
-
-    client = MongoClient()
-
-    db = client['airflow_db']
-    collection = db['user_inputs']
-    user_input = list(collection.find())[-1]  # getting the last entry made by user
-    NO_OF_INSTANCES = int(user_input.get('NO_OF_INSTANCES', 3)) or 1  # no of instances should be at least 1
-    BIN_DATA_SOURCE_BLOB = str(user_input.get('BIN_DATA_SOURCE_BLOB', 'bin_log'))
-    ZIP_BLOB = str(user_input.get('ZIP_BLOB', 'zip_blob'))
-    log.info("Fetched info from database")
-except Exception as e:
-    log.info("Exception occurred: {}".format(e))
-    NO_OF_INSTANCES = 3
-    BIN_DATA_SOURCE_BLOB = 'bin_log'
-    ZIP_BLOB = 'zip_blob'
+# the user inputs are resolved at run time by the sync task (see plugins/user_inputs.py), the DAG
+# layout only needs NO_OF_INSTANCES and the machine types, read from a cache so that parsing this
+# file stays cheap
+USER_INPUTS = user_inputs.cached()
+NO_OF_INSTANCES = USER_INPUTS['NO_OF_INSTANCES']
+# a worker task per task slot (vCPU) of the instances
+WORKER_TASKS = NO_OF_INSTANCES * autoscale.slots_per_instance(USER_INPUTS)
+# the tasks running on the instances; the permanent worker does not listen on their queue
+WORKER_ARGS = {'queue': WORKER_QUEUE}
+if USER_INPUTS['PREEMPTIBLE']:
+    # the tasks lost with a preempted instance are retried once it is restarted, see plugins/checkpoints.py
+    WORKER_ARGS.update(retries=3, retry_delay=timedelta(minutes=2))
+# spare worker tasks, for the speculative duplicates of the stragglers
+SPECULATIVE_TASKS = USER_INPUTS['SPECULATIVE_TASKS']
 
 # -------------------------------------------------------
 
@@ -62,31 +56,42 @@ def_args = {
 
 dag = airflow.DAG('process_dag', description='final running dag',
                   schedule_interval=timedelta(days=2),
-                  catchup=False, concurrency=20, default_args=def_args)
+                  catchup=False, concurrency=max(20, WORKER_TASKS + SPECULATIVE_TASKS + 5),
+                  default_args=def_args)
 
-sync_task = SyncOperator(op_param={'instance_info': instance_info,
-                                   'bin_data_source_blob': BIN_DATA_SOURCE_BLOB,
-                                   'zip_blob': ZIP_BLOB},
+sync_task = SyncOperator(op_param={'instance_info': instance_info, 'worker_tasks': WORKER_TASKS},
                          task_id='sync_task', dag=dag)
 
-setup_task = SetupOperator(op_param={},
-                           task_id='setup_task', dag=dag)
+# the small runs are processed on this host by local_task, the others by the instances (gce_mode)
+execution_mode_task = ExecutionModeOperator(op_param={'local': 'local_task', 'gce': 'gce_mode'},
+                                            task_id='execution_mode_task', dag=dag)
+
+gce_mode = DummyOperator(task_id='gce_mode', dag=dag)
+
+local_task = LocalOperator(op_param={}, task_id='local_task', dag=dag)
+
+# setup is done in a single poke; in reschedule mode, the completion task does not hold the
+# permanent worker's slot between its pokes
+setup_task = SetupOperator(op_param={}, poke_interval=30,
+                           task_id='setup_task', dag=dag, retries=3)
 
 unzip_task = UnzipOperator(op_param={},
-                           task_id='unzip_task', dag=dag)
+                           task_id='unzip_task', dag=dag, **WORKER_ARGS)
 
-completion_task = CompletionOperator(op_param={},
+completion_task = CompletionOperator(op_param={'spare_tasks': SPECULATIVE_TASKS}, mode='reschedule', poke_interval=30,
                                      task_id='completion_task', dag=dag, retries=5)
-sleep_task = SleepOperator(op_param={"sleep_time": 0}, task_id='sleep_task', dag=dag)
-block_after_unzip = BlockSensorOperator(op_param={}, task_id='post_unzip_block_task', dag=dag)
-
-sync_task >> setup_task >> completion_task
-sync_task >> sleep_task >> unzip_task >> block_after_unzip
-for instance_no in range(len(instance_info['instances'])):
-    # sleep task is arranged in parallel to blocking_sensor to eliminate the changes of scheduling
-    # worker task before it so that the permanent worker (the one that is supposed to create and
-    # destroy instances doesn't get the worker task
-    sTask = SleepOperator(op_param={"sleep_time": 0}, task_id='sleep_task' + str(instance_no), dag=dag)
-    wTask = WorkerOperator(op_param={"number": instance_no, "total": NO_OF_INSTANCES},
-                           task_id='worker_task' + str(instance_no), dag=dag)
-    setup_task >> sTask >> wTask
+
+sync_task >> execution_mode_task
+execution_mode_task >> local_task
+execution_mode_task >> gce_mode
+gce_mode >> setup_task >> completion_task
+gce_mode >> unzip_task
+for slot_no in range(WORKER_TASKS):
+    wTask = WorkerOperator(op_param={"number": slot_no},
+                           task_id='worker_task' + str(slot_no), dag=dag, **WORKER_ARGS)
+    setup_task >> wTask
+    unzip_task >> wTask
+for spare_no in range(SPECULATIVE_TASKS):
+    spare_task = SpeculativeWorkerOperator(op_param={}, mode='reschedule', poke_interval=30,
+                                           task_id='spare_task' + str(spare_no), dag=dag, **WORKER_ARGS)
+    unzip_task >> spare_task
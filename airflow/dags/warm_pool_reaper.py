@@ -0,0 +1,23 @@
+import os
+import airflow
+from datetime import timedelta
+from airflow.operators import WarmPoolReaperOperator
+
+# -------------------------------------------------------
+
+os.environ['AIRFLOW_HOME'] = os.getcwd()
+os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "{}/dags/auth.ansible.json".format(os.getcwd())
+
+# -------------------------------------------------------
+
+def_args = {
+    'start_date': airflow.utils.dates.days_ago(1),
+    'provide_context': True
+}
+
+dag = airflow.DAG('warm_pool_reaper', description='deletes the expired instances of the warm pool',
+                  schedule_interval=timedelta(minutes=10),
+                  catchup=False, max_active_runs=1, default_args=def_args)
+
+# deletes the instances idle in the warm pool for more than WARM_POOL_TTL, see plugins/warm_pool.py
+reap_task = WarmPoolReaperOperator(task_id='reap_task', dag=dag)
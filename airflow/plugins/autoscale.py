@@ -0,0 +1,132 @@
+"""
+Sizing of the worker fleet from the volume of the input data (user input AUTOSCALE).
+
+The DAG lays out a worker task per task slot (vCPU) of NO_OF_INSTANCES instances of the largest
+MACHINE_TYPES, the largest fleet a run can get. At run time SyncOperator sums the sizes of the
+input blobs and `plan` picks the no. of instances (and the machine type) parsing them within the
+target time, at the measured per core parse throughput:
+
+    cores = input MB / (MB/s per core) / (target seconds - instance boot seconds)
+
+The instances beyond the plan are not created by SetupOperator, and the worker tasks beyond its
+slots are not given files; they are no-ops.
+"""
+import math
+import logging
+
+log = logging.getLogger(__name__)
+
+# json output of the native engine on one core, benchmarks/parser_benchmark.py gives ~5 MB/s on a
+# 2.5 GHz core, less on the shared cores of the small machine types
+PARSE_MBPS_PER_CORE = 4.0
+# bin bytes per zip byte, for sizing the runs of which the zip is not extracted yet
+ZIP_EXPANSION = 3.0
+# creation of an instance up to its airflow worker taking tasks
+INSTANCE_BOOT_SECONDS = 240
+# (machine type, vCPUs), the smallest first
+MACHINE_TYPES = (
+    ('n1-standard-1', 1),
+    ('n1-standard-2', 2),
+    ('n1-standard-4', 4),
+    ('n1-standard-8', 8),
+)
+
+
+def vcpus(machine_type):
+    """
+    :return: vCPUs of the machine type, i.e. the task slots of its instances: the last part of
+        the predefined types (e.g. n1-highcpu-16), the one before the memory of the custom ones
+        ([<family>-]custom-<vCPUs>-<memory MB>[-ext]), 1 for the others (e.g. f1-micro)
+    """
+    for name, cpus in MACHINE_TYPES:
+        if name == machine_type:
+            return cpus
+    parts = machine_type.split('-')
+    try:
+        if 'custom' in parts:
+            return int(parts[parts.index('custom') + 1])
+        return int(parts[-1])
+    except (IndexError, ValueError):
+        return 1
+
+
+def slots_per_instance(inputs):
+    """
+    :return: task slots of the largest instances a run of the user inputs can get
+    """
+    if inputs['AUTOSCALE']:
+        return max(vcpus(machine_type) for machine_type in inputs['MACHINE_TYPES'] or [MACHINE_TYPES[0][0]])
+    return vcpus(inputs['MACHINE_TYPE'])
+
+
+def fleet_slots(instances, machine_type, worker_tasks):
+    """
+    :param instances: names of the instances of the run
+    :param worker_tasks: no. of worker tasks the DAG lays out
+    :return: (instances, workers): the instances needed to give each worker task a task slot,
+        and the no. of worker tasks run, one per slot up to `worker_tasks`
+    """
+    slots = vcpus(machine_type)
+    workers = min(len(instances) * slots, worker_tasks)
+    if workers < len(instances) * slots:
+        log.warning("{} x {} has {} task slots, the DAG runs with {} worker tasks until it is parsed again".format(
+            len(instances), machine_type, len(instances) * slots, worker_tasks))
+        instances = instances[:-(-workers // slots)]
+    return instances, workers
+
+
+def input_size(bucket, bin_data_source_blob, zip_blob, zip_expansion=ZIP_EXPANSION):
+    """
+    :return: (estimated bytes of bin data, no. of bin files or None when they are still zipped),
+        from a prefix listing of the bin files or else of the zip files
+    """
+    bin_sizes = [blob.size or 0 for blob in bucket.list_blobs(prefix=bin_data_source_blob + '/')]
+    if bin_sizes:
+        return sum(bin_sizes), len(bin_sizes)
+    zip_bytes = sum(blob.size or 0 for blob in bucket.list_blobs(prefix=zip_blob))
+    return int(zip_bytes * zip_expansion), None
+
+
+def plan(input_bytes, target_seconds, max_instances, min_instances=1, mbps_per_core=PARSE_MBPS_PER_CORE,
+         machine_types=None, cpu_quota=None, files=None, boot_seconds=INSTANCE_BOOT_SECONDS):
+    """
+    :param input_bytes: bytes of bin data to be parsed
+    :param target_seconds: wanted duration of the run
+    :param max_instances: max no. of instances, the NO_OF_INSTANCES the DAG lays out worker tasks for
+    :param min_instances: fleet size floor
+    :param mbps_per_core: parse throughput of a core, MB/s
+    :param machine_types: names of the MACHINE_TYPES to choose from, the first one only by default
+    :param cpu_quota: vCPUs left in the region's quota, None if unknown
+    :param files: no. of bin files, the task slots beyond them would stay idle
+    :return: {'instances', 'machine_type', 'cores', 'estimated_seconds'}
+    """
+    candidates = [(name, cpus) for name, cpus in MACHINE_TYPES if name in machine_types] \
+        if machine_types else [MACHINE_TYPES[0]]
+    if not candidates:
+        raise ValueError("Unknown machine types {}, expected some of {}".format(
+            machine_types, [name for name, _ in MACHINE_TYPES]))
+    parse_seconds = max(float(target_seconds) - boot_seconds, 60.0)
+    cores_needed = int(math.ceil(input_bytes / (mbps_per_core * 1e6) / parse_seconds)) or 1
+
+    # the smallest machine type fitting the cores in max_instances, else the largest one
+    machine_type, cpus = candidates[-1]
+    for name, type_cpus in candidates:
+        if int(math.ceil(cores_needed / float(type_cpus))) <= max_instances:
+            machine_type, cpus = name, type_cpus
+            break
+    instances = int(math.ceil(cores_needed / float(cpus)))
+    if files is not None:
+        instances = min(instances, int(math.ceil(files / float(cpus))))
+    if cpu_quota is not None:
+        instances = min(instances, int(cpu_quota) // cpus)
+    instances = max(min(instances, max_instances), min_instances, 1)
+    if cpu_quota is not None and instances * cpus > cpu_quota:
+        log.warning("{} x {} exceeds the {} vCPUs left in the quota".format(instances, machine_type, cpu_quota))
+
+    cores = instances * cpus
+    return {
+        'instances': instances,
+        'machine_type': machine_type,
+        'cores': cores,
+        'estimated_seconds': int(boot_seconds + input_bytes / (mbps_per_core * 1e6) / cores),
+    }
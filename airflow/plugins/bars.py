@@ -0,0 +1,63 @@
+TRADE_MSG_TYPES = (b'T',)
+BARS_HEADER = 'token,bar_start,open,high,low,close,volume,vwap,trades\n'
+# items of a running bar
+START, OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL, TRADES = range(8)
+
+
+class BarAggregator(object):
+    """
+    Parser sink computing per token OHLCV bars and VWAP of the trades, bucketed by
+    `interval` (timestamp units), in the single parsing pass. Bars are written as csv to
+    `save_filename` as soon as they close.
+
+    The running bar of every token is a plain list, [start, open, high, low, close, volume,
+    notional, trades], updated in place: one dict lookup per trade, and list items are cheaper
+    to update than array ones (no boxing of the values). A trade older than the running bar of
+    its token is accounted in the running bar.
+    """
+
+    def __init__(self, save_filename, interval, msg_types=TRADE_MSG_TYPES):
+        self.save_filename = save_filename
+        self.interval = interval
+        self.msg_types = msg_types
+        self.bars = {}  # token -> running bar
+        self.outfile = open(save_filename, 'w')
+        self.outfile.write(BARS_HEADER)
+
+    def add(self, offset, header, record):
+        if header.msg_type not in self.msg_types:
+            return
+        timestamp = record['timestamp']
+        price = record['price']
+        quantity = record['quantity']
+        start = timestamp - timestamp % self.interval
+
+        bar = self.bars.get(record['token'])
+        if bar is None or start > bar[START]:
+            if bar is not None:
+                self._write(record['token'], bar)
+            self.bars[record['token']] = [start, price, price, price, price, quantity, float(price) * quantity, 1]
+            return
+
+        if price > bar[HIGH]:
+            bar[HIGH] = price
+        elif price < bar[LOW]:
+            bar[LOW] = price
+        bar[CLOSE] = price
+        bar[VOLUME] += quantity
+        bar[NOTIONAL] += float(price) * quantity
+        bar[TRADES] += 1
+
+    def _write(self, token, bar):
+        start, open_, high, low, close, volume, notional, trades = bar
+        vwap = notional / volume if volume else float(close)
+        self.outfile.write('{},{},{},{},{},{},{},{:.6f},{}\n'.format(
+            token, start, open_, high, low, close, volume, vwap, trades))
+
+    def close(self):
+        for token in sorted(self.bars):
+            self._write(token, self.bars[token])
+        self.outfile.close()
+
+    def paths(self):
+        return [self.save_filename]
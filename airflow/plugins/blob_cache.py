@@ -0,0 +1,293 @@
+"""
+Local on-disk cache of the downloaded blobs for the long lived (permanent or reused) workers.
+
+Entries are content addressed: the key is the blob name + its generation (or md5 when the
+generation is missing), so a blob that is re-uploaded gets a new entry and a stale copy is never
+served. The cache is capped in size and the least recently used entries are evicted first. The cap
+is BLOB_CACHE_MAX_BYTES when set (0 disables the cache), else CACHE_DISK_SHARE of the disk space
+free or taken by the cache, so that it fits the small boot disks of the workers.
+
+The files fetched are hard links to the entries, not copies, so a blob takes its disk space once.
+The entries are read only, a fetched file must be replaced (e.g. downloaded again), not rewritten
+in place.
+
+Several processes (celery task processes, the startup script) may use the same cache directory
+at the same time: entries are written to a temporary file and renamed into place, a download of
+a blob is guarded by a per entry lock so that it is fetched once, the readers of an entry hold its
+lock shared (see `reading`), and the eviction runs under a cache wide lock, only removing the
+entries (and their lock files) whose lock it gets without waiting.
+
+This module is also downloaded next to instance_blob_download.py by the startup script (from
+its copy synced under airflow_home/plugins), so it must only depend on the standard library.
+"""
+import os
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+CACHE_ROOT = os.environ.get('BLOB_CACHE_DIR', os.path.expanduser('~/.blob_cache'))
+CACHE_MAX_BYTES = os.environ.get('BLOB_CACHE_MAX_BYTES')  # 0 disables the cache
+CACHE_MAX_BYTES = int(CACHE_MAX_BYTES) if CACHE_MAX_BYTES else None  # None: sized from the free disk space
+CACHE_DISK_SHARE = 0.25  # of the disk space free or cached, used by the cache without CACHE_MAX_BYTES
+
+
+def _make_dirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _link(source, file_path):
+    """
+    Hard links `source` to `file_path` (replacing it), copies it across file systems
+    """
+    tmp_path = '{}.{}.link'.format(file_path, os.getpid())
+    _remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.rename(tmp_path, file_path)
+
+
+class _FileLock(object):
+    """
+    flock based lock, exclusive or `shared`; with `blocking` False, entering raises IOError/OSError
+    (EWOULDBLOCK) instead of waiting when the lock is held. The lock file may be removed by its
+    holder, the ones waiting for it then lock the file created in its place
+    """
+
+    def __init__(self, path, shared=False, blocking=True):
+        self.path = path
+        self.operation = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        self.fd = None
+
+    def __enter__(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, self.operation)
+            except Exception:
+                os.close(fd)
+                raise
+            try:
+                current = os.path.samestat(os.fstat(fd), os.stat(self.path))
+            except OSError:
+                current = False
+            if current:
+                self.fd = fd
+                return self
+            os.close(fd)  # removed while waiting for it
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+class BlobCache(object):
+    def __init__(self, root=CACHE_ROOT, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, 'objects')
+        self.locks = os.path.join(root, 'locks')
+        _make_dirs(self.objects)
+        _make_dirs(self.locks)
+
+    @staticmethod
+    def key(blob):
+        """
+        :return: key of the blob in the cache, None for the blobs without any version info
+        """
+        version = blob.generation or blob.md5_hash
+        if not version:
+            return None
+        return hashlib.sha1('{}#{}'.format(blob.name, version).encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    def _lock(self, key, **kwargs):
+        return _FileLock(os.path.join(self.locks, key), **kwargs)
+
+    def capacity(self, cached=0):
+        """
+        :param cached: bytes in the cache
+        :return: max bytes of the cache, max_bytes or when None, CACHE_DISK_SHARE of the disk space
+            free or `cached`
+        """
+        if self.max_bytes is not None:
+            return self.max_bytes
+        stat = os.statvfs(self.root)
+        return int((stat.f_bavail * stat.f_frsize + cached) * CACHE_DISK_SHARE)
+
+    @contextmanager
+    def reading(self, blob):
+        """
+        Yields the path of the cached copy of the blob (None on a miss), which is not evicted
+        until the end of the `with` block
+        """
+        key = self.key(blob)
+        if key is None:
+            yield None
+            return
+        with self._lock(key, shared=True):
+            yield self.get(blob)
+
+    def get(self, blob):
+        """
+        :return: path of the cached copy of the blob, None on a miss. It may be evicted as soon
+            as it is returned, use `reading` to read it
+        """
+        key = self.key(blob)
+        if key is None:
+            return None
+        path = self._entry(key)
+        try:
+            if blob.size is not None and os.path.getsize(path) != blob.size:
+                return None
+            os.utime(path, None)  # mtime is the last access time for the LRU eviction
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, blob, file_path):
+        """
+        Saves the blob to `file_path`, downloading it only when it is not in the cache already
+        :return: True on a cache hit
+        """
+        key = self.key(blob)
+        capacity = self.capacity()
+        if key is None or capacity <= 0 or (blob.size or 0) > capacity:
+            blob.download_to_filename(file_path)
+            return False
+
+        hit = True
+        with self._lock(key):
+            path = self.get(blob)
+            if path is None:
+                hit = False
+                path = self._entry(key)
+                _make_dirs(os.path.dirname(path))
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as tmp_file:
+                        blob.download_to_file(tmp_file)
+                    os.chmod(tmp_path, 0o444)
+                    os.rename(tmp_path, path)
+                except Exception:
+                    os.remove(tmp_path)
+                    raise
+            _link(path, file_path)
+
+        if not hit:
+            self.evict()
+        return hit
+
+    def evict(self):
+        """
+        Removes the least recently used entries till the cache fits in its capacity, and the lock
+        files left without an entry
+        """
+        with _FileLock(os.path.join(self.root, '.evict.lock')):
+            entries = []
+            total = 0
+            for dir_path, _, file_names in os.walk(self.objects):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if file_name.endswith('.tmp'):
+                        # leftover of a killed download
+                        if stat.st_mtime < time.time() - 24 * 60 * 60:
+                            os.remove(path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            capacity = self.capacity(total)
+            keys = set(os.path.basename(path) for _, _, path in entries)
+            for key in os.listdir(self.locks):
+                if key not in keys:
+                    self._remove_entry(key, None)  # e.g. of a blob read while not cached
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= capacity:
+                    break
+                if self._remove_entry(os.path.basename(path), path):
+                    total -= size
+
+    def _remove_entry(self, key, path):
+        """
+        Removes the entry at `path` (if any) and its lock file, unless it is being downloaded or read
+        :return: True once removed
+        """
+        lock = self._lock(key, blocking=False)
+        try:
+            lock.__enter__()
+        except (IOError, OSError):
+            return False  # being downloaded or read
+        try:
+            if path is not None:
+                os.remove(path)
+            _remove(lock.path)  # while holding it, see _FileLock
+        except OSError:
+            return False
+        finally:
+            lock.__exit__()
+        return True
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    :return: BlobCache shared by the process, None when disabled by BLOB_CACHE_MAX_BYTES=0
+    """
+    global _default_cache
+    if CACHE_MAX_BYTES is not None and CACHE_MAX_BYTES <= 0:
+        return None
+    if _default_cache is None:
+        _default_cache = BlobCache()
+    return _default_cache
+
+
+@contextmanager
+def reading(blob):
+    """
+    BlobCache.reading of the default cache, yields None when the cache is disabled
+    """
+    cache = default_cache()
+    if cache is None:
+        yield None
+        return
+    with cache.reading(blob) as path:
+        yield path
+
+
+def download(blob, file_path):
+    """
+    Drop-in for blob.download_to_filename(file_path) reading through the default cache
+    """
+    cache = default_cache()
+    if cache is None:
+        blob.download_to_filename(file_path)
+        return False
+    return cache.fetch(blob, file_path)
@@ -0,0 +1,188 @@
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from log_parser import StreamParser, IndexBuilder, INDEX_EVERY, INDEX_MAGIC, INDEX_MAGIC_V1, INDEX_HEADER, \
+    INT64_TYPECODE, READ_CHUNK_SIZE
+
+
+class CaptureIndex(object):
+    """
+    Offset index of a capture (the sidecar saved by log_parser.IndexBuilder). Lets a reader
+    start at any seq_no or timestamp, or split a capture in parts, without walking the
+    msg_len chain from the first byte. Timestamps are expected to be non-decreasing in a
+    capture, seq_nos in a stream: the seq_nos of the interleaved streams are seeked per stream.
+    The indexes of the first version (INDEX_MAGIC_V1) have no stream_ids, they only seek timestamps.
+    """
+
+    def __init__(self, every, offsets, seq_nos, msg_types, timestamps, stream_ids=None):
+        self.every = every
+        self.offsets = offsets
+        self.seq_nos = seq_nos
+        self.msg_types = msg_types
+        self.timestamps = timestamps
+        self.stream_ids = stream_ids
+        self._streams = None  # stream_id -> (offsets, seq_nos) of its entries, built on the first seek
+
+    @classmethod
+    def load(cls, index_filename):
+        with open(index_filename, 'rb') as index_file:
+            magic, every, count = INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+            if magic not in (INDEX_MAGIC, INDEX_MAGIC_V1):
+                raise ValueError("{} is not a capture index".format(index_filename))
+            offsets = array(INT64_TYPECODE)
+            offsets.fromfile(index_file, count)
+            seq_nos = array('i')
+            seq_nos.fromfile(index_file, count)
+            msg_types = bytearray(index_file.read(count))
+            timestamps = array(INT64_TYPECODE)
+            timestamps.fromfile(index_file, count)
+            stream_ids = None
+            if magic == INDEX_MAGIC:
+                stream_ids = array('H')
+                stream_ids.fromfile(index_file, count)
+        if sys.byteorder == 'big':
+            for column in (offsets, seq_nos, timestamps, stream_ids):
+                if column is not None:
+                    column.byteswap()
+        return cls(every, offsets, seq_nos, msg_types, timestamps, stream_ids)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def streams(self):
+        """
+        :return: sorted stream_ids of the indexed messages
+        """
+        if self.stream_ids is None:
+            raise ValueError("The index has no stream_ids, rebuild it with build_index")
+        if self._streams is None:
+            streams = {}
+            for offset, seq_no, stream_id in zip(self.offsets, self.seq_nos, self.stream_ids):
+                entries = streams.setdefault(stream_id, (array(INT64_TYPECODE), array('i')))
+                entries[0].append(offset)
+                entries[1].append(seq_no)
+            self._streams = streams
+        return sorted(self._streams)
+
+    def seek_seq_no(self, seq_no, stream_id=None):
+        """
+        :param stream_id: stream of the `seq_no`, may be omitted for the single stream captures
+        :return: offset to start reading from to get the message with `seq_no` of the stream
+        """
+        streams = self.streams()
+        if stream_id is None:
+            if len(streams) > 1:
+                raise ValueError("seq_nos are per stream, the capture has the streams {}".format(streams))
+            stream_id = streams[0] if streams else 0
+        offsets, seq_nos = self._streams.get(stream_id, ((), ()))
+        pos = bisect_right(seq_nos, seq_no) - 1
+        return offsets[pos] if pos >= 0 else 0
+
+    def seek_timestamp(self, timestamp):
+        """
+        :return: offset to start reading from to get the first message at or after `timestamp`
+        """
+        pos = bisect_left(self.timestamps, timestamp) - 1
+        return self.offsets[pos] if pos >= 0 else 0
+
+    def split(self, parts):
+        """
+        Splits the capture into `parts` ranges of (nearly) equal no. of messages
+        :return: [(start_offset, end_offset), ...], end_offset of the last range is None
+        """
+        parts = max(1, min(parts, len(self.offsets)))
+        starts = [self.offsets[len(self.offsets) * i // parts] for i in range(parts)]
+        return list(zip(starts, starts[1:] + [None]))
+
+
+def parse_range(filename, sinks, start=0, end=None, logger=None):
+    """
+    Parses the messages of the capture in [start, end) byte offsets, `start` must be a
+    message boundary (e.g. an offset from CaptureIndex)
+    """
+    with StreamParser(sinks, logger=logger, name=filename, offset=start) as parser, open(filename, 'rb') as infile:
+        infile.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            chunk = infile.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            parser.feed(chunk)
+
+
+class _Collector(object):
+    def __init__(self):
+        self.records = []
+
+    def add(self, offset, header, record):
+        self.records.append((header.stream_id & 0xffff, record))
+
+    def close(self):
+        pass
+
+
+def _decoded(filename, start):
+    """
+    Yields the (stream_id, record) of the messages of the capture from the offset `start`, the
+    truncated last one included (flushed by the parser's close)
+    """
+    collector = _Collector()
+    with StreamParser([collector], name=filename, offset=start) as parser, open(filename, 'rb') as infile:
+        infile.seek(start)
+        for chunk in iter(lambda: infile.read(READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+            for item in collector.records:
+                yield item
+            collector.records = []
+    for item in collector.records:
+        yield item
+
+
+def read_messages(filename, index, start_seq_no=None, end_seq_no=None,
+                  start_timestamp=None, end_timestamp=None, stream_id=None):
+    """
+    Yields the decoded messages of the capture with start_seq_no <= seq_no <= end_seq_no
+    and start_timestamp <= timestamp <= end_timestamp (None for no bound), reading the
+    capture from the nearest indexed offset
+    :param stream_id: only the messages of this stream; needed for the seq_no bounds when the
+        capture has several streams, their seq_nos being per stream
+    """
+    seq_no_bounds = start_seq_no is not None or end_seq_no is not None
+    if seq_no_bounds and stream_id is None:
+        streams = index.streams()
+        if len(streams) > 1:
+            raise ValueError("seq_nos are per stream, the capture has the streams {}".format(streams))
+    start = 0
+    if start_seq_no is not None:
+        start = max(start, index.seek_seq_no(start_seq_no, stream_id))
+    if start_timestamp is not None:
+        start = max(start, index.seek_timestamp(start_timestamp))
+
+    timestamp = -1
+    for record_stream, record in _decoded(filename, start):
+        timestamp = record.get('timestamp', timestamp)
+        if end_timestamp is not None and timestamp > end_timestamp:
+            return
+        if stream_id is not None and record_stream != stream_id:
+            continue
+        if seq_no_bounds and stream_id is None and record_stream != streams[0]:
+            raise ValueError("seq_nos are per stream, {} has more streams than the index shows".format(filename))
+        if end_seq_no is not None and record['seq_no'] > end_seq_no:
+            return
+        if start_seq_no is not None and record['seq_no'] < start_seq_no:
+            continue
+        if start_timestamp is not None and timestamp < start_timestamp:
+            continue
+        yield record
+
+
+def build_index(filename, index_filename=None, every=INDEX_EVERY):
+    """
+    Builds the offset index of an existing capture, saving it next to the capture by default
+    """
+    index_filename = index_filename or filename + '.idx'
+    parse_range(filename, [IndexBuilder(index_filename, every)])
+    return CaptureIndex.load(index_filename)
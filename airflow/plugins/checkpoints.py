@@ -0,0 +1,112 @@
+"""
+Checkpoints of the worker tasks in GCS, for the preemptible fleet (user input PREEMPTIBLE): a
+worker task retried after the preemption of its instance resumes where the preempted one stopped.
+
+- per file: a bin file is marked done once its outputs are uploaded, the retries skip it;
+- per offset (user input CHECKPOINT_BYTES): while a bin file is parsed, its processed json is
+  written in parts (log_parser.PartedJsonOutput), cut at the message boundaries every
+  CHECKPOINT_BYTES bytes of the capture. Every part is uploaded with the offset of the capture it
+  ends at, a retry downloads the parts and parses the capture from that offset only.
+  The state of the integrity checks (integrity.IntegrityChecker) is saved with every part. The
+  files parsed with the other stateful sinks (partitions, order books, bars, offset index) only
+  get the per file checkpoints, their state is not checkpointed.
+
+Layout, under checkpoints/<run id>/<bin file blob name>/, or with the speculative duplicates
+(user input SPECULATIVE_TASKS), under checkpoints/<run id>/_attempts/<task id>/<bin file blob name>/
+so that a duplicate and its original, processing the same files at once, keep their own
+checkpoints (the retries of a task resume its own):
+    state.json      {"done": <bool>, "offset": <int> parsed up to, "parts": [<start offsets>],
+                     "records": <int> written to the parts, "heartbeat": {...} of the parts,
+                     "integrity": {...} IntegrityChecker.state() at the offset, null without the checks}
+    part<start>     part of the processed json from the offset `start` of the capture
+"""
+import re
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+CHECKPOINTS_BLOB = 'checkpoints'
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def run_prefix(run_id):
+    """
+    :return: blob prefix of the checkpoints of a DAG run
+    """
+    return '{}/{}/'.format(CHECKPOINTS_BLOB, _safe(run_id))
+
+
+def delete_run(bucket, run_id):
+    """
+    Deletes the checkpoints of a finished DAG run
+    :return: no. of blobs deleted
+    """
+    blobs = list(bucket.list_blobs(prefix=run_prefix(run_id)))
+    for blob in blobs:
+        bucket.delete_blob(blob.name)
+    return len(blobs)
+
+
+class FileCheckpoint(object):
+    """
+    Checkpoint of the processing of a bin file
+    :param attempt: id of the attempt (e.g. its task id) when several attempts may process the
+        file at once, each one keeping its own checkpoint
+    """
+
+    def __init__(self, bucket, run_id, blob_name, attempt=None):
+        self.bucket = bucket
+        self.blob_name = blob_name
+        self.prefix = run_prefix(run_id)
+        if attempt:
+            self.prefix += '_attempts/{}/'.format(_safe(attempt))
+        self.prefix += blob_name + '/'
+        blob = bucket.get_blob(self.prefix + 'state.json')
+        self.state = {'done': False, 'offset': 0, 'parts': [], 'records': 0, 'heartbeat': {}, 'integrity': None}
+        if blob is not None:
+            self.state.update(json.loads(blob.download_as_string().decode('utf-8')))
+
+    @property
+    def done(self):
+        return self.state['done']
+
+    @property
+    def offset(self):
+        return self.state['offset']
+
+    def save(self):
+        self.bucket.blob(self.prefix + 'state.json').upload_from_string(
+            json.dumps(self.state, sort_keys=True), content_type='application/json')
+
+    def add_part(self, path, start, end, records, heartbeat, integrity=None):
+        """
+        log_parser.PartedJsonOutput callback, uploads the part then moves the checkpoint to its end
+        :param integrity: state of the integrity checks at `end`, see IntegrityChecker.state
+        """
+        self.bucket.blob('{}part{}'.format(self.prefix, start)).upload_from_filename(path)
+        self.state.update(offset=end, records=records, heartbeat=heartbeat, integrity=integrity,
+                          parts=self.state['parts'] + [start])
+        self.save()
+        log.info("{} checkpointed at offset {}".format(self.blob_name, end))
+
+    def download_parts(self, save_filename, part_path):
+        """
+        Downloads the parts checkpointed to `part_path(save_filename, start)`
+        """
+        for start in self.state['parts']:
+            self.bucket.blob('{}part{}'.format(self.prefix, start)).download_to_filename(
+                part_path(save_filename, start))
+
+    def mark_done(self):
+        parts, self.state['parts'] = self.state['parts'], []
+        self.state['done'] = True
+        self.save()
+        for start in parts:
+            try:
+                self.bucket.delete_blob('{}part{}'.format(self.prefix, start))
+            except Exception as e:  # e.g. deleted by a speculative twin, only costs the storage
+                log.warning("Could not delete the part {} of {}: {}".format(start, self.blob_name, e))
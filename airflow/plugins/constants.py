@@ -2,4 +2,12 @@ DESTINATION_BLOB_NAME = 'airflow_home'  # root blob for uploading/syncing AIRFLO
 PROJECT_NAME = "rtheta-central"
 BUCKET_NAME = "central.rtheta.in"
 ZONE = "asia-south1-a"
-# ABHI.CYB@1021@@
\ No newline at end of file
+# celery queue of the tasks running on the instances (unzip, worker and spare tasks), the only one
+# the instances listen on (see gce_conf_script.sh); the permanent worker listens on the default
+# queue only, for the tasks managing the instances
+WORKER_QUEUE = 'worker'
+# ABHI.CYB@1021@@
+
+# size of the ranged requests used while parsing a blob straight from the download stream,
+# must be a multiple of 256 KB (google.cloud.storage requirement for blob.chunk_size)
+STREAM_CHUNK_SIZE = 32 * 256 * 1024
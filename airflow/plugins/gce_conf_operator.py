@@ -1,20 +1,142 @@
 import os
 import time
+import json
+import uuid
+import socket
 import logging
+from datetime import timedelta
 
 from airflow.models import BaseOperator
+from airflow.exceptions import AirflowException
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
 from airflow.operators.sensors import BaseSensorOperator
+from airflow.operators.python_operator import BranchPythonOperator
+
+try:
+    from airflow.exceptions import AirflowRescheduleException  # noqa: F401, airflow >= 1.10.2
+    NATIVE_RESCHEDULE = True
+except ImportError:
+    NATIVE_RESCHEDULE = False
+
+from taskers import xcom_pull, xcom_push, sync_folders, setup_instances, worker_task, upload_profiles, \
+    aggregate_progress, plan_fleet, find_stragglers, restart_preempted, delete_checkpoints, unzip_to_bucket, \
+    input_bytes, local_task, existing_instances
+
+from helper_functions import delete_instances
+
+import metrics
+import profiling
+import user_inputs
+import warm_pool
+import shared_state
+import autoscale
+from constants import *
 
-from taskers import xcom_pull, xcom_push, sync_folders, setup_instances, worker_task
+log = logging.getLogger(__name__)
 
-from helper_functions import unzip, \
-    delete_instances, download_blob_by_name, walktree_to_upload
 
-from constants import *
+def with_metrics(method):
+    """
+    Decorator for the operators' execute/poke: collects the metrics of the call, pushes them to
+    xcom under 'metrics' and exports them (metrics.export). A sensor's are summed up over its pokes.
+    """
+
+    def wrapper(self, context):
+        call_metrics = None
+        try:
+            with metrics.collect() as call_metrics:
+                return method(self, context)
+        finally:
+            if call_metrics is not None:
+                totals = self.__dict__.setdefault('_task_metrics', metrics.Metrics())
+                totals.merge(call_metrics)
+                task_instance = context['ti']
+                xcom_push(context, {'metrics': totals.as_dict()})
+                metrics.export(call_metrics, totals=totals, labels={
+                    'dag_id': getattr(task_instance, 'dag_id', ''),
+                    'task_id': task_instance.task_id,
+                })
+                log.info("metrics: {}".format(json.dumps(call_metrics.as_dict(), sort_keys=True)))
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class SensorNotReady(AirflowException):
+    """
+    Raised by a poke of a sensor in reschedule mode that is not done yet, for it to be retried
+    """
+
+
+class ReschedulingSensorOperator(BaseSensorOperator):
+    """
+    Sensor which can give its worker slot back between the pokes instead of sleeping in it.
+
+    :param mode: 'poke' keeps the slot for the whole sensing, 'reschedule' runs a single poke per
+        task try and frees the slot until the next one, poke_interval later. Airflow >= 1.10.2
+        reschedules the task natively. Older ones only do it for the sensors which emulate it
+        (EMULATE_RESCHEDULE), the others staying in poke mode.
+
+    The emulation fails the not yet done pokes with SensorNotReady, to be retried, the retries
+    covering the timeout. It is a workaround with visible costs, so it is kept to the sensors which
+    would otherwise hold a slot other tasks wait for: every not ready poke is a failed try of the
+    task, up_for_retry in the UI, logged by airflow with its traceback (and here at INFO), and the
+    retry emails are turned off. The sensor must keep its state outside of its own xcom, which is
+    cleared at every try. The failures of the pokes (errors, not SensorNotReady) are counted apart
+    in the shared state (FAILURES_KEY): the task fails for good once they exceed the `retries`
+    given to the operator. They are retried poke_interval later, the retry_delay being the pokes' one.
+    """
+    FAILURES_KEY = 'rescheduling_sensor_failures'
+    EMULATE_RESCHEDULE = False  # reschedule mode on airflow < 1.10.2, see above
 
-log = logging.getLogger(__name__)
+    @apply_defaults
+    def __init__(self, mode='poke', *args, **kwargs):
+        if NATIVE_RESCHEDULE:
+            kwargs['mode'] = mode
+        super(ReschedulingSensorOperator, self).__init__(*args, **kwargs)
+        self.reschedule = mode == 'reschedule' and (NATIVE_RESCHEDULE or self.EMULATE_RESCHEDULE)
+        self.failure_retries = self.retries or 0
+        if self.reschedule and not NATIVE_RESCHEDULE:
+            self.retries = self.failure_retries + int(self.timeout // self.poke_interval) + 1
+            self.retry_delay = timedelta(seconds=self.poke_interval)
+            self.email_on_retry = False  # the retries are the pokes
+
+    def execute(self, context):
+        if not self.reschedule or NATIVE_RESCHEDULE:
+            return super(ReschedulingSensorOperator, self).execute(context)
+        try:
+            done = self.poke(context)
+        except Exception:
+            if self._count_failure(context) > self.failure_retries:
+                self._clear_failures(context)
+                self.retries = 0  # read by the task instance's failure handling: failed, not up for retry
+            raise
+        if not done:
+            message = "{} is not done yet, poked again in {}s".format(self.task_id, self.poke_interval)
+            log.info(message)
+            raise SensorNotReady(message)
+        self._clear_failures(context)
+        log.info("Success criteria met. Exiting.")
+
+    def _failures_key(self, context):
+        return '{}.{}.{}'.format(self.dag_id, self.task_id, context['run_id'])
+
+    def _count_failure(self, context):
+        """
+        :return: no. of failed pokes of this task in the DAG run, this one included
+        """
+        with shared_state.locked(self.FAILURES_KEY) as failures:
+            key = self._failures_key(context)
+            failures[key] = failures.get(key, 0) + 1
+            return failures[key]
+
+    def _clear_failures(self, context):
+        if not shared_state.read(self.FAILURES_KEY):
+            return
+        with shared_state.locked(self.FAILURES_KEY) as failures:
+            failures.pop(self._failures_key(context), None)
 
 
 # TODO: Make these make these functions pluggable for the purpose of testing using docker
@@ -25,8 +147,15 @@ class SyncOperator(BaseOperator):
         self.operator_param = op_param
         super(SyncOperator, self).__init__(*args, **kwargs)
 
+    @with_metrics
     def execute(self, context):
         params = self.operator_param
+        dag_run = context.get('dag_run')
+        inputs = user_inputs.resolve(dag_run.conf if dag_run is not None else None)
+        log.info("user inputs: {}".format(inputs))
+        if inputs['NO_OF_INSTANCES'] != len(params['instance_info']['instances']):
+            log.warning("NO_OF_INSTANCES changed to {}, the DAG runs with {} until it is parsed again".format(
+                inputs['NO_OF_INSTANCES'], len(params['instance_info']['instances'])))
         log.info("Sync in progress...")
 
         # the program must be running in the airflow home thus, airflow_home = current working directory
@@ -37,11 +166,43 @@ class SyncOperator(BaseOperator):
                      ignores=ignores)
         log.info("Sync complete...")
 
+        instance_info = dict(params['instance_info'], machine_type=inputs['MACHINE_TYPE'])
         data = {
-            "instance_info": params['instance_info'],
-            "bin_data_source_blob": params['bin_data_source_blob'],
-            "zip_blob": params['zip_blob'],
+            "instance_info": instance_info,
+            "bin_data_source_blob": inputs['BIN_DATA_SOURCE_BLOB'],
+            "zip_blob": inputs['ZIP_BLOB'],
+            "user_inputs": inputs,
+            "execution_mode": inputs['EXECUTION_MODE'],
         }
+        if data['execution_mode'] == 'auto':
+            run_bytes = input_bytes(inputs)
+            data['execution_mode'] = 'local' if run_bytes <= inputs['LOCAL_MAX_BYTES'] else 'gce'
+            log.info("{:.1f} MB of input, {} execution mode".format(run_bytes / 1e6, data['execution_mode']))
+        if data['execution_mode'] == 'local':
+            # the whole run on this host (LocalOperator), no instances
+            xcom_push(context, data)
+            log.info("xcom data pushed: {}".format(data))
+            return
+        if inputs['AUTOSCALE']:
+            # the fleet of this run, the worker tasks beyond it are no-ops
+            fleet_plan = plan_fleet(inputs, max_instances=len(instance_info['instances']))
+            instance_info['instances'] = instance_info['instances'][:fleet_plan['instances']]
+            instance_info['machine_type'] = fleet_plan['machine_type']
+            data['fleet_plan'] = fleet_plan
+        # a worker task per task slot of the instances, up to the worker tasks of the DAG
+        instance_info['instances'], instance_info['workers'] = autoscale.fleet_slots(
+            instance_info['instances'], instance_info['machine_type'],
+            params.get('worker_tasks', len(params['instance_info']['instances'])))
+        if inputs['PREEMPTIBLE']:
+            instance_info['preemptible'] = True
+        if inputs['WARM_POOL_SIZE']:
+            # the idle instances of the previous runs first, SetupOperator creates the shortfall
+            instances = instance_info['instances']
+            instance_info['code_version'] = warm_pool.code_version()
+            warm_instances = warm_pool.acquire(len(instances), instance_info.get('machine_type', 'n1-standard-1'),
+                                               instance_info['code_version'], inputs['PREEMPTIBLE'])
+            instance_info['instances'] = warm_instances + instances[:len(instances) - len(warm_instances)]
+            instance_info['warm_instances'] = warm_instances
         xcom_push(context, data)
         log.info("xcom data pushed: {}".format(data))
 
@@ -60,49 +221,34 @@ class SyncOperator(BaseOperator):
 #         setup_instances(instances=instance_info['instances'])
 #         log.info("Instances created")
 
-class SetupOperator(BaseSensorOperator):
+class SetupOperator(ReschedulingSensorOperator):
+    """
+    Creates the instances of the run, the first one first for the unzip task. Done in a single
+    poke which waits for the instance operations, so it runs in poke mode (reschedule mode would
+    only free the slot once it is done); it is idempotent (the instances which exist are skipped).
+    The tasks running on the instances wait for them in the WORKER_QUEUE.
+    """
+
     @apply_defaults
     def __init__(self, op_param, *args, **kwargs):
         self.operator_param = op_param
         super(SetupOperator, self).__init__(*args, **kwargs)
 
+    @with_metrics
     def poke(self, context):
-        """
-        creates an instance and pushes its id into xcom under 'created_instances` and returns False.
-        check if the unzip instance has returned its status to be true in xcom and then creates the
-        remaining instances.
-        """
         xcom_data = xcom_pull(context, {
             'sync_task': 'instance_info',
-            'setup_task': 'created_instances',
-            'unzip_task': 'status',
-            'post_unzip_block_task': "started"
         })
         instance_info = xcom_data['sync_task']['instance_info']
-        created_instances = xcom_data['setup_task']['created_instances'] or []
-        unzip_status = xcom_data['unzip_task']['status']
-        post_unzip_block_started = xcom_data['post_unzip_block_task']['started']
         log.info("xcom data received: {}".format(xcom_data))
 
-        if unzip_status == True:
-            create_instances = instance_info['instances']
-            for instance in created_instances:
-                if instance in create_instances:
-                    create_instances.remove(instance)
-            setup_instances(instances=create_instances)
-            xcom_push(context, {'created_instances': instance_info['instances']})
-            if post_unzip_block_started == True:
-                # return true if unzip is complete and the blocking of worker after unzipping has started
-                return True
-        else:
-            if len(created_instances) >= 1:
-                # instance is already
-                return False
-            create_instance = instance_info['instances'][0]
-            setup_instances(instances=create_instance)
-            xcom_push(context, {'created_instances': [create_instance]})
-
-        return False
+        # the ones taken from the warm pool are already up
+        create_instances = [instance for instance in instance_info['instances']
+                            if instance not in instance_info.get('warm_instances', [])]
+        setup_instances(instances=create_instances, machine_type=instance_info.get('machine_type'),
+                        preemptible=instance_info.get('preemptible', False))
+        xcom_push(context, {'created_instances': instance_info['instances']})
+        return True
 
 
 class UnzipOperator(BaseOperator):
@@ -111,30 +257,68 @@ class UnzipOperator(BaseOperator):
         self.operator_param = op_param
         super(UnzipOperator, self).__init__(*args, **kwargs)
 
+    @with_metrics
     def execute(self, context):
         xcom_data = xcom_pull(context, {
             'sync_task': ['instance_info', 'zip_blob', 'bin_data_source_blob'],
-            'setup_task': 'created_instances',
-            'unzip_task': 'status'
         })
-        zip_blob = xcom_data['sync_task']['zip_blob']
-        bin_root_blob = xcom_data['sync_task']['bin_data_source_blob']
         log.info('xcom data received: {}'.format(xcom_data))
-
-        file_paths = download_blob_by_name(source_blob_name=zip_blob, bucket_name=BUCKET_NAME,
-                                           save_file_root=os.path.expanduser('~/zip_bin_log'))
-        unzip_roots = []
-        for path in file_paths:
-            # unzipping the files
-            unzip_root = unzip(path)
-            os.remove(path)  # remove the file
-            walktree_to_upload(tree_root=unzip_root,
-                               root_blob=bin_root_blob)  # TODO: Make this upload faster using parallel uploads
-            unzip_roots.append(unzip_root)
+        unzip_to_bucket(xcom_data['sync_task']['zip_blob'], xcom_data['sync_task']['bin_data_source_blob'])
         xcom_push(context, {'status': True})
         log.info("unzipping complete")
 
 
+class ExecutionModeOperator(BranchPythonOperator):
+    """
+    Follows the `local` task (op_param, 'local_task' by default) in the local execution mode chosen
+    by SyncOperator, the `gce` one ('gce_mode' by default) otherwise
+    """
+
+    @apply_defaults
+    def __init__(self, op_param=None, *args, **kwargs):
+        self.operator_param = dict({'local': 'local_task', 'gce': 'gce_mode'}, **(op_param or {}))
+        kwargs.update(python_callable=self.choose, provide_context=True)
+        super(ExecutionModeOperator, self).__init__(*args, **kwargs)
+
+    def choose(self, **context):
+        mode = xcom_pull(context, {'sync_task': 'execution_mode'})['sync_task']['execution_mode']
+        log.info("execution mode: {}".format(mode))
+        return self.operator_param['local'] if mode == 'local' else self.operator_param['gce']
+
+
+class LocalOperator(BaseOperator):
+    """
+    Runs the unzip and worker tasks of a small run on this host, parsing with a process pool of a
+    process per core (op_param 'processes' to override), without creating any instance
+    """
+
+    @apply_defaults
+    def __init__(self, op_param=None, *args, **kwargs):
+        self.operator_param = op_param or {}
+        super(LocalOperator, self).__init__(*args, **kwargs)
+
+    @with_metrics
+    def execute(self, context):
+        xcom_data = xcom_pull(context, {
+            'sync_task': ['zip_blob', 'bin_data_source_blob', 'user_inputs'],
+        })
+        log.info('xcom data received: {}'.format(xcom_data))
+        inputs = xcom_data['sync_task']['user_inputs']
+        options = {
+            'streaming': inputs['STREAMING'],
+            'compression': inputs['COMPRESSION'],
+            'compression_level': inputs['COMPRESSION_LEVEL'],
+            'index_every': inputs['INDEX_EVERY'],
+            'partition': inputs['PARTITION'],
+            'book_snapshot_interval': inputs['BOOK_SNAPSHOT_INTERVAL'],
+            'bar_interval': inputs['BAR_INTERVAL'],
+            'check_integrity': inputs['CHECK_INTEGRITY'],
+        }
+        local_task(xcom_data['sync_task']['zip_blob'], xcom_data['sync_task']['bin_data_source_blob'],
+                   options, processes=self.operator_param.get('processes'))
+        xcom_push(context, {'status': True})
+
+
 class SleepOperator(BaseOperator):
     @apply_defaults
     def __init__(self, op_param=None, *args, **kwargs):
@@ -148,7 +332,13 @@ class SleepOperator(BaseOperator):
         time.sleep(self.operator_param['sleep_time'])
 
 
-class BlockSensorOperator(BaseSensorOperator):
+class BlockSensorOperator(ReschedulingSensorOperator):
+    """
+    Holds a worker slot of the first instance until the completion task starts, so that the worker
+    tasks are spread one per instance; to be run in poke mode, holding the slot is its purpose.
+    Not needed by process_dag anymore, its worker tasks run in the task slots of the WORKER_QUEUE.
+    """
+
     @apply_defaults
     def __init__(self, op_param, *args, **kwargs):
         self.operator_param = op_param
@@ -172,21 +362,170 @@ class WorkerOperator(BaseOperator):
         self.operator_param = op_param
         super(WorkerOperator, self).__init__(*args, **kwargs)
 
+    @with_metrics
     def execute(self, context):
         log.info("working")
         xcom_data = xcom_pull(context, {
-            'sync_task': ['bin_data_source_blob']
+            'sync_task': ['bin_data_source_blob', 'user_inputs', 'instance_info']
         })
         bin_data_source_blob = xcom_data['sync_task']['bin_data_source_blob']
         log.info("xcom_data: {}".format(xcom_data))
 
-        worker_task(instance_no=self.operator_param['number'],
-                    total_instances=self.operator_param['total'],
-                    bin_data_source_blob=bin_data_source_blob)
-        xcom_push(context, {"status": True})
+        # the run's user inputs, resolved by the sync task, unless set in op_param
+        options = dict((key.lower(), value) for key, value in (xcom_data['sync_task']['user_inputs'] or {}).items())
+        options.update(self.operator_param)
+        # the fleet of the run, smaller than the DAG's fan-out when it is autoscaled
+        options['total'] = fleet_workers(xcom_data['sync_task']['instance_info'])
+        if options['number'] >= options['total']:
+            log.info("Worker task {} is beyond the {} task slots of this run's fleet".format(options['number'],
+                                                                                            options['total']))
+            xcom_push(context, {"complete": True})
+            return
+
+        process_files(self, context, options, xcom_data['sync_task']['bin_data_source_blob'])
+
+
+class WorkerCancelled(Exception):
+    """
+    Raised in a worker task of which the speculative twin processed the files first
+    """
+
+
+def fleet_workers(instance_info):
+    """
+    :return: no. of the worker tasks of the run's fleet (SyncOperator), the ones beyond are no-ops
+    """
+    return instance_info.get('workers', len(instance_info['instances']))
+
+
+def run_state_key(context):
+    """
+    :return: key of the state of the DAG run shared by its tasks (see shared_state.py), e.g. the
+        speculative duplicates of the stragglers
+    """
+    return 'process_dag_run_{}'.format(context['run_id'])
+
+
+def process_files(task, context, options, bin_data_source_blob, only_blobs=None):
+    """
+    Runs worker_task for a worker task or its speculative duplicate, pushing to xcom the 'hostname'
+    it runs on, its 'assigned_blobs', its 'progress' and at the end the 'complete' marker, or
+    'cancelled' if its twin was done first
+    :param options: the run's user inputs, lower cased, and the operator's op_param
+    """
+    xcom_push(context, {'hostname': socket.gethostname()})
+    speculation = options.get('speculative_tasks', 0) > 0
+
+    def push_progress(report):
+        # read by CompletionOperator for the fleet wide throughput and ETA
+        try:
+            xcom_push(context, {'progress': dict(report, reported_at=time.time())})
+        except Exception as e:
+            log.warning("Could not push the progress: {}".format(e))
+        cancelled = []
+        if speculation:
+            try:
+                cancelled = (shared_state.read(run_state_key(context)) or {}).get('cancelled', [])
+            except Exception as e:
+                log.warning("Could not read the run state: {}".format(e))
+        if task.task_id in cancelled:
+            raise WorkerCancelled("{} cancelled, its twin was done first".format(task.task_id))
+
+    def push_assignment(blob_names):
+        xcom_push(context, {'assigned_blobs': blob_names})
+
+    def publish(blob_name):
+        # the first of the twins done with a file uploads its outputs, the other one skips them
+        with shared_state.locked(run_state_key(context)) as state:
+            published = state.setdefault('published', {})
+            owner = published.setdefault(blob_name, task.task_id)
+        return owner == task.task_id
+
+    # opt-in profiling, see profiling.py
+    profile = profiling.profile_mode(options.get('profile'))
+    profile_files = []
+    try:
+        with profiling.profiled(profile, name=task.task_id) as profile_files:
+            worker_task(instance_no=options['number'],
+                        total_instances=options['total'],
+                        bin_data_source_blob=bin_data_source_blob,
+                        streaming=options.get('streaming', False),
+                        compression=options.get('compression'),
+                        compression_level=options.get('compression_level'),
+                        index_every=options.get('index_every'),
+                        partition=options.get('partition', False),
+                        book_snapshot_interval=options.get('book_snapshot_interval'),
+                        bar_interval=options.get('bar_interval'),
+                        check_integrity=options.get('check_integrity', False),
+                        progress=push_progress,
+                        only_blobs=only_blobs,
+                        assignment=push_assignment,
+                        checkpoint_run=context['run_id'] if options.get('preemptible') else None,
+                        checkpoint_bytes=options.get('checkpoint_bytes'),
+                        # a twin may run on the same instance as its original
+                        attempt=task.task_id if speculation else None,
+                        publish=publish if speculation else None)
+    except WorkerCancelled as e:
+        log.info(str(e))
+        xcom_push(context, {"cancelled": True})
+        return
+    finally:
+        # uploaded for the failed runs too, they are the ones worth looking at
+        upload_profiles(profile_files, bin_data_source_blob)
+    # the completion marker CompletionOperator waits for
+    xcom_push(context, {"complete": True})
+
+
+class SpeculativeWorkerOperator(ReschedulingSensorOperator):
+    """
+    Spare worker task: waits for CompletionOperator to assign it the remaining files of a
+    straggler, and processes them. Done once they are processed, or once the worker tasks are all
+    done without it. Waiting in poke mode, it would hold the slot of a worker task.
+    """
+    EMULATE_RESCHEDULE = True
 
+    @apply_defaults
+    def __init__(self, op_param=None, *args, **kwargs):
+        self.operator_param = op_param or {}
+        super(SpeculativeWorkerOperator, self).__init__(*args, **kwargs)
+
+    @with_metrics
+    def poke(self, context):
+        xcom_data = xcom_pull(context, {
+            'sync_task': ['bin_data_source_blob', 'user_inputs', 'instance_info']
+        })
+        instance_info = xcom_data['sync_task']['instance_info']
+        state = shared_state.read(run_state_key(context)) or {}
+        assignment = state.get('assignments', {}).get(self.task_id)
+        if assignment is None:
+            worker_task_ids = ['worker_task' + str(i) for i in range(fleet_workers(instance_info))]
+            workers_data = xcom_pull(context, dict((task_id, ['complete', 'cancelled']) for task_id in worker_task_ids))
+            return all(data['complete'] or data['cancelled'] for data in workers_data.values())
+        if self.task_id in state.get('cancelled', []):
+            log.info("{} was done first".format(assignment['worker']))
+            return True
+
+        log.info("Duplicating {} for its remaining files: {}".format(assignment['worker'], assignment['blobs']))
+        options = dict((key.lower(), value) for key, value in (xcom_data['sync_task']['user_inputs'] or {}).items())
+        options.update(self.operator_param)
+        options.update(number=int(assignment['worker'].replace('worker_task', '')),
+                       total=fleet_workers(instance_info))
+        process_files(self, context, options, xcom_data['sync_task']['bin_data_source_blob'],
+                      only_blobs=assignment['blobs'])
+        return True
+
+
+class CompletionOperator(ReschedulingSensorOperator):
+    """
+    Waits for the completion markers of all the worker tasks, releasing (deleting or parking in the
+    warm pool) every instance as soon as it is done. With spare tasks (op_param 'spare_tasks'), it
+    also assigns the remaining files of the stragglers to them, the first of the two twins to be
+    done winning and the other one being cancelled.
+    Its state lives in the xcom of the other tasks and in the run state (shared_state.py), so it
+    can run in reschedule mode and not hold a worker slot for the whole processing.
+    """
+    EMULATE_RESCHEDULE = True
 
-class CompletionOperator(BaseSensorOperator):
     @apply_defaults
     def __init__(self, op_param, *args, **kwargs):
         self.operator_param = op_param
@@ -220,42 +559,179 @@ class CompletionOperator(BaseSensorOperator):
         #     delete_instances(instances=instance_info['instances'])
         #     log.info("Instances deleted")
 
+    @with_metrics
     def poke(self, context):
         xcom_push(context, {"started": True})
-        # result = super(CompletionOperator, self).poke(context)
         xcom_data = xcom_pull(context, {
-            'sync_task': ['instance_info'],  # 'zip_blob'],
-            # 'setup_task': 'created_instances',
-            # 'unzip_task': 'status'
+            'sync_task': ['instance_info', 'user_inputs'],
         })
         instance_info = xcom_data['sync_task']['instance_info']
-        total_instance = len(instance_info['instances'])
+        inputs = xcom_data['sync_task']['user_inputs']
+        total_instance = fleet_workers(instance_info)
+        worker_task_ids = ['worker_task' + str(i) for i in range(total_instance)]
+        spare_task_ids = ['spare_task' + str(i) for i in range(self.operator_param.get('spare_tasks', 0))]
+        # the state of all the worker tasks in a single query, the poke cost stays flat with the fleet size
+        tasks_data = xcom_pull(context, dict(
+            (task_id, ['complete', 'cancelled', 'progress', 'hostname', 'assigned_blobs'])
+            for task_id in worker_task_ids + spare_task_ids))
+
+        fleet_progress = aggregate_progress([tasks_data[task_id]['progress'] for task_id in worker_task_ids],
+                                            total_instance)
+        xcom_push(context, {'fleet_progress': fleet_progress})
+        log.info("fleet progress: {}".format(json.dumps(fleet_progress, sort_keys=True)))
+
+        with shared_state.locked(run_state_key(context)) as state:
+            result, actions = self.coordinate(state, tasks_data, worker_task_ids, spare_task_ids, instance_info,
+                                              inputs)
+        # the instance operations take minutes, they run once the run state is saved and its lock released
+        self.apply(context, actions, instance_info, inputs)
+        if result:
+            shared_state.delete(run_state_key(context))
+            if instance_info.get('preemptible'):
+                delete_checkpoints(context['run_id'])
+            xcom_push(context, {'status': True})
+        return result
+
+    def coordinate(self, state, tasks_data, worker_task_ids, spare_task_ids, instance_info, inputs):
+        """
+        One round of the coordination of the worker tasks, updating the run state. Only decides on
+        the instance operations, see `apply`
+        :return: True once every worker task (or its twin) is done and all the instances are to be
+            released; the instance operations to apply, see `apply`
+        """
+        assignments = state.setdefault('assignments', {})  # spare task id -> {'worker': task id, 'blobs': [...]}
+        cancelled = state.setdefault('cancelled', [])  # task ids of the twins done second
+        released = state.setdefault('released', [])  # instances deleted or parked in the warm pool
+        extra_instances = state.setdefault('extra_instances', [])  # created for the speculative duplicates
+        # the instance operations decided but not done yet, applied again until they succeed
+        creating = state.setdefault('creating', [])
+        releasing = state.setdefault('releasing', [])
+        actions = {'restart': [], 'create': creating, 'release': releasing}
+        twins = dict((assignment['worker'], spare) for spare, assignment in assignments.items())
+
+        def finished(task_id):
+            return tasks_data[task_id]['complete'] == True or tasks_data[task_id]['cancelled'] == True
+
+        # a worker is done when it or its twin is complete, the other one is cancelled
         count = 0
-        for i in range(total_instance):
-            task_id = 'worker_task' + str(i)
-            work_status = xcom_pull(context, {task_id: 'complete'})[task_id]['complete']
-            if work_status == True:
+        for task_id in worker_task_ids:
+            pair = [twin for twin in (task_id, twins.get(task_id)) if twin]
+            if any(tasks_data[twin]['complete'] == True for twin in pair):
                 count += 1
+                for twin in pair:
+                    if not finished(twin) and twin not in cancelled:
+                        log.info("cancelling {}, its twin was done first".format(twin))
+                        cancelled.append(twin)
+        log.info("count: {}, total_instances: {} ".format(count, len(worker_task_ids)))
+
+        # speculative duplicates of the stragglers, on the free spare tasks
+        free_spares = [task_id for task_id in spare_task_ids if task_id not in assignments]
+        if free_spares and count < len(worker_task_ids):
+            reports = [tasks_data[task_id]['progress'] if task_id not in twins else None
+                       for task_id in worker_task_ids]
+            for i in find_stragglers(reports, inputs['SPECULATION_SLOWDOWN'], inputs['SPECULATION_MIN_SECONDS']):
+                task_id = worker_task_ids[i]
+                assigned_blobs = tasks_data[task_id]['assigned_blobs']
+                if not free_spares or not assigned_blobs:
+                    continue
+                spare = free_spares.pop(0)
+                # the file being parsed is parsed again by the twin
+                assignments[spare] = {'worker': task_id,
+                                      'blobs': assigned_blobs[reports[i]['files_done']:]}
+                log.info("{} is a straggler, duplicated on {}: {}".format(task_id, spare, assignments[spare]))
+                metrics.incr('worker.speculated')
+
+        fleet = instance_info['instances'] + extra_instances
+        if instance_info.get('preemptible'):
+            # the worker tasks lost with them are retried, resuming from their checkpoints
+            actions['restart'] = [instance for instance in fleet if instance not in released]
+        busy = set(data['hostname'] for task_id, data in tasks_data.items()
+                   if data['hostname'] and not finished(task_id))
+        freed = [instance for instance in fleet if instance not in busy and instance not in released and
+                 any(data['hostname'] == instance and finished(task_id) for task_id, data in tasks_data.items())]
+        if count == len(worker_task_ids):
+            if busy.intersection(fleet):
+                log.info("waiting for the cancelled twins to stop on {}".format(sorted(busy.intersection(fleet))))
+                return False, actions
+            remaining = [instance for instance in fleet if instance not in released]
+            releasing.extend(remaining)
+            released.extend(remaining)
+            return True, actions
+
+        # the instances done are released as soon as no task can be waiting for them
+        if all(tasks_data[task_id]['hostname'] or finished(task_id) for task_id in worker_task_ids):
+            pending = [spare for spare in assignments
+                       if not tasks_data[spare]['hostname'] and not finished(spare) and spare not in cancelled]
+            booting = [instance for instance in extra_instances if instance not in released and
+                       not any(data['hostname'] == instance for data in tasks_data.values())]
+            shortfall = len(pending) - len(freed) - len(booting)
+            if shortfall > 0:
+                new_instances = ['worker-' + str(uuid.uuid4()).replace('-', '') for _ in range(shortfall)]
+                log.info("creating {} for the speculative duplicates".format(new_instances))
+                creating.extend(new_instances)
+                extra_instances.extend(new_instances)
+            releasing.extend(freed[len(pending):])
+            released.extend(freed[len(pending):])
+        return False, actions
+
+    def apply(self, context, actions, instance_info, inputs):
+        """
+        Applies the instance operations decided by `coordinate`, outside of the run state's lock:
+        restarts the preempted instances, creates the ones for the speculative duplicates and
+        releases the ones done. The created and released ones are then taken out of the run state,
+        the others are tried again at the next poke.
+        """
+        if actions['restart']:
+            restart_preempted(actions['restart'])
+        if actions['create']:
+            setup_instances(instances=actions['create'], machine_type=instance_info.get('machine_type'),
+                            preemptible=instance_info.get('preemptible', False))
+        if actions['release']:
+            self.release(actions['release'], instance_info, inputs)
+        if actions['create'] or actions['release']:
+            with shared_state.locked(run_state_key(context)) as state:
+                for key in ('create', 'release'):
+                    state_key = 'creating' if key == 'create' else 'releasing'
+                    state[state_key] = [instance for instance in state.get(state_key, [])
+                                        if instance not in actions[key]]
+
+    def release(self, instances, instance_info, inputs):
+        """
+        Parks up to WARM_POOL_SIZE instances for the next runs and deletes the others, never the one
+        running this
+        """
+        if not instances:
+            return
+        log.info("releasing the instances {}".format(instances))
+        to_delete = warm_pool.release(instances, instance_info.get('machine_type', 'n1-standard-1'),
+                                      instance_info.get('code_version'), inputs['WARM_POOL_SIZE'],
+                                      instance_info.get('preemptible', False))
+        if to_delete:
+            # a release tried again may find some of them deleted already
+            existing = existing_instances()
+            to_delete = [instance for instance in to_delete if instance in existing]
+        delete_instances(instances=to_delete)
+        metrics.incr('gce.instances_released', len(instances))
+
+
+class WarmPoolReaperOperator(BaseOperator):
+    """
+    Deletes the instances of the warm pool idle for more than WARM_POOL_TTL, or booted with an
+    older version of the code (see warm_pool.py)
+    """
 
-        log.info("count: {}, total_instances: {} ".format(count, total_instance))
-        if count == total_instance:
-            xcom_push(context, {'status': True})
-            result = True
-        else:
-            result = False
+    @apply_defaults
+    def __init__(self, op_param=None, *args, **kwargs):
+        self.operator_param = op_param or {}
+        super(WarmPoolReaperOperator, self).__init__(*args, **kwargs)
 
-        if result:
-            log.info("deleting instances")
-            xcom_data = xcom_pull(context, {
-                'sync_task': 'instance_info',
-                'setup_task': 'created_instances',
-                'unzip_task': 'status'
-            })
-            instance_info = xcom_data['sync_task']['instance_info']
-            log.info("Instance info received: " + str(instance_info))
-            delete_instances(instances=instance_info['instances'])
-            log.info("Instances deleted")
-        return result
+    @with_metrics
+    def execute(self, context):
+        ttl = self.operator_param.get('ttl', user_inputs.cached()['WARM_POOL_TTL'])
+        expired = warm_pool.expire(ttl, version=warm_pool.code_version())
+        log.info("Reaping the idle instances: {}".format(expired))
+        delete_instances(instances=expired)
+        metrics.incr('gce.instances_reaped', len(expired))
 
 
 class GcePlugin(AirflowPlugin):
@@ -267,6 +743,10 @@ class GcePlugin(AirflowPlugin):
         UnzipOperator,
         BlockSensorOperator,
         WorkerOperator,
+        SpeculativeWorkerOperator,
+        ExecutionModeOperator,
+        LocalOperator,
         # WorkerBlockSensorOperator,
-        CompletionOperator
+        CompletionOperator,
+        WarmPoolReaperOperator,
     ]
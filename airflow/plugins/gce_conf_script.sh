@@ -28,6 +28,8 @@ pip install --upgrade google-api-python-client
 pip install python-dotenv
 pip install google-auth-httplib2
 pip install google-cloud
+pip install zstandard        # only needed for zstd compressed output
+pip install cython            # native decoding loop of log_parser, falls back to python without it
 
 #export AIRFLOW_HOME='/home/rtheta/airflow'
 #export AIRFLOW_HOME = "{AIRFLOW_HOME}"      # this will be filled from python
@@ -36,6 +38,8 @@ pip install google-cloud
 # downloading data from buckets
 #wget https://storage.googleapis.com/central.rtheta.in/instance_blob_download.py
 wget https://storage.googleapis.com/central.rtheta.in/instance_blob_download.py
+# synced by SyncOperator with the rest of the airflow home; instance_blob_download.py works without it
+wget -O blob_cache.py https://storage.googleapis.com/central.rtheta.in/airflow_home/plugins/blob_cache.py || rm -f blob_cache.py
 python instance_blob_download.py
 
 export C_FORCE_ROOT=true
@@ -50,4 +54,8 @@ export C_FORCE_ROOT=true
 
 pip install airflow    # Required!! otherwise it gives some error =_=
 cd $AIRFLOW_HOME
-airflow worker
+# the native decoding loop of log_parser built once here, instead of by pyximport in the first task parsing
+(cd plugins && cythonize -i -X language_level=2 log_parser_speedups.pyx) || echo "log_parser_speedups not built"
+# one task slot per vCPU, the DAG lays out a worker task per slot; WORKER_QUEUE is exported by create_instance
+export AIRFLOW__CELERY__CELERYD_CONCURRENCY=`nproc`
+airflow worker -q $WORKER_QUEUE
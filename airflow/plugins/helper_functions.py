@@ -1,11 +1,10 @@
 import os
 import time
+import errno
 from stat import *
 
-from google.cloud import storage
-from googleapiclient import discovery
-
-import log_parser
+import blob_cache
+import metrics
 from constants import *
 
 os.environ['PROJECT_NAME'] = "rtheta-central"
@@ -55,19 +54,21 @@ def wait_for_operation(compute, project, zone, operation):
     Waits for an Google cloud function to complete
     """
     print('Waiting for operation to finish...')
-    while True:
-        result = compute.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
+    with metrics.timer('gce.wait_for_operation'):
+        while True:
+            result = compute.zoneOperations().get(
+                project=project,
+                zone=zone,
+                operation=operation).execute()
+            metrics.incr('gce.operation_polls')
 
-        if result['status'] == 'DONE':
-            print("done.")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
+            if result['status'] == 'DONE':
+                print("done.")
+                if 'error' in result:
+                    raise Exception(result['error'])
+                return result
 
-        time.sleep(1)
+            time.sleep(1)
 
 
 def get_airflow_configs():
@@ -126,9 +127,12 @@ def get_airflow_configs():
     return exported_configs
 
 
-def create_instance(compute, project, zone, name, bucket):
+def create_instance(compute, project, zone, name, bucket, machine_type='n1-standard-1', preemptible=False):
     """
-    Creates a compute instance on the google cloud platform
+    Creates a compute instance on the google cloud platform. Its airflow worker takes the tasks of
+    the WORKER_QUEUE, as many at a time as it has vCPUs (see gce_conf_script.sh)
+    :param preemptible: a preemptible instance, several times cheaper but stopped whenever the
+        capacity is needed (and after 24h). It is not restarted by GCE, see restart_instance.
     """
     # Get the latest Ubuntu 16.04 image.
     image_response = compute.images().getFromFamily(
@@ -136,11 +140,11 @@ def create_instance(compute, project, zone, name, bucket):
     source_disk_image = image_response['selfLink']
 
     # Configure the machine
-    machine_type = "zones/%s/machineTypes/n1-standard-1" % zone
+    machine_type = "zones/%s/machineTypes/%s" % (zone, machine_type)
 
     startup_script = open(os.path.join(os.path.dirname(__file__), 'gce_conf_script.sh'), 'r').read()
     become_superuser = "#!/usr/bin/env bash\n" + "sudo su\n"  # this is done here  because after changing the user, all the environment variables are gone
-    temp_string = "export AIRFLOW_HOME=" + os.getcwd() + '\n'
+    temp_string = "export AIRFLOW_HOME=" + os.getcwd() + '\n' + "export WORKER_QUEUE=" + WORKER_QUEUE + '\n'
     overrided_configs = get_airflow_configs()
     startup_script = become_superuser + temp_string + overrided_configs + startup_script
 
@@ -198,6 +202,12 @@ def create_instance(compute, project, zone, name, bucket):
             }]
         }
     }
+    if preemptible:
+        config['scheduling'] = {
+            'preemptible': True,
+            'onHostMaintenance': 'TERMINATE',
+            'automaticRestart': False,
+        }
 
     return compute.instances().insert(
         project=project,
@@ -215,6 +225,48 @@ def delete_instance(compute, project, zone, name):
         instance=name).execute()
 
 
+def instance_statuses(compute, project, zone):
+    """
+    :return: {name: status} of the instances of the zone
+    """
+    response = compute.instances().list(project=project, zone=zone).execute()
+    return dict((item['name'], item.get('status')) for item in response.get('items', []))
+
+
+def stopped_instances(compute, project, zone, names):
+    """
+    :return: the names of the instances which are stopped (TERMINATED), e.g. preempted
+    """
+    statuses = instance_statuses(compute, project, zone)
+    return [name for name in names if statuses.get(name) == 'TERMINATED']
+
+
+def restart_instance(compute, project, zone, name):
+    """
+    Starts a stopped instance again, its startup script runs at every boot
+    """
+    return compute.instances().start(
+        project=project,
+        zone=zone,
+        instance=name).execute()
+
+
+def cpu_quota_left(compute, project, zone):
+    """
+    :return: vCPUs left in the CPUS quota of the zone's region, None if it could not be read
+    """
+    region = zone.rsplit('-', 1)[0]
+    try:
+        quotas = compute.regions().get(project=project, region=region).execute().get('quotas', [])
+    except Exception as e:
+        print("Could not read the quotas of {}: {}".format(region, e))
+        return None
+    for quota in quotas:
+        if quota.get('metric') == 'CPUS':
+            return int(quota['limit'] - quota.get('usage', 0))
+    return None
+
+
 def list_instances(compute, project, zone):
     """
     list all the active instances
@@ -232,18 +284,25 @@ def sleep(seconds=0):
 
 def make_dirs(path):
     """
-    Checks for a path it is exists if not, it creates one
+    Creates the directory and its parents if missing; safe with other tasks (e.g. the worker
+    tasks of an instance) creating the same directories at once
     """
-    if os.path.exists(path):
-        return
-    else:
-        make_dirs(os.path.dirname(path))
-        os.mkdir(path)
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
 
 
 def upload_blob(source_file_path, destination_blob_name=None, bucket_name=BUCKET_NAME,
-                tree_root=None, root_blob=None, *args, **kwargs):
-    """Uploads a file to the bucket"""
+                tree_root=None, root_blob=None, content_type=None, content_encoding=None, *args, **kwargs):
+    """
+    Uploads a file to the bucket
+    :param content_encoding: stored as the `Content-Encoding` of the blob, e.g. 'gzip' for gzipped
+        files so that the storage serves them decompressed to the clients not accepting gzip
+    """
+    from google.cloud import storage
+
     storage_client = storage.Client()
     bucket = storage_client.get_bucket(bucket_name)
     if destination_blob_name is None:
@@ -256,14 +315,22 @@ def upload_blob(source_file_path, destination_blob_name=None, bucket_name=BUCKET
                                              get_joinable_rear_path(rel_file_path))  # destination blob to upload file
 
     blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(source_file_path)
+    if content_encoding:
+        blob.content_encoding = content_encoding
+    with metrics.timer('gcs.upload'):
+        blob.upload_from_filename(source_file_path, content_type=content_type)
+    metrics.incr('gcs.files_uploaded')
+    metrics.incr('gcs.bytes_uploaded', os.path.getsize(source_file_path))
 
 
 def download_blob_by_name(source_blob_name, bucket_name, save_file_root=""):
-    """Uploads a file to the bucket."""
+    """Downloads the blobs containing `source_blob_name` (read through the local blob cache)"""
+    from google.cloud import storage
+
     storage_client = storage.Client()
     bucket = storage_client.get_bucket(bucket_name)
-    blobs = bucket.list_blobs()
+    with metrics.timer('gcs.list'):
+        blobs = list(bucket.list_blobs())
     file_paths = []
     for blob in blobs:
         if blob.name.__contains__(source_blob_name):
@@ -273,7 +340,10 @@ def download_blob_by_name(source_blob_name, bucket_name, save_file_root=""):
                 continue
             file_path = os.path.join(save_file_root, valid_file_name)
             make_dirs(os.path.dirname(file_path))  # for creating the path recursively
-            blob.download_to_filename(file_path)
+            with metrics.timer('gcs.download'):
+                blob_cache.download(blob, file_path)
+            metrics.incr('gcs.files_downloaded')
+            metrics.incr('gcs.bytes_downloaded', os.path.getsize(file_path))
             file_paths.append(file_path)
     return file_paths
 
@@ -316,16 +386,13 @@ def assign_files(instance_no, total_instances, bin_data_source_blob):
     """
     assigns files to the instances
     """
+    from google.cloud import storage
+
     storage_client = storage.Client()
     bucket = storage_client.get_bucket(os.environ.get("BUCKET_NAME", ""))
-    # # for listing the blobs
-    blobs_iter = bucket.list_blobs()
-    blob_list = list(blobs_iter)
-
-    req_blob = []
-    for blob in blob_list:
-        if blob.name.__contains__(bin_data_source_blob):
-            req_blob.append(blob)
+    # the bin files only: the processed data (processed/<bin_data_source_blob>/...) uploaded by the
+    # other workers meanwhile would change the split for the retries of a worker
+    req_blob = list(bucket.list_blobs(prefix=bin_data_source_blob + '/'))
 
     q = len(req_blob) // total_instances
     r = len(req_blob) % total_instances
@@ -346,10 +413,24 @@ def assign_files(instance_no, total_instances, bin_data_source_blob):
     return [blob for blob in req_blob[start:end]]
 
 
+def get_blobs(names, bin_data_source_blob):
+    """
+    :return: the blobs of the names under `bin_data_source_blob`, in the order of the names
+    """
+    from google.cloud import storage
+
+    storage_client = storage.Client()
+    bucket = storage_client.get_bucket(os.environ.get("BUCKET_NAME", ""))
+    blobs = dict((blob.name, blob) for blob in bucket.list_blobs(prefix=bin_data_source_blob))
+    return [blobs[name] for name in names if name in blobs]
+
+
 def sync_folders(blob_name=DESTINATION_BLOB_NAME):
     """
     To sync the folders with the cloud storage for the instances to pull
     """
+    from google.cloud import storage
+
     # sleep()
     storage_client = storage.Client()
     bucket = storage_client.get_bucket(os.environ.get("BUCKET_NAME", ""))
@@ -364,6 +445,8 @@ def setup_instances(instances):
     """
     will create instances, has to run on local/permanent machine
     """
+    from googleapiclient import discovery
+
     if not isinstance(instances, list):
         instances = [instances]
     project = os.environ.get("PROJECT_NAME", "")
@@ -384,6 +467,8 @@ def worker_task(instance_no, total_instances, bin_data_source_blob, logger=None)
     be used by the machines to process the data like file numbers
     instance_no belongs to [0, total_instances - 1]
     """
+    import log_parser
+
     if logger:
         log_info = logger.info
     else:
@@ -433,6 +518,8 @@ def delete_instances(instances):
     """
     has to run on the local/permanent machine to destroy the instances after completion of work.
     """
+    from googleapiclient import discovery
+
     sleep()
     project = os.environ.get("PROJECT_NAME", "")
     zone = os.environ.get("ZONE", "")
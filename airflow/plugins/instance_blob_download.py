@@ -1,6 +1,13 @@
 import os
 from google.cloud import storage
 
+try:
+    # downloaded next to this script by the startup script, missing on older setups
+    from blob_cache import download
+except ImportError:
+    def download(blob, file_path):
+        blob.download_to_filename(file_path)
+
 DESTINATION_BLOB_NAME = 'airflow_home'
 
 airflow_home = os.environ.get('AIRFLOW_HOME')
@@ -24,7 +31,7 @@ def download_blob(bucket_name='central.rtheta.in', source_blob_name=DESTINATION_
             rel_file_path = blob.name.replace(source_blob_name + '/', "")
             file_path = os.path.join(airflow_home, rel_file_path)
             make_dirs(os.path.dirname(file_path))  # for creating the path recursively
-            blob.download_to_filename(file_path)
+            download(blob, file_path)
             print (file_path)
 
 
@@ -0,0 +1,188 @@
+import json
+import logging
+from array import array
+from bisect import bisect_right
+
+from log_parser import INT64_TYPECODE
+
+log = logging.getLogger(__name__)
+
+STREAMS = 1 << 16  # stream_id is a c_short
+MAX_SAMPLES = 100  # no. of gaps/out of order messages kept as examples in the summary
+MAX_OPEN_GAPS = 1024  # per stream, the seq_no ranges of the latest gaps kept for the late messages filling them
+# the per stream arrays of IntegrityChecker, with their initial value, saved by `state`
+STATE_COLUMNS = ('last_seq', 'first_seq', 'gaps', 'missing', 'duplicates', 'out_of_order', 'out_of_order_runs',
+                 'out_of_order_last', 'filled')
+STATE_DEFAULTS = (-1, -1, 0, 0, 0, 0, 0, -1, 0)
+
+
+class IntegrityChecker(object):
+    """
+    Checks the seq_no continuity of every stream_id of a capture, and the heartbeats'
+    last_seq_no against it, while the capture is being parsed (see StreamParser's `integrity`).
+
+    The last seq_no of every stream is kept in an array indexed by the stream_id. The parser
+    itself advances it for the in-order messages, the common case, and calls `check` only for
+    the rest, so that the check adds close to nothing to the parse time.
+
+    Reported per stream: gaps (and the no. of missing seq_nos), duplicates, out of order
+    messages (seq_no lower than the last one seen) and out of order runs (blocks of consecutive
+    seq_nos arriving late), plus the heartbeats announcing seq_nos never received. The seq_no
+    ranges of the gaps (the latest MAX_OPEN_GAPS of a stream) are kept, so that the out of order
+    messages filling them are not counted missing (`filled`).
+    The summary is saved as json to `save_filename` on close.
+    """
+
+    def __init__(self, save_filename=None, name=''):
+        self.save_filename = save_filename
+        self.name = name
+        self.last_seq = array(INT64_TYPECODE, [-1]) * STREAMS  # -1: stream not seen yet
+        self.first_seq = array(INT64_TYPECODE, [-1]) * STREAMS
+        self.gaps = array(INT64_TYPECODE, [0]) * STREAMS
+        self.missing = array(INT64_TYPECODE, [0]) * STREAMS
+        self.duplicates = array(INT64_TYPECODE, [0]) * STREAMS
+        self.out_of_order = array(INT64_TYPECODE, [0]) * STREAMS
+        self.out_of_order_runs = array(INT64_TYPECODE, [0]) * STREAMS
+        self.out_of_order_last = array(INT64_TYPECODE, [-1]) * STREAMS
+        self.filled = array(INT64_TYPECODE, [0]) * STREAMS
+        self.open_gaps = {}  # stream -> [from, to] seq_no ranges of its gaps still missing, in order
+        self.heartbeat_mismatches = 0
+        self.samples = []
+        self.summary = None
+
+    def check(self, offset, header, record):
+        """
+        Accounts a message that is not simply the next one of its stream
+        """
+        stream = header.stream_id & 0xffff
+        seq_no = header.seq_no
+        last = self.last_seq[stream]
+
+        if last == -1:
+            self.first_seq[stream] = seq_no
+            self.last_seq[stream] = seq_no
+        elif seq_no == last + 1:
+            self.last_seq[stream] = seq_no
+        elif seq_no > last:
+            self.gaps[stream] += 1
+            self.missing[stream] += seq_no - last - 1
+            self.last_seq[stream] = seq_no
+            self._sample('gap', header, offset, last + 1, seq_no - 1)
+            open_gaps = self.open_gaps.setdefault(stream, [])
+            open_gaps.append([last + 1, seq_no - 1])
+            if len(open_gaps) > MAX_OPEN_GAPS:
+                del open_gaps[0]
+        elif seq_no == last:
+            self.duplicates[stream] += 1
+        else:
+            self.out_of_order[stream] += 1
+            if self._fill(stream, seq_no):
+                self.missing[stream] -= 1
+                self.filled[stream] += 1
+            if seq_no != self.out_of_order_last[stream] + 1:
+                self.out_of_order_runs[stream] += 1
+                self._sample('out_of_order', header, offset, seq_no, last)
+            self.out_of_order_last[stream] = seq_no
+
+        if header.msg_type == b'Z' and record['last_seq_no'] > last:
+            # heartbeat announcing the messages which never arrived
+            self.heartbeat_mismatches += 1
+            self._sample('heartbeat', header, offset, last + 1, record['last_seq_no'])
+
+    def _fill(self, stream, seq_no):
+        """
+        Removes a late seq_no from the open gaps of its stream
+        :return: True when it was in one of them
+        """
+        open_gaps = self.open_gaps.get(stream)
+        if not open_gaps:
+            return False
+        pos = bisect_right(open_gaps, [seq_no, float('inf')]) - 1  # the last gap from seq_no or before
+        if pos < 0 or not open_gaps[pos][0] <= seq_no <= open_gaps[pos][1]:
+            return False
+        gap = open_gaps[pos]
+        if gap[0] == gap[1]:
+            del open_gaps[pos]
+        elif seq_no == gap[0]:
+            gap[0] += 1
+        elif seq_no == gap[1]:
+            gap[1] -= 1
+        else:
+            open_gaps.insert(pos + 1, [seq_no + 1, gap[1]])
+            gap[1] = seq_no - 1
+        return True
+
+    def state(self):
+        """
+        :return: json serializable state of the checks so far, of the streams seen only, to resume
+            them with `restore` (e.g. from a checkpoint, see checkpoints.py)
+        """
+        columns = [getattr(self, name) for name in STATE_COLUMNS]
+        return {
+            'streams': dict((str(stream), [column[stream] for column in columns]) for stream in range(STREAMS)
+                            if self.last_seq[stream] != -1 or self.first_seq[stream] != -1),
+            'open_gaps': dict((str(stream), open_gaps) for stream, open_gaps in self.open_gaps.items() if open_gaps),
+            'heartbeat_mismatches': self.heartbeat_mismatches,
+            'samples': list(self.samples),
+        }
+
+    def restore(self, state):
+        """
+        Resumes the checks from a `state`; the arrays are updated in place, the parser's
+        decoding loop holding on to last_seq
+        """
+        columns = [getattr(self, name) for name in STATE_COLUMNS]
+        for column, default in zip(columns, STATE_DEFAULTS):
+            column[:] = array(INT64_TYPECODE, [default]) * STREAMS
+        for stream, values in state['streams'].items():
+            for column, value in zip(columns, values):
+                column[int(stream)] = value
+        self.open_gaps = dict((int(stream), [list(gap) for gap in open_gaps])
+                              for stream, open_gaps in state.get('open_gaps', {}).items())
+        self.heartbeat_mismatches = state['heartbeat_mismatches']
+        self.samples = list(state['samples'])
+
+    def _sample(self, kind, header, offset, start, end):
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append({
+                'kind': kind,
+                'stream_id': header.stream_id,
+                'offset': offset,
+                'from': start,
+                'to': end,
+            })
+
+    def close(self):
+        streams = {}
+        for stream in range(STREAMS):
+            if self.first_seq[stream] == -1 and self.last_seq[stream] == -1:
+                continue
+            # the late messages filling the gaps are in the range, the others come on top of it
+            in_range = self.last_seq[stream] - self.first_seq[stream] + 1 - self.missing[stream]
+            streams[str(stream)] = {
+                'first_seq_no': self.first_seq[stream],
+                'last_seq_no': self.last_seq[stream],
+                'messages': in_range + self.duplicates[stream] + self.out_of_order[stream] - self.filled[stream],
+                'gaps': self.gaps[stream],
+                'missing': self.missing[stream],
+                'duplicates': self.duplicates[stream],
+                'out_of_order': self.out_of_order[stream],
+                'out_of_order_runs': self.out_of_order_runs[stream],
+                'filled': self.filled[stream],
+            }
+        self.summary = {
+            'name': self.name,
+            'ok': not (any(sum(column) for column in (self.gaps, self.duplicates, self.out_of_order))
+                       or self.heartbeat_mismatches),
+            'streams': streams,
+            'heartbeat_mismatches': self.heartbeat_mismatches,
+            'samples': self.samples,
+        }
+        if not self.summary['ok']:
+            log.warning("Integrity issues in {}: {}".format(self.name, json.dumps(streams)))
+        if self.save_filename:
+            with open(self.save_filename, 'w') as summary_file:
+                json.dump(self.summary, summary_file)
+
+    def paths(self):
+        return [self.save_filename] if self.save_filename else []
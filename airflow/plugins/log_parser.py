@@ -1,5 +1,18 @@
 from ctypes import *
+from array import array
+import gzip
 import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import time
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
 
 
 class OrderPayload(LittleEndianStructure):
@@ -43,93 +56,628 @@ class StreamHeader(LittleEndianStructure):
     ]
 
 
-def main(logger=None, filename='test.bin', save_filename=""):
-    heartbeat = {}  # TODO: ask about the frequency of heartbeat message and its usage
-    arr = []
-    counter = 0
-    infile = open(filename, 'rb')
-    bin_data = infile.read()
-    header = StreamHeader()
-    header_size = sizeof(StreamHeader)
-    # import pdb; pdb.set_trace()
-    while bin_data:
-        counter += 1
-        iter_data = {}
-        # Abuse ctypes to initialize from a string
-        bb = create_string_buffer(bin_data)
-        memmove(addressof(header), addressof(bb), header_size)
-
-        iter_data['msg_type'] = header.msg_type
-        iter_data['seq_no'] = header.seq_no
-
-        if header.msg_type == 'Z':
-            # print "Received HeartBeat Message"
-            bb = create_string_buffer(bin_data[header_size:])
-            packet = HeartBeatPayload()
-            memmove(addressof(packet), addressof(bb), sizeof(packet))
-            # print "Heartbeat {} sq:{}".format(header.msg_type, packet.last_seq_no)
-
-            heartbeat['msg_type'] = 'Z'
-            heartbeat['last_seq_no'] = packet.last_seq_no
-
-        elif header.msg_type == 'N' or header.msg_type == 'X' or header.msg_type == 'M':
-            # print "Received Order Message"
-            bb = create_string_buffer(bin_data[header_size:])
-            packet = OrderPayload()
-            memmove(addressof(packet), addressof(bb), sizeof(packet))
-            iter_data['order_id'] = packet.order_id
-            iter_data['token'] = packet.token
-            iter_data['order_type'] = packet.order_type
-            iter_data['price'] = packet.price
-            iter_data['quantity'] = packet.quantity
-
-        elif header.msg_type == 'T':
-            # print "Received Trade Message"
-            bb = create_string_buffer(bin_data[header_size:])
-            packet = TradePayload()
-            memmove(addressof(packet), addressof(bb), sizeof(packet))
-            iter_data['buy_order_id'] = packet.buy_order_id
-            iter_data['sell_order_id'] = packet.sell_order_id
-            iter_data['token'] = packet.token
-            iter_data['price'] = packet.price
-            iter_data['quantity'] = packet.quantity
-
-        elif header.msg_type == 'G' or header.msg_type == 'H' or header.msg_type == 'J':
-            # print "Received Spread Order Message"
-            bb = create_string_buffer(bin_data[header_size:])
-            packet = OrderPayload()
-            memmove(addressof(packet), addressof(bb), sizeof(packet))
-            iter_data['order_id'] = packet.order_id
-            iter_data['token'] = packet.token
-            iter_data['order_type'] = packet.order_type
-            iter_data['price'] = packet.price
-            iter_data['quantity'] = packet.quantity
-
-        elif header.msg_type == 'K':
-            # print "Received Spread Trade Message"
-            bb = create_string_buffer(bin_data[header_size:])
-            packet = TradePayload()
-            memmove(addressof(packet), addressof(bb), sizeof(packet))
-            iter_data['buy_order_id'] = packet.buy_order_id
-            iter_data['sell_order_id'] = packet.sell_order_id
-            iter_data['token'] = packet.token
-            iter_data['price'] = packet.price
-            iter_data['quantity'] = packet.quantity
+HEADER_SIZE = sizeof(StreamHeader)
+READ_CHUNK_SIZE = 8 * 1024 * 1024  # bytes read from a local capture per feed
+WRITE_BATCH_SIZE = 4096  # no. of json records buffered before hitting the output file
+PROGRESS_INTERVAL = 10.0  # min. seconds between two progress reports
+
+# file name suffix of the output for every supported compression
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+DEFAULT_COMPRESSION_LEVELS = {
+    'gzip': 6,
+    'zstd': 3,
+}
+
+INDEX_EVERY = 4096  # default no. of messages between two entries of the offset index
+INDEX_MAGIC = b'BINIDX02'
+INDEX_MAGIC_V1 = b'BINIDX01'  # without the stream_ids column, still read by capture_index
+INDEX_HEADER = struct.Struct('<8sII')  # magic, messages between entries, no. of entries
+try:
+    array('q')
+    INT64_TYPECODE = 'q'
+except ValueError:
+    INT64_TYPECODE = 'l'  # python 2 has no 'q', long is 64 bit on the 64 bit linux machines
+
 
+# struct codes of the ctypes used in the payload layouts
+_STRUCT_CODES = {
+    c_char: 'c',
+    c_short: 'h',
+    c_int: 'i',
+    c_int64: 'q',
+    c_double: 'd',
+}
+
+
+class MessageDecoder(object):
+    """
+    Decoder of the payload of one message type, precompiled from its ctypes layout into a
+    struct.Struct and the list of the fields to be extracted
+    """
+
+    def __init__(self, payload_cls, fields=None):
+        names = [name for name, _ in payload_cls._fields_]
+        self.payload_cls = payload_cls
+        self.layout = struct.Struct('<' + ''.join(_STRUCT_CODES[ctype] for _, ctype in payload_cls._fields_))
+        self.size = self.layout.size
+        self.fields = tuple(fields or names)
+        # positions of the fields in the unpacked values, None when all are extracted in order
+        self.positions = None if self.fields == tuple(names) else [names.index(field) for field in self.fields]
+
+    def decode(self, header, buf, start, end):
+        if end - start >= self.size:
+            values = self.layout.unpack_from(buf, start)
         else:
-            print (header.msg_type)
-            # TODO: ask about dealing with 'Y' messages
+            # truncated message, zero padded the way create_string_buffer used to do it
+            values = self.layout.unpack(bytes(buf[start:end]) + b'\0' * (self.size - (end - start)))
+        if self.positions is not None:
+            values = [values[position] for position in self.positions]
+        record = {'msg_type': header.msg_type, 'seq_no': header.seq_no}
+        record.update(zip(self.fields, values))
+        return record
+
+
+# msg_type -> MessageDecoder, see register_message_type
+DECODERS = {}
+
+
+def register_message_type(msg_types, payload_cls, fields=None):
+    """
+    Registers the payload layout of message types, new exchange message types are added here
+    without touching the parsing loop
+    :param msg_types: list of msg_types (single bytes, e.g. b'N') having this payload
+    :param payload_cls: LittleEndianStructure describing the payload
+    :param fields: fields of the payload to be extracted in the decoded message, defaults to all
+    """
+    decoder = MessageDecoder(payload_cls, fields)
+    for msg_type in msg_types:
+        DECODERS[msg_type] = decoder
+
+
+register_message_type([b'Z'], HeartBeatPayload)  # heartbeat
+register_message_type([b'N', b'X', b'M'], OrderPayload)  # new/cancel/modify order
+register_message_type([b'T'], TradePayload)  # trade
+register_message_type([b'G', b'H', b'J'], OrderPayload)  # spread order
+register_message_type([b'K'], TradePayload)  # spread trade
+# TODO: ask about dealing with 'Y' messages, register its layout once known
+
+
+def decode_message(header, buf, start, end):
+    """
+    Decodes the payload of a single message
+    :param header: <type: StreamHeader> header of the message
+    :param buf: buffer holding the message
+    :param start: offset of the payload (first byte after the header) in `buf`
+    :param end: offset of the end of the message in `buf`
+    :return: <type: dict> decoded message, only msg_type and seq_no for the unknown types
+    """
+    decoder = DECODERS.get(header.msg_type)
+    if decoder is None:
+        return {'msg_type': header.msg_type, 'seq_no': header.seq_no}
+    return decoder.decode(header, buf, start, end)
+
+
+def _json_default(value):
+    # c_char fields come out as bytes on python 3
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+class _ZstdFile(object):
+    """
+    Write-only zstd compressed file, compressing the data while it is being written
+    """
+
+    def __init__(self, filename, level):
+        import zstandard  # optional dependency, only needed for zstd output
+        self.raw = open(filename, 'wb')
+        # used as a context manager, leaving it writes the end of the frame
+        self.writer = zstandard.ZstdCompressor(level=level).stream_writer(self.raw)
+        self.writer.__enter__()
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        self.writer.__exit__(None, None, None)
+        self.raw.close()
+
+
+def open_output(save_filename, compression=None, level=None):
+    """
+    Opens the output file for writing (in binary mode), compressing everything written to it
+    on the fly
+    :param save_filename: path of the output file
+    :param compression: None, 'gzip' or 'zstd'
+    :param level: compression level, defaults to DEFAULT_COMPRESSION_LEVELS[compression]
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression: {}".format(compression))
+    if compression is None:
+        return open(save_filename, 'wb')
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS[compression]
+    if compression == 'gzip':
+        return gzip.open(save_filename, 'wb', compresslevel=level)
+    return _ZstdFile(save_filename, level)
+
+
+class JsonOutput(object):
+    """
+    Sink writing the decoded messages in the format
+        {
+            "data": [<messages>],
+            "heartbeat": {"msg_type": "Z", "last_seq_no": <int>},
+        }
+    record by record, so that the decoded capture is never held in memory. With `compression`
+    set, the records are compressed while being written (see open_output)
+    """
+
+    def __init__(self, save_filename, compression=None, level=None):
+        self.outfile = open_output(save_filename, compression, level)
+        self.heartbeat = {}  # TODO: ask about the frequency of heartbeat message and its usage
+        self.pending = []
+        self.empty = True
+        self.outfile.write(b'{"data": [')
+
+    def add(self, offset, header, record):
+        if header.msg_type == b'Z':
+            self.heartbeat['msg_type'] = 'Z'
+            self.heartbeat['last_seq_no'] = record['last_seq_no']
+            record = {'msg_type': record['msg_type'], 'seq_no': record['seq_no']}
+        self.pending.append(json.dumps(record, default=_json_default))
+        if len(self.pending) >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if not self.empty:
+            self.outfile.write(b', ')
+        self.outfile.write(', '.join(self.pending).encode('utf-8'))
+        self.empty = False
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.outfile.write('], "heartbeat": {}}}'.format(json.dumps(self.heartbeat)).encode('utf-8'))
+        self.outfile.close()
+
+
+def part_path(save_filename, start):
+    """
+    :return: path of the part of the output `save_filename` starting at offset `start` of the capture
+    """
+    return '{}.part{:015d}'.format(save_filename, start)
+
+
+class PartedJsonOutput(JsonOutput):
+    """
+    JsonOutput written in parts, a new part starting at the first message boundary every `every`
+    bytes of the capture; `on_part(path, start, end, records, heartbeat)` is called with every
+    complete part (e.g. to checkpoint it) but the last one. On close, the parts are joined into
+    `save_filename`, the compressed ones too (concatenated gzip members / zstd frames are valid).
+
+    To resume the output of a capture parsed up to the offset `start`, the parts of that range
+    must be at their part_path, listed (by start offset) in `parts`, with the no. of `records`
+    written to them and the last `heartbeat`.
+    """
+
+    def __init__(self, save_filename, every, on_part, compression=None, level=None,
+                 start=0, parts=(), records=0, heartbeat=None):
+        self.save_filename = save_filename
+        self.every = every
+        self.on_part = on_part
+        self.compression = compression
+        self.level = level
+        self.parts = list(parts)
+        self.start = start
+        self.next_cut = start + every
+        self.records = records
+        self.heartbeat = dict(heartbeat or {})
+        self.pending = []
+        self.empty = not records
+        self.outfile = open_output(part_path(save_filename, start), compression, level)
+        if not start:
+            self.outfile.write(b'{"data": [')
+
+    def add(self, offset, header, record):
+        if offset >= self.next_cut:
+            self.cut(offset)
+        self.records += 1
+        super(PartedJsonOutput, self).add(offset, header, record)
+
+    def cut(self, offset):
+        self.flush()
+        self.outfile.close()
+        self.on_part(part_path(self.save_filename, self.start), self.start, offset, self.records, self.heartbeat)
+        self.parts.append(self.start)
+        self.start = offset
+        self.next_cut = offset + self.every
+        self.outfile = open_output(part_path(self.save_filename, offset), self.compression, self.level)
+
+    def close(self):
+        super(PartedJsonOutput, self).close()
+        with open(self.save_filename, 'wb') as outfile:
+            for start in self.parts + [self.start]:
+                with open(part_path(self.save_filename, start), 'rb') as part:
+                    shutil.copyfileobj(part, outfile)
+                os.remove(part_path(self.save_filename, start))
+
+
+class IndexBuilder(object):
+    """
+    Sink building the offset index of a capture: (offset, stream_id, seq_no, msg_type, timestamp)
+    of every `every`th message, saved as a sidecar file on close. Heartbeats carry no timestamp, their
+    entries get the timestamp of the last message having one (-1 before any).
+
+    Sidecar layout (little endian): INDEX_HEADER followed by the columns; offsets (int64),
+    seq_nos (int32), msg_types (1 byte each), timestamps (int64), stream_ids (uint16). See
+    capture_index for reading it
+    """
+
+    def __init__(self, index_filename, every=INDEX_EVERY):
+        self.index_filename = index_filename
+        self.every = every
+        self.offsets = array(INT64_TYPECODE)
+        self.seq_nos = array('i')
+        self.msg_types = bytearray()
+        self.timestamps = array(INT64_TYPECODE)
+        self.stream_ids = array('H')
+        self.timestamp = -1
+        self.counter = 0
+
+    def add(self, offset, header, record):
+        timestamp = record.get('timestamp')
+        if timestamp is not None:
+            self.timestamp = timestamp
+        if self.counter % self.every == 0:
+            self.offsets.append(offset)
+            self.seq_nos.append(header.seq_no)
+            self.msg_types.extend(header.msg_type)
+            self.timestamps.append(self.timestamp)
+            self.stream_ids.append(header.stream_id & 0xffff)
+        self.counter += 1
+
+    def close(self):
+        columns = [self.offsets, self.seq_nos, self.timestamps, self.stream_ids]
+        if sys.byteorder == 'big':
+            for column in columns:
+                column.byteswap()
+        with open(self.index_filename, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.every, len(self.offsets)))
+            self.offsets.tofile(index_file)
+            self.seq_nos.tofile(index_file)
+            index_file.write(bytes(self.msg_types))
+            self.timestamps.tofile(index_file)
+            self.stream_ids.tofile(index_file)
+
+
+def _scan_python(parser, buf, end):
+    """
+    Decodes the complete messages in buf[:end] and passes them to the parser's sinks
+    :return: offset in `buf` of the first message not decoded (incomplete)
+    """
+    pos = 0
+    count = 0
+    sinks = parser.sinks
+    integrity = parser.integrity
+    last_seq = integrity.last_seq if integrity else None
+    decoders = DECODERS
+    unknown_msg_types = parser.unknown_msg_types
+    try:
+        while end - pos >= HEADER_SIZE:
+            header = StreamHeader.from_buffer_copy(buf, pos)
+            msg_len = header.msg_len
+            if msg_len < HEADER_SIZE:
+                raise ValueError("Corrupt message at offset {} in {}: msg_len {}".format(
+                    parser.offset + pos, parser.name, msg_len))
+            if end - pos < msg_len:
+                break  # rest of the message is in the next chunk
+            decoder = decoders.get(header.msg_type)
+            if decoder is not None:
+                record = decoder.decode(header, buf, pos + HEADER_SIZE, pos + msg_len)
+            else:
+                record = {'msg_type': header.msg_type, 'seq_no': header.seq_no}
+                unknown_msg_types[header.msg_type] = unknown_msg_types.get(header.msg_type, 0) + 1
+            for sink in sinks:
+                sink.add(parser.offset + pos, header, record)
+            if last_seq is not None:
+                stream = header.stream_id & 0xffff
+                if header.seq_no == last_seq[stream] + 1 and header.msg_type != b'Z':
+                    last_seq[stream] = header.seq_no
+                else:
+                    integrity.check(parser.offset + pos, header, record)
+            pos += msg_len
+            count += 1
+    finally:
+        parser.counter += count
+    return pos
+
+
+# decoding loops the parser can run on, 'native' is the compiled log_parser_speedups when available
+ENGINES = {
+    'python': _scan_python,
+}
+
+
+class Progress(object):
+    """
+    Progress of the parsing of one or more captures, reported to `callback` at most every
+    `interval` seconds (and at the end of every capture) as a dict:
+        name, files, files_done, bytes, total_bytes, messages, elapsed_seconds,
+        msgs_per_sec, bytes_per_sec, eta_seconds (None while unknown), done
+    A parser calls `update` with the bytes and messages of the capture being parsed, and
+    `file_done` at its end; the figures of the captures done are carried over to the next ones.
+    """
+
+    def __init__(self, callback, total_bytes=None, files=1, name='', interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.total_bytes = total_bytes
+        self.files = files
+        self.name = name
+        self.interval = interval
+        self.files_done = 0
+        self.base_bytes = 0  # bytes and messages of the captures done
+        self.base_messages = 0
+        self.start = time.time()
+        self.next_report = self.start + interval
+
+    def update(self, bytes_done, messages, force=False):
+        now = time.time()
+        if not force and now < self.next_report:
+            return
+        self.next_report = now + self.interval
+        bytes_done += self.base_bytes
+        messages += self.base_messages
+        elapsed = now - self.start
+        bytes_per_sec = bytes_done / elapsed if elapsed > 0 else 0.0
+        done = self.files_done >= self.files
+        eta = None
+        if done:
+            eta = 0.0
+        elif self.total_bytes and bytes_per_sec:
+            eta = max(0.0, self.total_bytes - bytes_done) / bytes_per_sec
+        self.callback({
+            'name': self.name,
+            'files': self.files,
+            'files_done': self.files_done,
+            'bytes': bytes_done,
+            'total_bytes': self.total_bytes,
+            'messages': messages,
+            'elapsed_seconds': elapsed,
+            'msgs_per_sec': messages / elapsed if elapsed > 0 else 0.0,
+            'bytes_per_sec': bytes_per_sec,
+            'eta_seconds': eta,
+            'done': done,
+        })
+
+    def file_done(self, bytes_done, messages):
+        self.base_bytes += bytes_done
+        self.base_messages += messages
+        self.files_done += 1
+        self.update(0, 0, force=True)
+
+
+def log_progress(logger):
+    """
+    :return: Progress callback logging the reports to `logger`
+    """
+    def callback(report):
+        eta = report['eta_seconds']
+        logger.info("{}: {} messages, {:.1f} MB{}, {:.0f} msgs/sec, {:.2f} MB/sec, ETA {}".format(
+            report['name'], report['messages'], report['bytes'] / 1048576.0,
+            ' of {:.1f} MB'.format(report['total_bytes'] / 1048576.0) if report['total_bytes'] else '',
+            report['msgs_per_sec'], report['bytes_per_sec'] / 1048576.0,
+            '{:.0f}s'.format(eta) if eta is not None else 'unknown'))
+    return callback
+
+
+class StreamParser(object):
+    """
+    Incremental parser for a capture delivered in chunks of arbitrary size.
+
+    Bytes are handed over with `feed` (aliased as `write`, so that the parser can be passed
+    wherever a writable file object is expected, e.g. `blob.download_to_file`). Every complete
+    message is decoded as soon as its last byte arrives and passed to the sinks as
+    `sink.add(offset, header, record)`; a message straddling two chunks is held back until
+    the rest of it is fed.
+
+    With an `integrity` checker (integrity.IntegrityChecker), the seq_no continuity is tracked in
+    the loop itself and only the messages breaking it are passed to `integrity.check`.
+    `engine` picks the decoding loop from `engines()`, DEFAULT_ENGINE when not given (the python
+    one where the native one is unavailable).
+    `progress` (a Progress) is updated after every chunk fed.
+    As a context manager, the parser is closed at the end of the `with` block, on failures too
+    (the sinks' files are closed, not uploaded by anyone)
+    """
+
+    def __init__(self, sinks, logger=None, name='', offset=0, integrity=None, engine=None, progress=None):
+        self.sinks = sinks
+        self.progress = progress
+        self.bytes_fed = 0
+        self.integrity = integrity
+        self.logger = logger
+        self.name = name
+        self.buffer = bytearray()
+        self.offset = offset  # offset of the first byte of self.buffer in the capture
+        self.counter = 0
+        self.unknown_msg_types = {}  # msg_type -> no. of messages without a registered decoder
+        self.scan = engine_scan(engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            log.exception("Closing the parser of {} after a failure".format(self.name))  # the failure is raised
+
+    def feed(self, data):
+        buf = self.buffer
+        buf.extend(data)
+        pos = self.scan(self, buf, len(buf))
+        if pos:
+            del buf[:pos]
+            self.offset += pos
+        self.bytes_fed += len(data)
+        if self.progress is not None:
+            self.progress.update(self.bytes_fed, self.counter)
+
+    write = feed
+
+    def close(self):
+        if self.buffer:
+            # a truncated message at the end of the capture, decode what is there
+            header = StreamHeader.from_buffer_copy(bytes(self.buffer) + b'\0' * HEADER_SIZE)
+            if len(self.buffer) >= HEADER_SIZE:
+                record = decode_message(header, self.buffer, HEADER_SIZE, len(self.buffer))
+                if header.msg_type not in DECODERS:
+                    self.unknown_msg_types[header.msg_type] = self.unknown_msg_types.get(header.msg_type, 0) + 1
+                for sink in self.sinks:
+                    sink.add(self.offset, header, record)
+                if self.integrity:
+                    self.integrity.check(self.offset, header, record)
+            self.offset += len(self.buffer)
+            self.buffer = bytearray()
+        metrics.incr('log_parser.messages', self.counter)
+        metrics.incr('log_parser.bytes', self.offset)
+        if self.unknown_msg_types and self.logger:
+            self.logger.warning("File: {}, messages of unknown types: {}".format(self.name, self.unknown_msg_types))
+        for sink in self.sinks:
+            sink.close()
+        if self.integrity:
+            self.integrity.close()
+        if self.progress is not None:
+            self.progress.file_done(self.bytes_fed, self.counter)
+
+
+def _native_build_errors():
+    """
+    :return: exception types of a failed import or build of the native loop: ImportError (pyximport
+        raises its build failures as ImportError too) and the Cython/distutils compile errors
+    """
+    errors = [ImportError]
+    try:
+        from distutils.errors import DistutilsError, CCompilerError
+        errors.extend([DistutilsError, CCompilerError])
+    except ImportError:
+        pass
+    try:
+        from Cython.Compiler.Errors import CompileError
+        errors.append(CompileError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _load_native_engine():
+    """
+    Imports the compiled decoding loop (log_parser_speedups.pyx), building it with pyximport
+    when Cython is installed and no prebuilt module is around. Why it is unavailable is logged
+    (once, engines() loading it once)
+    :return: the native scan function, None when unavailable
+    """
+    if os.environ.get('LOG_PARSER_NATIVE', '1') == '0' or sys.byteorder != 'little':
+        return None  # the native loop reads the packed little endian layouts in place
+    try:
+        try:
+            import log_parser_speedups
+        except ImportError:
+            import pyximport
+            pyximport.install(language_level=2)
+            import log_parser_speedups
+    except _native_build_errors() as e:
+        log.warning("Native decoding loop unavailable, parsing with the python engine: {!r}".format(e))
+        return None
+    if not log_parser_speedups.setup(DECODERS, StreamHeader, OrderPayload, TradePayload, HeartBeatPayload):
+        log.warning("Native decoding loop built for other message layouts, parsing with the python engine")
+        return None
+    return log_parser_speedups.scan
+
+
+DEFAULT_ENGINE = 'native'
+_native_loaded = False
+_native_lock = threading.Lock()
+
+
+def engines():
+    """
+    :return: ENGINES, with the native decoding loop once it is available. It is only loaded (and
+        built, see _load_native_engine) on the first call, e.g. the first parse, not on import:
+        the DAG file parse and the processes which do not parse never build it
+    """
+    global _native_loaded
+    if not _native_loaded:
+        with _native_lock:  # the threads parsing at once wait for a single build
+            if not _native_loaded:
+                native_scan = _load_native_engine()
+                if native_scan is not None:
+                    ENGINES['native'] = native_scan
+                _native_loaded = True
+    return ENGINES
+
+
+def engine_scan(engine=None):
+    """
+    :return: the decoding loop of `engine`, of DEFAULT_ENGINE (or the python one where it is
+        unavailable) when not given
+    """
+    available = engines() if engine in (None, 'native') else ENGINES
+    if engine is None:
+        return available.get(DEFAULT_ENGINE, available['python'])
+    return available[engine]
+
 
-        bin_data = bin_data[header.msg_len:]
-        arr.append(iter_data)
+def open_stream(save_filename, logger=None, name='', compression=None, compression_level=None,
+                index_filename=None, index_every=INDEX_EVERY, sinks=(), integrity=None, engine=None,
+                progress=None, total_bytes=None, offset=0, output=None):
+    """
+    Returns a StreamParser writing the decoded messages to `save_filename`.
+    The caller feeds it with the capture bytes and closes it at the end
+    :param index_filename: if given, the offset index of the capture is saved to it
+    :param sinks: additional sinks for the decoded messages, e.g. partitioned_store.PartitionWriter
+    :param integrity: integrity.IntegrityChecker for the capture
+    :param engine: decoding loop, 'python' or 'native' (see ENGINES), DEFAULT_ENGINE if not given
+    :param progress: Progress to update while parsing, by default the progress is logged to
+        `logger` (if any) every PROGRESS_INTERVAL seconds
+    :param total_bytes: size of the capture, for the ETA of the default progress
+    :param offset: offset in the capture of the first byte fed, when resuming a capture from a
+        message boundary
+    :param output: sink writing `save_filename` instead of a JsonOutput, e.g. a PartedJsonOutput
+    """
+    sinks = [output or JsonOutput(save_filename, compression, compression_level)] + list(sinks)
+    if index_filename:
+        sinks.append(IndexBuilder(index_filename, index_every))
+    if progress is None and logger:
+        progress = Progress(log_progress(logger), total_bytes=total_bytes, name=name)
+    return StreamParser(sinks, logger=logger, name=name, offset=offset, integrity=integrity, engine=engine,
+                        progress=progress)
 
-        if counter % 500 == 0 and bin_data and logger:
-            print ("File: {}, count: {}".format(filename, counter))
 
-    json.dump({
-        'heartbeat': heartbeat,
-        'data': arr,
-    }, open(save_filename or filename.replace('.bin', '.json'), 'w'))
+def main(logger=None, filename='test.bin', save_filename="", compression=None, compression_level=None,
+         index_filename=None, index_every=INDEX_EVERY, sinks=(), integrity=None, engine=None, progress=None,
+         offset=0, output=None):
+    save_filename = save_filename or filename.replace('.bin', '.json') + COMPRESSION_SUFFIXES[compression]
+    parser = open_stream(save_filename, logger=logger, name=filename,
+                         compression=compression, compression_level=compression_level,
+                         index_filename=index_filename, index_every=index_every, sinks=sinks,
+                         integrity=integrity, engine=engine, progress=progress,
+                         total_bytes=os.path.getsize(filename) - offset, offset=offset, output=output)
+    with metrics.timer('log_parser.main'), parser:
+        with open(filename, 'rb') as infile:
+            infile.seek(offset)
+            for chunk in iter(lambda: infile.read(READ_CHUNK_SIZE), b''):
+                parser.feed(chunk)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+# cython: language_level=2, boundscheck=False, wraparound=False
+"""
+Native decoding loop of log_parser.StreamParser (engine 'native').
+
+Reads the headers and the payloads of the registered layouts in place from the parser's
+buffer, through packed C structs mirroring the ctypes ones of log_parser, and builds the
+same records as log_parser._scan_python. Message types whose decoder extracts a subset of
+the fields, truncated payloads and the layouts not known here go through decoder.decode.
+Built with pyximport when Cython is installed, log_parser falls back to the python loop otherwise.
+"""
+from cpython cimport array
+from cpython.bytearray cimport PyByteArray_AS_STRING
+from libc.string cimport memcpy
+
+import ctypes
+
+
+cdef packed struct header_t:
+    short msg_len
+    short stream_id
+    int seq_no
+    char msg_type
+
+
+cdef packed struct order_t:
+    long long timestamp
+    double order_id
+    int token
+    char order_type
+    int price
+    int quantity
+
+
+cdef packed struct trade_t:
+    long long timestamp
+    double buy_order_id
+    double sell_order_id
+    int token
+    int price
+    int quantity
+
+
+cdef packed struct heartbeat_t:
+    int last_seq_no
+
+
+# payload kinds decoded in place, KIND_DECODER goes through decoder.decode
+cdef enum:
+    KIND_UNKNOWN = 0
+    KIND_DECODER = 1
+    KIND_ORDER = 2
+    KIND_TRADE = 3
+    KIND_HEARTBEAT = 4
+
+cdef list BYTES = [bytes(bytearray([i])) for i in range(256)]  # single byte objects, no allocation per message
+cdef dict DECODERS = None
+cdef object ORDER_CLS = None
+cdef object TRADE_CLS = None
+cdef object HEARTBEAT_CLS = None
+
+
+cdef class Header:
+    """
+    Decoded message header, with the attributes of log_parser.StreamHeader
+    """
+    cdef readonly int msg_len
+    cdef readonly int stream_id
+    cdef readonly int seq_no
+    cdef readonly object msg_type
+
+
+def setup(decoders, header_cls, order_cls, trade_cls, heartbeat_cls):
+    """
+    Binds the loop to log_parser's decoder registry and payload layouts
+    :return: False when the C structs do not match the ctypes layouts
+    """
+    global DECODERS, ORDER_CLS, TRADE_CLS, HEARTBEAT_CLS
+    for cls, size in ((header_cls, sizeof(header_t)), (order_cls, sizeof(order_t)),
+                      (trade_cls, sizeof(trade_t)), (heartbeat_cls, sizeof(heartbeat_t))):
+        if ctypes.sizeof(cls) != size:
+            return False
+    DECODERS = decoders
+    ORDER_CLS = order_cls
+    TRADE_CLS = trade_cls
+    HEARTBEAT_CLS = heartbeat_cls
+    return True
+
+
+cdef int _kind(decoder):
+    if decoder.positions is not None:
+        return KIND_DECODER
+    if decoder.payload_cls is ORDER_CLS:
+        return KIND_ORDER
+    if decoder.payload_cls is TRADE_CLS:
+        return KIND_TRADE
+    if decoder.payload_cls is HEARTBEAT_CLS:
+        return KIND_HEARTBEAT
+    return KIND_DECODER
+
+
+def scan(parser, bytearray buf, Py_ssize_t end):
+    """
+    Decodes the complete messages in buf[:end] and passes them to the parser's sinks
+    :return: offset in `buf` of the first message not decoded (incomplete)
+    """
+    cdef int kinds[256]
+    cdef list decoders = [None] * 256
+    cdef int i, kind, stream, msg_type
+    cdef Py_ssize_t pos = 0, msg_len, payload_len
+    cdef long long offset = parser.offset
+    cdef long long counter = parser.counter
+    cdef long long *last_seq = NULL
+    cdef header_t header_data
+    cdef order_t order
+    cdef trade_t trade
+    cdef heartbeat_t heartbeat
+    cdef char *data = PyByteArray_AS_STRING(buf)
+    cdef Header header
+    cdef array.array last_seq_array
+    cdef list sinks = list(parser.sinks)
+    cdef dict unknown_msg_types = parser.unknown_msg_types
+
+    for i in range(256):
+        kinds[i] = KIND_UNKNOWN
+    for key, decoder in DECODERS.items():
+        if isinstance(key, bytes) and len(key) == 1:
+            i = bytearray(key)[0]
+            kinds[i] = _kind(decoder)
+            decoders[i] = decoder
+
+    integrity = parser.integrity
+    if integrity is not None:
+        last_seq_array = integrity.last_seq
+        if last_seq_array.itemsize != sizeof(long long):
+            raise ValueError("Unexpected integrity.last_seq item size {}".format(last_seq_array.itemsize))
+        last_seq = <long long *>last_seq_array.data.as_voidptr
+
+    try:
+        while end - pos >= <Py_ssize_t>sizeof(header_t):
+            memcpy(&header_data, data + pos, sizeof(header_t))
+            msg_len = header_data.msg_len
+            if msg_len < <Py_ssize_t>sizeof(header_t):
+                raise ValueError("Corrupt message at offset {} in {}: msg_len {}".format(
+                    offset + pos, parser.name, msg_len))
+            if end - pos < msg_len:
+                break  # rest of the message is in the next chunk
+            msg_type = <unsigned char>header_data.msg_type
+            header = Header.__new__(Header)
+            header.msg_len = header_data.msg_len
+            header.stream_id = header_data.stream_id
+            header.seq_no = header_data.seq_no
+            header.msg_type = BYTES[msg_type]
+
+            kind = kinds[msg_type]
+            payload_len = msg_len - sizeof(header_t)
+            if kind == KIND_ORDER and payload_len >= <Py_ssize_t>sizeof(order_t):
+                memcpy(&order, data + pos + sizeof(header_t), sizeof(order_t))
+                record = {
+                    'msg_type': header.msg_type,
+                    'seq_no': header.seq_no,
+                    'timestamp': order.timestamp,
+                    'order_id': order.order_id,
+                    'token': order.token,
+                    'order_type': BYTES[<unsigned char>order.order_type],
+                    'price': order.price,
+                    'quantity': order.quantity,
+                }
+            elif kind == KIND_TRADE and payload_len >= <Py_ssize_t>sizeof(trade_t):
+                memcpy(&trade, data + pos + sizeof(header_t), sizeof(trade_t))
+                record = {
+                    'msg_type': header.msg_type,
+                    'seq_no': header.seq_no,
+                    'timestamp': trade.timestamp,
+                    'buy_order_id': trade.buy_order_id,
+                    'sell_order_id': trade.sell_order_id,
+                    'token': trade.token,
+                    'price': trade.price,
+                    'quantity': trade.quantity,
+                }
+            elif kind == KIND_HEARTBEAT and payload_len >= <Py_ssize_t>sizeof(heartbeat_t):
+                memcpy(&heartbeat, data + pos + sizeof(header_t), sizeof(heartbeat_t))
+                record = {
+                    'msg_type': header.msg_type,
+                    'seq_no': header.seq_no,
+                    'last_seq_no': heartbeat.last_seq_no,
+                }
+            elif kind != KIND_UNKNOWN:
+                record = decoders[msg_type].decode(header, buf, pos + sizeof(header_t), pos + msg_len)
+            else:
+                record = {'msg_type': header.msg_type, 'seq_no': header.seq_no}
+                unknown_msg_types[header.msg_type] = unknown_msg_types.get(header.msg_type, 0) + 1
+
+            for sink in sinks:
+                sink.add(offset + pos, header, record)
+            if last_seq != NULL:
+                stream = header_data.stream_id & 0xffff
+                if header_data.seq_no == last_seq[stream] + 1 and msg_type != 90:  # 90: b'Z'
+                    last_seq[stream] = header_data.seq_no
+                else:
+                    integrity.check(offset + pos, header, record)
+            pos += msg_len
+
+            counter += 1
+    finally:
+        parser.counter = counter
+    return pos
@@ -0,0 +1,201 @@
+"""
+Lightweight timers and counters for the pipeline stages.
+
+The instrumented functions record to `current()`: the Metrics of the innermost `collect()` block
+of the thread, or the process wide `default` outside of them. An operator wraps its work in
+`collect()` to get the metrics of its own task, then pushes them to XCom and exports them with
+`export` (StatsD over UDP and/or a Prometheus text file, see STATSD_HOST / METRICS_TEXTFILE_DIR).
+
+    with metrics.timer('worker.parse'):
+        ...
+    metrics.incr('worker.bytes_downloaded', blob.size)
+
+Only depends on the standard library.
+"""
+import os
+import re
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+STATSD_HOST = os.environ.get('STATSD_HOST')
+STATSD_PORT = int(os.environ.get('STATSD_PORT', 8125))
+METRICS_PREFIX = os.environ.get('METRICS_PREFIX', 'parser_pipeline')
+METRICS_TEXTFILE_DIR = os.environ.get('METRICS_TEXTFILE_DIR')  # e.g. the node_exporter textfile collector dir
+
+
+class Metrics(object):
+    """
+    Timers (count, total and max seconds) and counters, keyed by dotted names
+    """
+
+    def __init__(self):
+        self.timers = {}  # name -> [count, total seconds, max seconds]
+        self.counters = {}  # name -> value
+        self.lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def merge(self, other):
+        for name, (count, total, longest) in other.timers.items():
+            with self.lock:
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+        for name, value in other.counters.items():
+            self.incr(name, value)
+
+    def as_dict(self):
+        """
+        :return: json serializable {'timers': {name: {count, seconds, max_seconds}}, 'counters': {name: value}}
+        """
+        with self.lock:
+            return {
+                'timers': dict((name, {'count': count, 'seconds': round(total, 6), 'max_seconds': round(longest, 6)})
+                               for name, (count, total, longest) in self.timers.items()),
+                'counters': dict(self.counters),
+            }
+
+    def to_statsd(self, prefix=METRICS_PREFIX):
+        """
+        :return: StatsD lines, timers as the total milliseconds of the stage
+        """
+        lines = []
+        with self.lock:
+            for name, (count, total, _) in sorted(self.timers.items()):
+                lines.append('{}.{}:{}|ms'.format(prefix, name, int(round(total * 1000))))
+            for name, value in sorted(self.counters.items()):
+                lines.append('{}.{}:{}|c'.format(prefix, name, value))
+        return lines
+
+    def to_prometheus(self, prefix=METRICS_PREFIX, labels=None):
+        """
+        :return: Prometheus text exposition of the metrics
+        """
+        label_text = ''
+        if labels:
+            label_text = '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                                        for key, value in sorted(labels.items())) + '}'
+        lines = []
+        with self.lock:
+            for name, (count, total, longest) in sorted(self.timers.items()):
+                metric = _prometheus_name(prefix, name)
+                lines.append('# TYPE {}_seconds summary'.format(metric))
+                lines.append('{}_seconds_count{} {}'.format(metric, label_text, count))
+                lines.append('{}_seconds_sum{} {}'.format(metric, label_text, repr(float(total))))
+                lines.append('# TYPE {}_seconds_max gauge'.format(metric))
+                lines.append('{}_seconds_max{} {}'.format(metric, label_text, repr(float(longest))))
+            for name, value in sorted(self.counters.items()):
+                metric = _prometheus_name(prefix, name)
+                lines.append('# TYPE {}_total counter'.format(metric))
+                lines.append('{}_total{} {}'.format(metric, label_text, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_name(prefix, name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '{}_{}'.format(prefix, name))
+
+
+default = Metrics()
+_local = threading.local()
+
+
+def current():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else default
+
+
+@contextmanager
+def collect():
+    """
+    Records the metrics of the block (in this thread) to a new Metrics, yielded, merged into the
+    enclosing one at the end
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    collected = Metrics()
+    stack.append(collected)
+    try:
+        yield collected
+    finally:
+        stack.pop()
+        current().merge(collected)
+
+
+def timer(name):
+    return current().timer(name)
+
+
+def incr(name, value=1):
+    current().incr(name, value)
+
+
+def timed(name):
+    """
+    Decorator timing every call of the function as `name`
+    """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
+
+
+def export(task_metrics, labels=None, totals=None):
+    """
+    Sends the metrics to StatsD when STATSD_HOST is set, and writes them as a Prometheus text
+    file when METRICS_TEXTFILE_DIR is set. Failures are logged, never raised.
+    :param task_metrics: metrics to send to StatsD
+    :param labels: e.g. {'task_id': ..., 'dag_id': ...}, the Prometheus labels and the file name
+    :param totals: metrics to write to the text file, `task_metrics` if not given (e.g. the totals
+        of all the pokes of a sensor while StatsD gets the ones of the last poke)
+    """
+    labels = labels or {}
+    if STATSD_HOST:
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                for line in task_metrics.to_statsd():
+                    sock.sendto(line.encode('utf-8'), (STATSD_HOST, STATSD_PORT))
+            finally:
+                sock.close()
+        except Exception as e:
+            log.warning("Could not send the metrics to statsd: {}".format(e))
+    if METRICS_TEXTFILE_DIR:
+        name = '_'.join(str(labels[key]) for key in sorted(labels)) or 'metrics'
+        path = os.path.join(METRICS_TEXTFILE_DIR, re.sub(r'[^a-zA-Z0-9_.-]', '_', name) + '.prom')
+        try:
+            with open(path + '.tmp', 'w') as outfile:
+                outfile.write((totals or task_metrics).to_prometheus(labels=labels))
+            os.rename(path + '.tmp', path)  # the collector never reads a half written file
+        except Exception as e:
+            log.warning("Could not write the metrics to {}: {}".format(path, e))
@@ -0,0 +1,197 @@
+import json
+from heapq import heappush, heappop, heapify
+
+ORDER_MSG_TYPES = (b'N', b'M', b'X')  # new, modify, cancel
+TRADE_MSG_TYPE = b'T'
+BUY = b'B'
+REORDER_WINDOW = 64  # default no. of messages of a stream buffered to be applied in seq_no order
+
+
+class _Side(object):
+    """
+    Price levels of one side of a book: aggregated quantity per price in a dict, and a heap of
+    the prices (negated for the bids) for the best price. Emptied levels are dropped from the
+    heap lazily, when they reach its top.
+    """
+
+    def __init__(self, is_bid):
+        self.sign = -1 if is_bid else 1
+        self.quantity = {}  # price -> total quantity
+        self.orders = {}  # price -> no. of orders
+        self.heap = []
+
+    def add(self, price, quantity):
+        if price in self.quantity:
+            self.quantity[price] += quantity
+            self.orders[price] += 1
+        else:
+            self.quantity[price] = quantity
+            self.orders[price] = 1
+            heappush(self.heap, self.sign * price)
+
+    def reduce(self, price, quantity, remove_order):
+        left = self.quantity[price] - quantity
+        orders = self.orders[price] - (1 if remove_order else 0)
+        if orders <= 0:
+            del self.quantity[price]
+            del self.orders[price]
+            if len(self.heap) > 2 * len(self.quantity) + 64:
+                # too many stale prices, rebuild the heap
+                self.heap = [self.sign * p for p in self.quantity]
+                heapify(self.heap)
+        else:
+            self.quantity[price] = left
+            self.orders[price] = orders
+
+    def best(self):
+        heap = self.heap
+        while heap and self.sign * heap[0] not in self.quantity:
+            heappop(heap)
+        if not heap:
+            return None, 0
+        price = self.sign * heap[0]
+        return price, self.quantity[price]
+
+
+class OrderBook(object):
+    """
+    Limit order book of a single token, with a hash index on order_id
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.bids = _Side(is_bid=True)
+        self.asks = _Side(is_bid=False)
+        self.orders = {}  # order_id -> [is_bid, price, quantity]
+
+    def add(self, order_id, is_bid, price, quantity):
+        if order_id in self.orders:
+            self.cancel(order_id)
+        self.orders[order_id] = [is_bid, price, quantity]
+        (self.bids if is_bid else self.asks).add(price, quantity)
+
+    def modify(self, order_id, is_bid, price, quantity):
+        self.add(order_id, is_bid, price, quantity)
+
+    def cancel(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        is_bid, price, quantity = order
+        (self.bids if is_bid else self.asks).reduce(price, quantity, remove_order=True)
+        return True
+
+    def fill(self, order_id, quantity):
+        """
+        Reduces the open quantity of the order by a traded `quantity`
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            return False
+        is_bid, price, open_quantity = order
+        quantity = min(quantity, open_quantity)
+        filled = quantity == open_quantity
+        (self.bids if is_bid else self.asks).reduce(price, quantity, remove_order=filled)
+        if filled:
+            del self.orders[order_id]
+        else:
+            order[2] = open_quantity - quantity
+        return True
+
+    def top(self):
+        """
+        :return: (bid price, bid quantity, ask price, ask quantity), None prices for an empty side
+        """
+        bid, bid_quantity = self.bids.best()
+        ask, ask_quantity = self.asks.best()
+        return bid, bid_quantity, ask, ask_quantity
+
+
+class BookEngine(object):
+    """
+    Parser sink maintaining the order book of every token from the order ('N', 'M', 'X') and
+    trade ('T') messages, and writing top-of-book snapshots as json lines to `save_filename`.
+
+    Messages are applied in seq_no order, seq_nos counting per stream (a token always comes on the
+    same stream): with `reorder_window` > 0, up to that many messages of every stream are
+    buffered and released smallest seq_no first, which absorbs small reorderings in a capture.
+
+    A snapshot of a token is written when its top of book (best prices and their quantities)
+    changed since its previous snapshot, taken at least `snapshot_interval` (timestamp units)
+    before; with 0, on every change of the top. Most messages are deeper in the book and write none.
+    """
+
+    def __init__(self, save_filename, snapshot_interval=0, reorder_window=REORDER_WINDOW):
+        self.save_filename = save_filename
+        self.snapshot_interval = snapshot_interval
+        self.reorder_window = reorder_window
+        self.books = {}  # token -> OrderBook
+        self.next_snapshot = {}  # token -> timestamp of its next snapshot
+        self.tops = {}  # token -> top of book of its last snapshot
+        self.pending = {}  # stream_id -> heap of (seq_no, counter, record) waiting to be applied
+        self.counter = 0
+        self.unknown_orders = 0  # cancels/trades for the orders not in the book
+        self.outfile = open(save_filename, 'w')
+
+    def add(self, offset, header, record):
+        msg_type = header.msg_type
+        if msg_type not in ORDER_MSG_TYPES and msg_type != TRADE_MSG_TYPE:
+            return
+        if not self.reorder_window:
+            self.apply(record)
+            return
+        self.counter += 1
+        pending = self.pending.get(header.stream_id)
+        if pending is None:
+            pending = self.pending[header.stream_id] = []
+        heappush(pending, (header.seq_no, self.counter, record))
+        if len(pending) > self.reorder_window:
+            self.apply(heappop(pending)[2])
+
+    def apply(self, record):
+        token = record['token']
+        book = self.books.get(token)
+        if book is None:
+            book = self.books[token] = OrderBook(token)
+
+        msg_type = record['msg_type']
+        if msg_type == b'N':
+            book.add(record['order_id'], record['order_type'] == BUY, record['price'], record['quantity'])
+        elif msg_type == b'M':
+            book.modify(record['order_id'], record['order_type'] == BUY, record['price'], record['quantity'])
+        elif msg_type == b'X':
+            if not book.cancel(record['order_id']):
+                self.unknown_orders += 1
+        else:
+            if not book.fill(record['buy_order_id'], record['quantity']):
+                self.unknown_orders += 1
+            if not book.fill(record['sell_order_id'], record['quantity']):
+                self.unknown_orders += 1
+
+        timestamp = record['timestamp']
+        if timestamp >= self.next_snapshot.get(token, timestamp):
+            top = book.top()
+            if top == self.tops.get(token):
+                return
+            self.tops[token] = top
+            self.next_snapshot[token] = timestamp + self.snapshot_interval
+            bid, bid_quantity, ask, ask_quantity = top
+            self.outfile.write(json.dumps({
+                'token': token,
+                'timestamp': timestamp,
+                'seq_no': record['seq_no'],
+                'bid': bid,
+                'bid_quantity': bid_quantity,
+                'ask': ask,
+                'ask_quantity': ask_quantity,
+            }) + '\n')
+
+    def close(self):
+        for stream_id in sorted(self.pending):
+            pending = self.pending[stream_id]
+            while pending:
+                self.apply(heappop(pending)[2])
+        self.outfile.close()
+
+    def paths(self):
+        return [self.save_filename]
@@ -0,0 +1,183 @@
+import os
+import json
+
+from log_parser import _json_default
+
+TOKEN_BUCKETS = 64  # no. of token buckets, a token goes to the bucket token % TOKEN_BUCKETS
+ROW_GROUP_SIZE = 8192  # no. of messages in a row group, the unit of reading for the queries
+MANIFEST_DIR = '_manifests'
+
+
+def bucket_path(name, bucket):
+    return os.path.join('token_bucket={}'.format(bucket), name + '.jsonl')
+
+
+def manifest_path(name):
+    return os.path.join(MANIFEST_DIR, name + '.json')
+
+
+class PartitionWriter(object):
+    """
+    Parser sink storing the decoded order and trade messages of a capture bucketed by `token`,
+    for the per-token / per-time-range queries (see `query`).
+
+    Every bucket file is a sequence of row groups of json lines. The manifest of the capture holds
+    the byte range of every row group along with its min/max timestamp, tokens and msg_types,
+    so that a query reads only the row groups which can hold matching messages:
+        <root>/token_bucket=<bucket>/<name>.jsonl
+        <root>/_manifests/<name>.json
+    """
+
+    def __init__(self, root, name, buckets=TOKEN_BUCKETS, row_group_size=ROW_GROUP_SIZE):
+        self.root = root
+        self.name = name
+        self.buckets = buckets
+        self.row_group_size = row_group_size
+        self.files = {}  # bucket -> open file
+        self.pending = {}  # bucket -> [rows]
+        self.row_groups = {}  # bucket -> [row group stats]
+
+    def add(self, offset, header, record):
+        token = record.get('token')
+        if token is None:
+            return  # heartbeats and unknown messages have no token
+        bucket = token % self.buckets
+        rows = self.pending.setdefault(bucket, [])
+        rows.append(record)
+        if len(rows) >= self.row_group_size:
+            self._write_row_group(bucket)
+
+    def _write_row_group(self, bucket):
+        rows = self.pending.pop(bucket, None)
+        if not rows:
+            return
+        outfile = self.files.get(bucket)
+        if outfile is None:
+            path = os.path.join(self.root, bucket_path(self.name, bucket))
+            _make_dirs(os.path.dirname(path))
+            outfile = self.files[bucket] = open(path, 'wb')
+        data = ''.join(json.dumps(row, default=_json_default) + '\n' for row in rows).encode('utf-8')
+        timestamps = [row['timestamp'] for row in rows]
+        self.row_groups.setdefault(bucket, []).append({
+            'offset': outfile.tell(),
+            'length': len(data),
+            'rows': len(rows),
+            'min_timestamp': min(timestamps),
+            'max_timestamp': max(timestamps),
+            'tokens': sorted(set(row['token'] for row in rows)),
+            'msg_types': sorted(set(_text(row['msg_type']) for row in rows)),
+        })
+        outfile.write(data)
+
+    def close(self):
+        for bucket in list(self.pending):
+            self._write_row_group(bucket)
+        for outfile in self.files.values():
+            outfile.close()
+        path = os.path.join(self.root, manifest_path(self.name))
+        _make_dirs(os.path.dirname(path))
+        with open(path, 'w') as manifest_file:
+            json.dump({
+                'name': self.name,
+                'buckets': self.buckets,
+                'row_groups': dict((str(bucket), groups) for bucket, groups in self.row_groups.items()),
+            }, manifest_file)
+
+    def paths(self):
+        """
+        :return: paths of all the files written
+        """
+        return [os.path.join(self.root, path) for path in
+                [bucket_path(self.name, bucket) for bucket in sorted(self.files)] + [manifest_path(self.name)]]
+
+
+def _text(value):
+    return value.decode('latin-1') if isinstance(value, bytes) else value
+
+
+def _make_dirs(path):
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+
+
+class LocalReader(object):
+    """
+    Reads a partitioned store from a local directory
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def manifests(self):
+        manifest_root = os.path.join(self.root, MANIFEST_DIR)
+        for dir_path, _, file_names in os.walk(manifest_root):
+            for file_name in sorted(file_names):
+                if file_name.endswith('.json'):
+                    with open(os.path.join(dir_path, file_name)) as manifest_file:
+                        yield json.load(manifest_file)
+
+    def read(self, path, offset, length):
+        with open(os.path.join(self.root, path), 'rb') as infile:
+            infile.seek(offset)
+            return infile.read(length)
+
+
+class GcsReader(object):
+    """
+    Reads a partitioned store from the bucket, fetching only the byte ranges of the row groups
+    """
+
+    def __init__(self, root_blob, bucket_name):
+        from google.cloud import storage
+        self.root_blob = root_blob
+        self.bucket = storage.Client().get_bucket(bucket_name)
+
+    def manifests(self):
+        prefix = self.root_blob + '/' + MANIFEST_DIR + '/'
+        for blob in self.bucket.list_blobs(prefix=prefix):
+            if blob.name.endswith('.json'):
+                yield json.loads(blob.download_as_string().decode('utf-8'))
+
+    def read(self, path, offset, length):
+        blob = self.bucket.blob(self.root_blob + '/' + path.replace(os.sep, '/'))
+        return blob.download_as_string(start=offset, end=offset + length - 1)  # `end` is inclusive
+
+
+def query(reader, token=None, msg_types=None, start_timestamp=None, end_timestamp=None):
+    """
+    Yields the stored messages matching all the given filters
+    :param reader: LocalReader or GcsReader of the store
+    :param token: instrument token
+    :param msg_types: message types to select, e.g. ['T', 'K'] for the trades
+    :param start_timestamp: min timestamp (inclusive)
+    :param end_timestamp: max timestamp (inclusive)
+    """
+    if msg_types is not None:
+        msg_types = set(msg_types)
+    for manifest in reader.manifests():
+        if token is not None:
+            buckets = [str(token % manifest['buckets'])]
+        else:
+            buckets = sorted(manifest['row_groups'], key=int)
+        for bucket in buckets:
+            for group in manifest['row_groups'].get(bucket, []):
+                if token is not None and token not in group['tokens']:
+                    continue
+                if msg_types is not None and not msg_types.intersection(group['msg_types']):
+                    continue
+                if start_timestamp is not None and group['max_timestamp'] < start_timestamp:
+                    continue
+                if end_timestamp is not None and group['min_timestamp'] > end_timestamp:
+                    continue
+                data = reader.read(bucket_path(manifest['name'], bucket), group['offset'], group['length'])
+                for line in data.decode('utf-8').splitlines():
+                    row = json.loads(line)
+                    if token is not None and row['token'] != token:
+                        continue
+                    if msg_types is not None and row['msg_type'] not in msg_types:
+                        continue
+                    if start_timestamp is not None and row['timestamp'] < start_timestamp:
+                        continue
+                    if end_timestamp is not None and row['timestamp'] > end_timestamp:
+                        continue
+                    yield row
@@ -0,0 +1,129 @@
+"""
+Opt-in profiling of the worker tasks on the production inputs.
+
+Modes:
+    'sample': a sampling profiler, a background thread records the stack of the profiled thread
+        every SAMPLE_INTERVAL seconds. Low overhead; saved as folded stacks (<name>.folded), the
+        input of flamegraph.pl / speedscope / inferno.
+    'cprofile': cProfile, exact call counts but a noticeable overhead on the parsing loop; saved as
+        <name>.prof (pstats, for snakeviz / gprof2dot) and <name>.txt (top functions by cumulative time).
+
+The mode comes from the DAG (op_param 'profile') or the WORKER_PROFILE environment variable.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+log = logging.getLogger(__name__)
+
+MODES = ('sample', 'cprofile')
+SAMPLE_INTERVAL = float(os.environ.get('WORKER_PROFILE_INTERVAL', 0.01))
+PROFILE_STORAGE = os.path.expanduser('~/profiles')
+
+
+def profile_mode(param=None):
+    """
+    :return: the profiling mode of the task, None when profiling is off
+    """
+    mode = param or os.environ.get('WORKER_PROFILE') or None
+    if mode and mode not in MODES:
+        log.warning("Unknown profiling mode {}, expected one of {}".format(mode, MODES))
+        return None
+    return mode
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of a thread (the one calling `start` by default) from a background thread
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = {}  # folded stack -> no. of samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.current_thread().ident
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        samples = self.samples
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                samples[key] = samples.get(key, 0) + 1
+
+    def save(self, path):
+        with open(path, 'w') as outfile:
+            for stack, count in sorted(self.samples.items()):
+                outfile.write('{} {}\n'.format(stack, count))
+
+
+@contextmanager
+def profiled(mode, name, save_root=PROFILE_STORAGE):
+    """
+    Profiles the block, run in the calling thread
+    :param mode: one of MODES, None runs the block as it is
+    :param name: base name of the profile files
+    :return: yields the list of the profile files, filled in when the block exits (even on errors)
+    """
+    paths = []
+    if not mode:
+        yield paths
+        return
+    if not os.path.exists(save_root):
+        os.makedirs(save_root)
+    base_name = os.path.join(save_root, '{}.{}'.format(name, time.strftime('%Y%m%dT%H%M%S')))
+    start = time.time()
+    if mode == 'sample':
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield paths
+        finally:
+            profiler.stop()
+            profiler.save(base_name + '.folded')
+            paths.append(base_name + '.folded')
+            log.info("{} samples in {:.1f}s saved to {}".format(sum(profiler.samples.values()),
+                                                                time.time() - start, paths[0]))
+    else:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield paths
+        finally:
+            profiler.disable()
+            profiler.dump_stats(base_name + '.prof')
+            summary = StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(50)
+            with open(base_name + '.txt', 'w') as outfile:
+                outfile.write(summary.getvalue())
+            paths.extend([base_name + '.prof', base_name + '.txt'])
+            log.info("cProfile of {:.1f}s saved to {}".format(time.time() - start, paths))
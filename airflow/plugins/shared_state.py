@@ -0,0 +1,65 @@
+"""
+JSON state shared by the tasks of different DAG runs or task tries, kept in airflow Variables.
+
+Unlike xcom, it survives the retries of a task (xcom of a task is cleared at every try, which is
+how the sensors in reschedule mode poke on airflow 1.8) and can be updated under a row lock:
+
+    with shared_state.locked('gce_warm_pool') as pool:
+        pool[name] = {...}
+"""
+import json
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(key, default=None):
+    """
+    Yields the state of `key` (`default`, {} if not given, when there is none) to be read and
+    changed in place, saved at the end of the block. The concurrent updates of the same key wait
+    for each other on the lock of the Variable's row.
+    """
+    from airflow.models import Variable
+    from airflow.settings import Session
+
+    session = Session()
+    try:
+        variable = session.query(Variable).filter(Variable.key == key).with_for_update().first()
+        if variable is None:
+            variable = Variable(key=key, val=json.dumps(default if default is not None else {}))
+            session.add(variable)
+        state = json.loads(variable.val)
+        yield state
+        variable.val = json.dumps(state, sort_keys=True)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def read(key):
+    """
+    :return: the state of `key`, None if there is none
+    """
+    from airflow.models import Variable
+
+    return Variable.get(key, default_var=None, deserialize_json=True)
+
+
+def write(key, state):
+    from airflow.models import Variable
+
+    Variable.set(key, state, serialize_json=True)
+
+
+def delete(key):
+    from airflow.models import Variable
+    from airflow.settings import Session
+
+    session = Session()
+    try:
+        session.query(Variable).filter(Variable.key == key).delete()
+        session.commit()
+    finally:
+        session.close()
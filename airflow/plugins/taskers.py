@@ -2,15 +2,14 @@ import os
 import time
 import logging
 
-from google.cloud import storage
-from googleapiclient import discovery
-
 from constants import *
-import log_parser
+import blob_cache
+import metrics
 from helper_functions import print_alias, \
     wait_for_operation, create_instance, delete_instance, \
     unzip, download_blob_by_name, walktree_to_upload, \
-    assign_files, make_dirs, upload_blob, get_joinable_rear_path
+    assign_files, get_blobs, make_dirs, upload_blob, get_joinable_rear_path, cpu_quota_left, \
+    instance_statuses, stopped_instances, restart_instance
 
 log = logging.getLogger(__name__)
 
@@ -43,22 +42,69 @@ def xcom_pull(context, params):
             },
         }
     """
-    data = {}
     task_instance = context['ti']
-    # task_instance.xcom_pull(key='instance_info', task_ids='sync_task')
+    pairs = []
     for task_id in params.keys():
-        data[task_id] = {}
         keys = params[task_id] if isinstance(params[task_id], (list, tuple)) else [params[task_id]]
-        for key in keys:
-            data[task_id][key] = task_instance.xcom_pull(key=key, task_ids=task_id)
+        pairs.extend((task_id, key) for key in keys)
 
+    values = xcom_pull_many(task_instance, pairs)
+    data = dict((task_id, {}) for task_id in params.keys())
+    for task_id, key in pairs:
+        data[task_id][key] = values.get((task_id, key))
     return data
 
 
+def xcom_pull_many(task_instance, pairs):
+    """
+    Pulls the xcom values of many (task_id, key) pairs of the task instance's DAG run in a single
+    query of the metadata database, instead of one query per pair with task_instance.xcom_pull
+    (e.g. the sensors polling every worker task)
+    :param task_instance: task instance of the calling task
+    :param pairs: list of (task_id, key)
+    :return: {(task_id, key): value}, the pairs without a value are left out
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    metrics.incr('xcom.pulls')
+    metrics.incr('xcom.pulled_pairs', len(pairs))
+    try:
+        from airflow.models import XCom
+        from airflow.settings import Session
+        dag_id, execution_date = task_instance.dag_id, task_instance.execution_date
+    except (ImportError, AttributeError):
+        # not a task instance of the metadata database (e.g. benchmarks/pipeline_benchmark.py)
+        values = {}
+        for task_id, key in pairs:
+            value = task_instance.xcom_pull(key=key, task_ids=task_id)
+            if value is not None:
+                values[(task_id, key)] = value
+        return values
+
+    session = Session()
+    try:
+        rows = session.query(XCom.task_id, XCom.key, XCom.value).filter(
+            XCom.dag_id == dag_id,
+            XCom.execution_date == execution_date,
+            XCom.task_id.in_(set(task_id for task_id, _ in pairs)),
+            XCom.key.in_(set(key for _, key in pairs)),
+        ).order_by(XCom.timestamp.asc()).all()
+    finally:
+        session.close()
+    values = {}
+    for task_id, key, value in rows:  # the latest push wins, as with task_instance.xcom_pull
+        if (task_id, key) in pairs:
+            values[(task_id, key)] = value
+    return values
+
+
 def sync_folders(upload_blob_name, folder_root, bucket_name, ignores=None):
     """
     To sync the folders with the cloud storage for the compute instances to pull
     """
+    from google.cloud import storage
+
     storage_client = storage.Client()
     bucket = storage_client.get_bucket(bucket_name)
     blob_list = bucket.list_blobs()
@@ -69,24 +115,157 @@ def sync_folders(upload_blob_name, folder_root, bucket_name, ignores=None):
                        bucket_name=bucket_name, root_blob=upload_blob_name)
 
 
-def setup_instances(instances):
+def setup_instances(instances, machine_type=None, preemptible=False):
     """
-    will create instances, has to run on local/permanent machine
+    will create instances, has to run on local/permanent machine. The instances which already exist
+    (e.g. created by a previous try) are skipped.
+    :param machine_type: machine type of the instances, n1-standard-1 by default
+    :param preemptible: create preemptible instances
     """
+    from googleapiclient import discovery
+
     if not isinstance(instances, (list, tuple)):
         instances = [instances]
     project = PROJECT_NAME
     bucket = BUCKET_NAME
     zone = ZONE
     compute = discovery.build('compute', 'v1')
+    existing = instance_statuses(compute, project, zone)
     for instance in instances:
+        if instance in existing:
+            log.info("instance {} already exists".format(instance))
+            continue
         log.info('Creating instance.')
-        operation = create_instance(compute, project, zone, instance, bucket)
-        wait_for_operation(compute, project, zone, operation['name'])
+        with metrics.timer('gce.setup_instance'):
+            operation = create_instance(compute, project, zone, instance, bucket,
+                                        machine_type=machine_type or 'n1-standard-1', preemptible=preemptible)
+            wait_for_operation(compute, project, zone, operation['name'])
+        metrics.incr('gce.instances_created')
         log.info("instance {} created".format(instance))
 
 
-def worker_task(instance_no, total_instances, bin_data_source_blob):
+def existing_instances():
+    """
+    :return: names of the instances of the zone
+    """
+    from googleapiclient import discovery
+
+    return list(instance_statuses(discovery.build('compute', 'v1'), PROJECT_NAME, ZONE))
+
+
+def restart_preempted(instances):
+    """
+    Restarts the preempted (stopped) ones of the instances. The worker tasks lost with them are
+    retried by airflow and resume from their checkpoints (see checkpoints.py).
+    A restart failing for the lack of capacity is tried again at the next call.
+    :return: names of the instances restarted
+    """
+    from googleapiclient import discovery
+
+    compute = discovery.build('compute', 'v1')
+    restarted = []
+    for instance in stopped_instances(compute, PROJECT_NAME, ZONE, instances):
+        log.info("instance {} was preempted, restarting it".format(instance))
+        try:
+            operation = restart_instance(compute, PROJECT_NAME, ZONE, instance)
+            wait_for_operation(compute, PROJECT_NAME, ZONE, operation['name'])
+        except Exception as e:
+            log.warning("Could not restart {}: {}".format(instance, e))
+            continue
+        metrics.incr('gce.instances_restarted')
+        restarted.append(instance)
+    return restarted
+
+
+def unzip_to_bucket(zip_blob, bin_data_source_blob):
+    """
+    Downloads the zip files under `zip_blob`, uploading the files they contain under `bin_data_source_blob`
+    """
+    file_paths = download_blob_by_name(source_blob_name=zip_blob, bucket_name=BUCKET_NAME,
+                                       save_file_root=os.path.expanduser('~/zip_bin_log'))
+    for path in file_paths:
+        # unzipping the files
+        unzip_root = unzip(path)
+        os.remove(path)  # remove the file
+        walktree_to_upload(tree_root=unzip_root,
+                           root_blob=bin_data_source_blob)  # TODO: Make this upload faster using parallel uploads
+
+
+def input_bytes(inputs):
+    """
+    :return: estimated bytes of bin data of a run (see autoscale.input_size), from a prefix listing
+    """
+    from google.cloud import storage
+    import autoscale
+
+    bucket = storage.Client().get_bucket(BUCKET_NAME)
+    with metrics.timer('gcs.list'):
+        return autoscale.input_size(bucket, inputs['BIN_DATA_SOURCE_BLOB'], inputs['ZIP_BLOB'])[0]
+
+
+def _local_worker(kwargs):
+    # module level, the process pool pickles it
+    worker_task(**kwargs)
+    return kwargs['instance_no']
+
+
+def local_task(zip_blob, bin_data_source_blob, options, processes=None):
+    """
+    The unzip and worker tasks of a run on this host, without instances: unzips the input, then
+    runs a worker_task per core in a process pool
+    :param options: keyword arguments of worker_task, e.g. streaming or compression
+    :param processes: no. of worker processes, the no. of cores by default
+    """
+    import multiprocessing
+
+    with metrics.timer('local.unzip'):
+        unzip_to_bucket(zip_blob, bin_data_source_blob)
+    processes = processes or multiprocessing.cpu_count()
+    jobs = [dict(options, instance_no=instance_no, total_instances=processes,
+                 bin_data_source_blob=bin_data_source_blob) for instance_no in range(processes)]
+    log.info("Parsing {} with {} processes".format(bin_data_source_blob, processes))
+    pool = multiprocessing.Pool(processes)
+    try:
+        with metrics.timer('local.parse'):
+            for instance_no in pool.imap_unordered(_local_worker, jobs):
+                log.info("Local worker {} done".format(instance_no))
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def plan_fleet(inputs, max_instances):
+    """
+    Sizes the fleet of an autoscaled run (see autoscale.py) from a prefix listing of its input blobs
+    :param inputs: user inputs of the run (user_inputs.resolve)
+    :param max_instances: max no. of instances, the ones the DAG lays out worker tasks for
+    :return: the plan, autoscale.plan with the 'input_bytes' and 'files' it is based on
+    """
+    from google.cloud import storage
+    from googleapiclient import discovery
+    import autoscale
+
+    bucket = storage.Client().get_bucket(BUCKET_NAME)
+    with metrics.timer('gcs.list'):
+        input_bytes, files = autoscale.input_size(bucket, inputs['BIN_DATA_SOURCE_BLOB'], inputs['ZIP_BLOB'])
+    cpu_quota = cpu_quota_left(discovery.build('compute', 'v1'), PROJECT_NAME, ZONE)
+    fleet_plan = autoscale.plan(input_bytes, inputs['TARGET_SECONDS'], max_instances,
+                                min_instances=inputs['MIN_INSTANCES'],
+                                mbps_per_core=inputs['PARSE_MBPS_PER_CORE'] or autoscale.PARSE_MBPS_PER_CORE,
+                                machine_types=inputs['MACHINE_TYPES'], cpu_quota=cpu_quota, files=files)
+    fleet_plan.update(input_bytes=input_bytes, files=files)
+    log.info("fleet plan: {}".format(fleet_plan))
+    return fleet_plan
+
+
+def worker_task(instance_no, total_instances, bin_data_source_blob, streaming=False,
+                compression=None, compression_level=None, index_every=None, partition=False,
+                book_snapshot_interval=None, bar_interval=None, check_integrity=False, progress=None,
+                only_blobs=None, assignment=None, checkpoint_run=None, checkpoint_bytes=None, attempt=None,
+                publish=None):
     """
     get the task for the worker
     arguments contains the various parameters that will
@@ -96,22 +275,203 @@ def worker_task(instance_no, total_instances, bin_data_source_blob):
     :param instance_no: the instance_no, this process is running on
     :param total_instances: total no. of instances
     :param bin_data_source_blob: blob name of for binary data
+    :param streaming: parse the blobs straight from the download stream instead of
+        saving the raw binary files to ~/raw_data first
+    :param compression: None, 'gzip' or 'zstd'; the processed json is compressed while being
+        written and uploaded as it is
+    :param compression_level: level for the `compression`, None for its default
+    :param index_every: if set, an offset index with an entry every `index_every` messages is built
+        for every bin file and uploaded next to the processed data as <file>.bin.idx
+    :param partition: also store the messages bucketed by token under processed/<blob>/_partitions
+        for partitioned_store.query
+    :param book_snapshot_interval: if set, order books are rebuilt while parsing and their
+        top-of-book snapshots, taken on the changes of the top at most every interval (timestamp units,
+        0 for all of them), are uploaded as <file>.book.jsonl
+    :param bar_interval: if set, per token OHLCV/VWAP bars of this interval (timestamp units) are
+        computed while parsing and uploaded as <file>.bars.csv
+    :param check_integrity: check the seq_no continuity and heartbeats while parsing and upload
+        the summary as <file>.integrity.json
+    :param progress: callback for the progress reports of the worker over all its files
+        (see log_parser.Progress), besides logging them
+    :param only_blobs: names of the blobs to process instead of the share of `instance_no` (e.g. the
+        remaining files of a straggler for its speculative duplicate)
+    :param assignment: callback getting the names of the blobs assigned, in the processing order
+    :param checkpoint_run: id of the DAG run, to checkpoint the processing of every file and resume
+        from the checkpoints of a previous try (see checkpoints.py)
+    :param checkpoint_bytes: if set with `checkpoint_run`, also checkpoint the parsing of a file
+        every `checkpoint_bytes` bytes
+    :param attempt: id of the attempt (e.g. its task id) when other attempts may process the same
+        files, e.g. a speculative duplicate; its local files are kept under ~/attempts/<attempt>
+        instead of ~ and its checkpoints apart from the other attempts' ones
+    :param publish: callback getting the name of a blob once it is parsed, returns False when the
+        outputs of another attempt were uploaded for it, which are then not uploaded
     """
+    # the parser and its sinks (and the native decoding loop it builds) are only needed on the workers
+    import log_parser
+    from partitioned_store import PartitionWriter
+    from order_book import BookEngine
+    from bars import BarAggregator
+    from integrity import IntegrityChecker
+    import checkpoints
+
     if log:
         log_info = log.info
     else:
         log_info = print_alias
 
-    BIN_DATA_STORAGE = os.path.expanduser('~/raw_data')  # binary will be stored in ~/raw_data
+    # local root of the files of this attempt, the processed ones are uploaded under the same names
+    WORK_ROOT = os.path.expanduser(os.path.join('~', 'attempts', attempt) if attempt else '~')
+    BIN_DATA_STORAGE = os.path.join(WORK_ROOT, 'raw_data')  # binary will be stored in ~/raw_data
     PROCESSED_DATA_BLOB_NAME = "processed/" + bin_data_source_blob  # blob name for processed data
-    PROCESSED_DATA_STORAGE = os.path.expanduser('~/' + PROCESSED_DATA_BLOB_NAME)  # processed data storage loc
+    PROCESSED_DATA_STORAGE = os.path.join(WORK_ROOT, PROCESSED_DATA_BLOB_NAME)  # processed data storage loc
+    PARTITIONED_DATA_STORAGE = os.path.join(PROCESSED_DATA_STORAGE, '_partitions')
+    processed_suffix = '.json' + log_parser.COMPRESSION_SUFFIXES[compression]
+    upload_kwargs = {
+        'content_type': 'application/json' if compression != 'zstd' else 'application/zstd',
+        'content_encoding': 'gzip' if compression == 'gzip' else None,
+    }
+
+    def parse_options(joinable_rel_file_name):
+        """
+        :return: keyword arguments of log_parser.main/open_stream for a bin file and the
+            [(path, upload_blob kwargs)] of the outputs known before parsing
+        """
+        base_name = os.path.join(PROCESSED_DATA_STORAGE, joinable_rel_file_name)
+        options = {
+            'save_filename': base_name.replace('.bin', processed_suffix),
+            'compression': compression,
+            'compression_level': compression_level,
+            'sinks': [],
+        }
+        outputs = [(options['save_filename'], upload_kwargs)]
+        if index_every:
+            options['index_filename'] = base_name + '.idx'
+            options['index_every'] = index_every
+            outputs.append((options['index_filename'], {}))
+        if partition:
+            options['sinks'].append(PartitionWriter(PARTITIONED_DATA_STORAGE,
+                                                    joinable_rel_file_name.replace('.bin', '')))
+        if book_snapshot_interval is not None:
+            options['sinks'].append(BookEngine(base_name.replace('.bin', '.book.jsonl'),
+                                               snapshot_interval=book_snapshot_interval))
+        if bar_interval:
+            options['sinks'].append(BarAggregator(base_name.replace('.bin', '.bars.csv'), bar_interval))
+        if check_integrity:
+            options['integrity'] = IntegrityChecker(base_name.replace('.bin', '.integrity.json'),
+                                                    name=joinable_rel_file_name)
+        make_dirs(os.path.dirname(options['save_filename']))
+        return options, outputs
+
+    def upload_outputs(blob, options, outputs):
+        if publish is not None and not publish(blob.name):
+            log_info('{} already published by another attempt, not uploaded'.format(blob.name))
+            return
+        for sink in options['sinks'] + [options.get('integrity')]:
+            if sink is not None:
+                outputs.extend((path, {}) for path in sink.paths())
+        with metrics.timer('worker.upload'):
+            for path, kwargs in outputs:
+                upload_blob(source_file_path=path, destination_blob_name=os.path.relpath(path, WORK_ROOT).replace(os.sep, '/'),
+                            bucket_name=BUCKET_NAME, **kwargs)
 
-    assigned_blobs = assign_files(instance_no=instance_no,
-                                  total_instances=total_instances,
-                                  bin_data_source_blob=bin_data_source_blob)
+    def resume(options, checkpoint):
+        """
+        Sets the parsing of a file up to resume from its checkpoint, when its outputs allow it
+        :return: offset of the capture to parse from
+        """
+        if checkpoint is None or not checkpoint_bytes or options['sinks'] or options.get('index_filename'):
+            return 0  # the state of the other sinks is not checkpointed, parsed from the start
+        integrity = options.get('integrity')
+        state = checkpoint.state
+        if integrity is not None and state['offset'] and state.get('integrity') is None:
+            return 0  # checkpointed without the integrity checks
+
+        def add_part(path, start, end, records, heartbeat):
+            # the checks are at `end` too: the parser passes a message to the output before checking it
+            checkpoint.add_part(path, start, end, records, heartbeat,
+                                integrity=integrity.state() if integrity is not None else None)
+
+        checkpoint.download_parts(options['save_filename'], log_parser.part_path)
+        if integrity is not None and state['offset']:
+            integrity.restore(state['integrity'])
+        options['output'] = log_parser.PartedJsonOutput(options['save_filename'], checkpoint_bytes,
+                                                        add_part, compression, compression_level,
+                                                        start=state['offset'], parts=state['parts'],
+                                                        records=state['records'], heartbeat=state['heartbeat'])
+        options['offset'] = state['offset']
+        if state['offset']:
+            log_info('Resuming {} from offset {}'.format(checkpoint.blob_name, state['offset']))
+        return state['offset']
+
+    with metrics.timer('worker.list'):
+        if only_blobs is not None:
+            assigned_blobs = get_blobs(only_blobs, bin_data_source_blob)
+        else:
+            assigned_blobs = assign_files(instance_no=instance_no,
+                                          total_instances=total_instances,
+                                          bin_data_source_blob=bin_data_source_blob)
+    file_checkpoints = dict((blob.name, None) for blob in assigned_blobs)
+    if checkpoint_run:
+        from google.cloud import storage
+
+        checkpoint_bucket = storage.Client().get_bucket(BUCKET_NAME)
+        with metrics.timer('worker.checkpoints'):
+            file_checkpoints = dict(
+                (blob.name, checkpoints.FileCheckpoint(checkpoint_bucket, checkpoint_run, blob.name, attempt))
+                for blob in assigned_blobs)
+        done_blobs = [blob for blob in assigned_blobs if file_checkpoints[blob.name].done]
+        if done_blobs:
+            log_info('Files done by a previous try, skipped: ' + str(done_blobs))
+            metrics.incr('worker.files_resumed', len(done_blobs))
+        assigned_blobs = [blob for blob in assigned_blobs if blob not in done_blobs]
+    if assignment is not None:
+        assignment([blob.name for blob in assigned_blobs])
+    metrics.incr('worker.files', len(assigned_blobs))
+    metrics.incr('worker.bytes_assigned', sum(blob.size or 0 for blob in assigned_blobs))
+
+    def file_done(blob):
+        checkpoint = file_checkpoints[blob.name]
+        if checkpoint is not None:
+            checkpoint.mark_done()
+
+    def report_progress(report, log_report=log_parser.log_progress(log)):
+        log_report(report)
+        if progress is not None:
+            progress(report)
+
+    worker_progress = log_parser.Progress(report_progress, name='worker {}'.format(instance_no),
+                                          total_bytes=sum((blob.size or 0) - (file_checkpoints[blob.name].offset
+                                                                              if file_checkpoints[blob.name] else 0)
+                                                          for blob in assigned_blobs),
+                                          files=len(assigned_blobs))
     log_info("Instance_no: {}".format(instance_no))
     log_info('Blobs assigned: ' + str(assigned_blobs))
 
+    if streaming:
+        for blob in assigned_blobs:
+            rel_file_name = blob.name.replace(bin_data_source_blob, '')
+            options, outputs = parse_options(get_joinable_rear_path(rel_file_name))
+            offset = resume(options, file_checkpoints[blob.name])
+
+            # a cached copy is not evicted while it is being parsed
+            with blob_cache.reading(blob) as cached_path:
+                if cached_path:
+                    with metrics.timer('worker.parse'):
+                        log_parser.main(log, filename=cached_path, progress=worker_progress, **options)
+            if not cached_path:
+                # the parser is fed chunk by chunk while the blob is being downloaded, from the
+                # checkpoint's offset when resumed (`start` of google-cloud-storage 1.10)
+                with metrics.timer('worker.download_parse'), \
+                        log_parser.open_stream(logger=log, name=blob.name, progress=worker_progress,
+                                               **options) as parser:
+                    blob.chunk_size = STREAM_CHUNK_SIZE
+                    blob.download_to_file(parser, start=offset or None)
+            log_info('File {} parsed to {}'.format(str(blob.name), options['save_filename']))
+            upload_outputs(blob, options, outputs)
+            file_done(blob)
+        worker_progress.update(0, 0, force=True)
+        return
+
     # downloading the files
     file_names = []
     for blob in assigned_blobs:  # downloading bin files
@@ -119,34 +479,110 @@ def worker_task(instance_no, total_instances, bin_data_source_blob):
         joinable_rel_file_name = get_joinable_rear_path(rel_file_name)
         filename = os.path.join(BIN_DATA_STORAGE, joinable_rel_file_name)   # absolute path for raw_data
         make_dirs(os.path.dirname(filename))
-        blob.download_to_filename(filename)
+        with metrics.timer('worker.download'):
+            blob_cache.download(blob, filename)
         log_info('File {} downloaded to {}'.format(str(blob.name), filename))
         file_names.append(filename)
 
-    save_names = []
-    upload_names = []
-    for filename in file_names:
+    worker_progress.start = time.time()  # the rates are the parsing ones, downloads are done
+    for blob, filename in zip(assigned_blobs, file_names):
         # processing the file
-        save_filename = filename.replace(BIN_DATA_STORAGE, PROCESSED_DATA_STORAGE).replace('.bin', '.json')
-        make_dirs(os.path.dirname(save_filename))
-        log_parser.main(log, filename=filename, save_filename=save_filename)
-        save_names.append(save_filename)
+        options, outputs = parse_options(get_joinable_rear_path(filename.replace(BIN_DATA_STORAGE, '')))
+        resume(options, file_checkpoints[blob.name])
+        with metrics.timer('worker.parse'):
+            log_parser.main(log, filename=filename, progress=worker_progress, **options)
 
-        # uploading the file
-        upload_name = save_filename.replace(os.path.expanduser('~/'), '')
-        upload_blob(source_file_path=save_filename,
-                    destination_blob_name=upload_name, bucket_name=BUCKET_NAME)
-        upload_names.append(upload_name)
+        # uploading the files
+        upload_outputs(blob, options, outputs)
+        file_done(blob)
+    worker_progress.update(0, 0, force=True)
 
-        # print ("file_names: {}".format(file_names))
-        # print ("save_names: {}".format(save_names))
-        # print ("upload_names: {}".format(upload_names))
+
+def delete_checkpoints(run_id):
+    """
+    Deletes the checkpoints of the worker tasks of a finished DAG run, see checkpoints.py
+    """
+    from google.cloud import storage
+    import checkpoints
+
+    deleted = checkpoints.delete_run(storage.Client().get_bucket(BUCKET_NAME), run_id)
+    log.info("{} checkpoint blobs of {} deleted".format(deleted, run_id))
+
+
+def aggregate_progress(reports, workers):
+    """
+    Fleet wide progress from the last progress reports of the workers
+    :param reports: progress reports (log_parser.Progress) of the workers, None for the ones
+        that did not report yet
+    :param workers: total no. of workers
+    :return: <type: dict> bytes, total_bytes, messages, msgs_per_sec and bytes_per_sec of the
+        running workers, eta_seconds and finish_at (None until every worker reported)
+    """
+    now = time.time()
+    received = [report for report in reports if report]
+    running = [report for report in received if not report['done']]
+    # the ETAs are as of the reports, `reported_at` is set by WorkerOperator
+    etas = [max(0.0, report['eta_seconds'] - (now - report.get('reported_at', now)))
+            if report['eta_seconds'] is not None else None for report in received]
+    eta = max(etas) if len(received) == workers and None not in etas else None
+    return {
+        'workers': workers,
+        'workers_reporting': len(received),
+        'workers_done': len(received) - len(running),
+        'bytes': sum(report['bytes'] for report in received),
+        'total_bytes': sum(report['total_bytes'] or 0 for report in received),
+        'messages': sum(report['messages'] for report in received),
+        'msgs_per_sec': sum(report['msgs_per_sec'] for report in running),
+        'bytes_per_sec': sum(report['bytes_per_sec'] for report in running),
+        'eta_seconds': eta,
+        'finish_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now + eta)) if eta is not None
+        else None,
+    }
+
+
+def find_stragglers(reports, slowdown, min_seconds):
+    """
+    Workers falling well behind the fleet, worth a speculative duplicate
+    :param reports: progress reports of the workers (see aggregate_progress), None for the ones
+        that did not report yet
+    :param slowdown: a worker is a straggler when its throughput is below the fleet median / slowdown
+    :param min_seconds: ... and it still has more than that to go
+    :return: indices of the stragglers in `reports`
+    """
+    now = time.time()
+    rates = sorted(report['bytes_per_sec'] for report in reports if report and report['bytes_per_sec'])
+    if len(rates) < 2:
+        return []
+    median = rates[len(rates) // 2] if len(rates) % 2 else (rates[len(rates) // 2 - 1] + rates[len(rates) // 2]) / 2.0
+    stragglers = []
+    for i, report in enumerate(reports):
+        if not report or report['done'] or report['eta_seconds'] is None:
+            continue
+        eta = report['eta_seconds'] - (now - report.get('reported_at', now))
+        if report['bytes_per_sec'] < median / slowdown and eta > min_seconds:
+            stragglers.append(i)
+    return stragglers
+
+
+def upload_profiles(paths, bin_data_source_blob):
+    """
+    Uploads the profile files of a worker task next to the processed data,
+    under processed/<bin_data_source_blob>/_profiles
+    """
+    for path in paths:
+        upload_blob(source_file_path=path,
+                    destination_blob_name='/'.join(['processed', bin_data_source_blob, '_profiles',
+                                                    os.path.basename(path)]),
+                    bucket_name=BUCKET_NAME)
+        log.info("profile {} uploaded".format(path))
 
 
 def delete_instances(instances):
     """
     has to run on the local/permanent machine to destroy the instances after completion of work.
     """
+    from googleapiclient import discovery
+
     project = PROJECT_NAME
     zone = ZONE
     for instance in instances:
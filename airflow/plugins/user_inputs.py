@@ -0,0 +1,192 @@
+"""
+User inputs of process_dag: the latest document of airflow_db.user_inputs, overridden by the
+DAG run conf (`airflow trigger_dag process_dag -c '{"STREAMING": true}'`).
+
+They are resolved at run time by SyncOperator (`resolve`) and passed on to the other tasks
+through xcom. The DAG file only needs NO_OF_INSTANCES to lay out the worker tasks; it reads it
+with `cached`, from a local cache file refreshed at most every USER_INPUTS_CACHE_TTL seconds, so
+that the scheduler does not hit the database on every parse of the DAG file.
+
+Document structure:
+    {
+        "NO_OF_INSTANCES": <int>,
+        "BIN_DATA_SOURCE_BLOB": <str> root blob name for the binary files
+        "ZIP_BLOB": <str> prefix of the root directory of bin files without trailing `/`
+        "STREAMING": <bool> (optional) parse the bin files straight from the download stream
+        "COMPRESSION": <str> (optional) 'gzip' or 'zstd' compression of the processed data
+        "COMPRESSION_LEVEL": <int> (optional) level for the COMPRESSION
+        "INDEX_EVERY": <int> (optional) build offset index sidecars with an entry every INDEX_EVERY messages
+        "PARTITION": <bool> (optional) also store the processed data bucketed by token for the queries
+        "BOOK_SNAPSHOT_INTERVAL": <int> (optional) rebuild the order books, snapshotting their top changes at most every interval (0: all)
+        "BAR_INTERVAL": <int> (optional) compute per token OHLCV/VWAP bars of this interval
+        "CHECK_INTEGRITY": <bool> (optional, default true) report seq_no gaps/duplicates while parsing
+        "PROFILE": <str> (optional) 'sample' or 'cprofile' to profile the worker tasks, see profiling.py
+        "EXECUTION_MODE": <str> (optional, default 'auto') 'gce' to run on instances, 'local' to run on
+            this host with a process pool (no instances), 'auto' for 'local' up to LOCAL_MAX_BYTES of input
+        "LOCAL_MAX_BYTES": <int> (optional, default 4 GiB) largest input run locally in the 'auto' mode
+        "MACHINE_TYPE": <str> (optional, default n1-standard-1) machine type of the instances, which run
+            a worker task per vCPU
+        "AUTOSCALE": <bool> (optional) size the fleet from the input size, NO_OF_INSTANCES being the
+            largest one, see autoscale.py
+        "TARGET_SECONDS": <int> (optional, default 3600) wanted duration of an autoscaled run
+        "MIN_INSTANCES": <int> (optional, default 1) smallest autoscaled fleet
+        "PARSE_MBPS_PER_CORE": <float> (optional) measured parse throughput of a core, MB/s
+        "MACHINE_TYPES": <list> (optional) machine types the autoscaling may choose from, e.g.
+            ["n1-standard-1", "n1-standard-4"]
+        "WARM_POOL_SIZE": <int> (optional, default 0) idle instances kept for the next runs, see warm_pool.py
+        "WARM_POOL_TTL": <int> (optional, default 1800) seconds after which an idle instance is deleted
+        "SPECULATIVE_TASKS": <int> (optional, default 0) spare worker tasks for the speculative
+            duplicates of the stragglers
+        "SPECULATION_SLOWDOWN": <float> (optional, default 2.0) a worker is a straggler when its
+            throughput is below the fleet median / SPECULATION_SLOWDOWN ...
+        "SPECULATION_MIN_SECONDS": <int> (optional, default 120) ... and it has more than that to go
+        "PREEMPTIBLE": <bool> (optional) run the workers on preemptible instances, the worker tasks
+            lost with a preempted instance resume from their checkpoints, see checkpoints.py
+        "CHECKPOINT_BYTES": <int> (optional, default 64 MiB) bytes of a bin file parsed between two
+            checkpoints of a preemptible worker, 0 to checkpoint whole files only
+    }
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+
+log = logging.getLogger(__name__)
+
+MONGO_HOST = os.environ.get('USER_INPUTS_MONGO_HOST')  # None: localhost
+MONGO_TIMEOUT_MS = 500  # the DAG file parse must not wait on an unreachable database
+USER_INPUTS_CACHE = os.environ.get('USER_INPUTS_CACHE',
+                                   os.path.join(tempfile.gettempdir(), 'airflow_user_inputs.json'))
+USER_INPUTS_CACHE_TTL = int(os.environ.get('USER_INPUTS_CACHE_TTL', 300))
+
+DEFAULTS = {
+    'NO_OF_INSTANCES': 3,
+    'BIN_DATA_SOURCE_BLOB': 'bin_log',
+    'ZIP_BLOB': 'zip_blob',
+    'STREAMING': False,
+    'COMPRESSION': None,
+    'COMPRESSION_LEVEL': None,
+    'INDEX_EVERY': None,
+    'PARTITION': False,
+    'BOOK_SNAPSHOT_INTERVAL': None,
+    'BAR_INTERVAL': None,
+    'CHECK_INTEGRITY': True,
+    'PROFILE': None,
+    'EXECUTION_MODE': 'auto',
+    'LOCAL_MAX_BYTES': 4 * 1024 ** 3,
+    'MACHINE_TYPE': 'n1-standard-1',
+    'AUTOSCALE': False,
+    'TARGET_SECONDS': 3600,
+    'MIN_INSTANCES': 1,
+    'PARSE_MBPS_PER_CORE': None,
+    'MACHINE_TYPES': None,
+    'WARM_POOL_SIZE': 0,
+    'WARM_POOL_TTL': 1800,
+    'SPECULATIVE_TASKS': 0,
+    'SPECULATION_SLOWDOWN': 2.0,
+    'SPECULATION_MIN_SECONDS': 120,
+    'PREEMPTIBLE': False,
+    'CHECKPOINT_BYTES': 64 * 1024 * 1024,
+}
+
+
+def normalize(document):
+    """
+    :return: the user inputs of `document` with the defaults for the missing ones, typed
+    """
+    inputs = dict(DEFAULTS)
+    inputs.update((key, value) for key, value in (document or {}).items() if key in DEFAULTS)
+    inputs['NO_OF_INSTANCES'] = int(inputs['NO_OF_INSTANCES'] or 0) or 1  # at least 1 instance
+    inputs['BIN_DATA_SOURCE_BLOB'] = str(inputs['BIN_DATA_SOURCE_BLOB'])
+    inputs['ZIP_BLOB'] = str(inputs['ZIP_BLOB'])
+    inputs['MACHINE_TYPE'] = str(inputs['MACHINE_TYPE'] or DEFAULTS['MACHINE_TYPE'])
+    inputs['EXECUTION_MODE'] = str(inputs['EXECUTION_MODE'] or DEFAULTS['EXECUTION_MODE']).lower()
+    if inputs['EXECUTION_MODE'] not in ('auto', 'gce', 'local'):
+        raise ValueError("Unknown EXECUTION_MODE {}, expected auto, gce or local".format(inputs['EXECUTION_MODE']))
+    for key in ('STREAMING', 'PARTITION', 'CHECK_INTEGRITY', 'AUTOSCALE', 'PREEMPTIBLE'):
+        inputs[key] = bool(inputs[key])
+    for key in ('COMPRESSION', 'PROFILE', 'PARSE_MBPS_PER_CORE', 'MACHINE_TYPES'):
+        inputs[key] = inputs[key] or None
+    for key in ('TARGET_SECONDS', 'WARM_POOL_SIZE', 'WARM_POOL_TTL', 'SPECULATIVE_TASKS', 'SPECULATION_MIN_SECONDS',
+                'CHECKPOINT_BYTES', 'LOCAL_MAX_BYTES'):
+        inputs[key] = int(inputs[key] or 0)
+    inputs['SPECULATION_SLOWDOWN'] = float(inputs['SPECULATION_SLOWDOWN'] or DEFAULTS['SPECULATION_SLOWDOWN'])
+    inputs['MIN_INSTANCES'] = min(max(int(inputs['MIN_INSTANCES'] or 1), 1), inputs['NO_OF_INSTANCES'])
+    return inputs
+
+
+def fetch_latest(host=MONGO_HOST, timeout_ms=MONGO_TIMEOUT_MS):
+    """
+    :return: the latest user inputs document, None if there is none. The _ids being ObjectIds,
+        the latest is found on the _id index without scanning the collection.
+    """
+    from pymongo import MongoClient, DESCENDING
+
+    client = MongoClient(host=host, serverSelectionTimeoutMS=timeout_ms, connectTimeoutMS=timeout_ms)
+    try:
+        document = client['airflow_db']['user_inputs'].find_one(sort=[('_id', DESCENDING)])
+    finally:
+        client.close()
+    if document is not None:
+        document.pop('_id', None)
+    return document
+
+
+def _read_cache(path):
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_cache(inputs, path=USER_INPUTS_CACHE):
+    try:
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(inputs, cache_file)
+        os.rename(tmp_path, path)  # readers never see a half written file
+    except (IOError, OSError) as e:
+        log.warning("Could not write the user inputs cache {}: {}".format(path, e))
+
+
+def cached(path=USER_INPUTS_CACHE, ttl=USER_INPUTS_CACHE_TTL):
+    """
+    User inputs for the DAG file parse: from the cache file while it is fresh, else from the
+    database (refreshing the cache), else from the stale cache, else the defaults
+    """
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        age = None
+    cached_inputs = _read_cache(path)
+    if cached_inputs is not None and age is not None and age < ttl:
+        return normalize(cached_inputs)
+    try:
+        inputs = normalize(fetch_latest())
+    except Exception as e:
+        log.info("Could not fetch the user inputs: {}".format(e))
+        if cached_inputs is not None:
+            os.utime(path, None)  # stale but better than the defaults, retried after the ttl
+            return normalize(cached_inputs)
+        write_cache({}, path)  # the defaults until the database is back, retried after the ttl
+        return normalize(None)
+    write_cache(inputs, path)
+    return inputs
+
+
+def resolve(dag_run_conf=None):
+    """
+    User inputs for a DAG run: the latest database document overridden by the run's conf.
+    The cache used by the DAG file is refreshed on the way.
+    """
+    try:
+        document = fetch_latest()
+        write_cache(normalize(document))
+    except Exception as e:
+        log.warning("Could not fetch the user inputs, using the cached ones: {}".format(e))
+        document = _read_cache(USER_INPUTS_CACHE)
+    document = dict(document or {})
+    document.update(dag_run_conf or {})
+    return normalize(document)
@@ -0,0 +1,122 @@
+"""
+Warm pool of worker instances kept between the runs of process_dag (user input WARM_POOL_SIZE).
+
+Instead of deleting its instances, CompletionOperator parks up to WARM_POOL_SIZE of them in the
+pool, idle but booted and registered as celery workers. SyncOperator takes the instances of the
+next run from the pool first, SetupOperator creates only the shortfall, so that back-to-back runs
+skip the boot and provisioning of the instances. The idle instances are deleted after
+WARM_POOL_TTL seconds by the warm_pool_reaper DAG.
+
+The pool lives in the airflow Variable `gce_warm_pool` (see shared_state.py):
+    {
+        <instance name>: {
+            "machine_type": <str>,
+            "preemptible": <bool>,
+            "code_version": <str> code_version() of the airflow home the instance was booted with,
+            "idle_since": <epoch seconds>, 0 to be deleted by the next reaping
+        },
+    }
+An instance only downloads the airflow home at boot, so it is only reused by the runs of the
+same code_version. An instance never deletes itself: a task running on an instance to be deleted
+parks it for the next reaping instead.
+"""
+import os
+import time
+import socket
+import hashlib
+import logging
+
+import shared_state
+
+log = logging.getLogger(__name__)
+
+POOL_VARIABLE = 'gce_warm_pool'
+CODE_EXTENSIONS = ('.py', '.pyx', '.sh', '.cfg')
+
+
+def code_version(airflow_home=None):
+    """
+    :return: hash of the dags and plugins of the airflow home (the current directory by default)
+    """
+    airflow_home = airflow_home or os.getcwd()
+    digest = hashlib.sha1()
+    for folder in ('dags', 'plugins'):
+        for root, dirs, files in os.walk(os.path.join(airflow_home, folder)):
+            dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+            for name in sorted(files):
+                if name.endswith(CODE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, airflow_home).encode('utf-8'))
+                    with open(path, 'rb') as code_file:
+                        digest.update(code_file.read())
+    return digest.hexdigest()[:16]
+
+
+def locked_pool():
+    """
+    The pool (dict, see the module doc) to be read and changed in a `with` block, see shared_state.locked
+    """
+    return shared_state.locked(POOL_VARIABLE)
+
+
+def acquire(count, machine_type, version, preemptible=False):
+    """
+    Takes up to `count` idle instances of the machine type, code version and preemptibility out of
+    the pool, the most recently parked first
+    :return: names of the instances taken
+    """
+    with locked_pool() as pool:
+        matching = sorted((entry['idle_since'], name) for name, entry in pool.items()
+                          if entry['machine_type'] == machine_type and entry['code_version'] == version
+                          and entry.get('preemptible', False) == preemptible and entry['idle_since'])
+        taken = [name for _, name in reversed(matching)][:count]
+        for name in taken:
+            del pool[name]
+    log.info("{} instances taken from the warm pool: {}".format(len(taken), taken))
+    return taken
+
+
+def release(instances, machine_type, version, pool_size, preemptible=False):
+    """
+    Parks up to `pool_size` of the instances of a finished run in the pool, the instance running
+    this task being parked for deletion at the next reaping
+    :return: names of the instances to be deleted now
+    """
+    hostname = socket.gethostname()
+    if not pool_size and hostname not in instances:
+        return list(instances)
+    now = time.time()
+    to_delete = []
+    with locked_pool() as pool:
+        idle = sum(1 for entry in pool.values() if entry['idle_since'])
+        for name in instances:
+            if idle < pool_size:
+                pool[name] = {'machine_type': machine_type, 'code_version': version, 'preemptible': preemptible,
+                              'idle_since': now}
+                idle += 1
+            elif name == hostname:
+                pool[name] = {'machine_type': machine_type, 'code_version': version, 'preemptible': preemptible,
+                              'idle_since': 0}
+            else:
+                to_delete.append(name)
+    log.info("{} instances parked in the warm pool, {} to be deleted".format(
+        len(instances) - len(to_delete), len(to_delete)))
+    return to_delete
+
+
+def expire(ttl, version=None):
+    """
+    Takes out of the pool the instances idle for more than `ttl` seconds, the ones parked for
+    deletion and, if `version` is given, the ones of another code version; except the instance
+    running this task
+    :return: names of the instances to be deleted
+    """
+    hostname = socket.gethostname()
+    now = time.time()
+    with locked_pool() as pool:
+        expired = [name for name, entry in pool.items()
+                   if name != hostname and (now - entry['idle_since'] > ttl or
+                                            (version is not None and entry['code_version'] != version))]
+        for name in expired:
+            del pool[name]
+    return expired
@@ -0,0 +1,121 @@
+"""
+Benchmark of order_book.BookEngine: msgs/sec of the book rebuilding alone (the messages being
+decoded beforehand) and of the whole parse with it, for a few snapshot intervals, on a synthetic
+capture (capture_generator).
+
+    python benchmarks/book_benchmark.py --messages 1000000
+    python benchmarks/book_benchmark.py --capture real.bin --intervals 0,1000000 --engine python
+
+Results are printed as a table, and saved as json with --output for comparing machines or commits.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PLUGINS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'plugins'))
+sys.path.insert(0, PLUGINS_DIR)
+
+import log_parser  # noqa: E402
+from order_book import BookEngine, ORDER_MSG_TYPES, TRADE_MSG_TYPE  # noqa: E402
+
+
+class _Collector(object):
+    def __init__(self):
+        self.messages = []
+
+    def add(self, offset, header, record):
+        if header.msg_type in ORDER_MSG_TYPES or header.msg_type == TRADE_MSG_TYPE:
+            self.messages.append((offset, header, record))
+
+    def close(self):
+        pass
+
+
+def _parse(capture, sinks, engine):
+    parser = log_parser.StreamParser(sinks, engine=engine)
+    with open(capture, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(log_parser.READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+    parser.close()
+    return parser.counter
+
+
+def run(capture, interval, engine, work_dir, messages):
+    """
+    Times the BookEngine with a snapshot `interval` on the decoded `messages` of the capture, then
+    in a parse of the capture
+    :return: result dict
+    """
+    save_filename = os.path.join(work_dir, 'out.book.jsonl')
+    book = BookEngine(save_filename, snapshot_interval=interval)
+    start = time.time()
+    for offset, header, record in messages:
+        book.add(offset, header, record)
+    book.close()
+    book_seconds = time.time() - start
+    with open(save_filename) as snapshots_file:
+        snapshots = sum(1 for _ in snapshots_file)
+
+    start = time.time()
+    parsed = _parse(capture, [BookEngine(save_filename, snapshot_interval=interval)], engine)
+    parse_seconds = time.time() - start
+    return {
+        'interval': interval,
+        'engine': engine,
+        'book_messages': len(messages),
+        'snapshots': snapshots,
+        'book_seconds': book_seconds,
+        'book_msgs_per_sec': len(messages) / book_seconds if book_seconds else 0.0,
+        'messages': parsed,
+        'parse_seconds': parse_seconds,
+        'parse_msgs_per_sec': parsed / parse_seconds if parse_seconds else 0.0,
+    }
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmarks the order book rebuilding of order_book.BookEngine")
+    arg_parser.add_argument('--capture', help="capture to parse, a synthetic one is generated if not given")
+    arg_parser.add_argument('--messages', type=int, default=500000, help="messages of the synthetic capture")
+    arg_parser.add_argument('--tokens', type=int, default=100)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--intervals', default='0,1000000',
+                            help="comma separated snapshot intervals (timestamp units), 0 on every top change")
+    arg_parser.add_argument('--engine', help="decoding engine of the parse, the default one if not given")
+    arg_parser.add_argument('--output', help="json file to save the results to")
+    args = arg_parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='book_benchmark_')
+    try:
+        capture = args.capture
+        if not capture:
+            from capture_generator import generate_capture
+            capture = os.path.join(work_dir, 'capture.bin')
+            count, size = generate_capture(capture, messages=args.messages, tokens=args.tokens, seed=args.seed)
+            sys.stderr.write("Generated {}: {} messages, {:.1f} MB\n".format(capture, count, size / 1048576.0))
+        available = log_parser.engines()  # the native loop is built out of the timing
+        engine = args.engine or (log_parser.DEFAULT_ENGINE if log_parser.DEFAULT_ENGINE in available else 'python')
+        if engine not in available:
+            arg_parser.error("engine not available here: {}".format(engine))
+        collector = _Collector()
+        _parse(capture, [collector], engine)
+        results = [run(capture, int(interval), engine, work_dir, collector.messages)
+                   for interval in args.intervals.split(',')]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("{:<10} {:<8} {:>10} {:>14} {:>15}".format('interval', 'engine', 'snapshots', 'book msgs/sec',
+                                                     'parse msgs/sec'))
+    for result in results:
+        print("{interval:<10} {engine:<8} {snapshots:>10,} {book_msgs_per_sec:>14,.0f} "
+              "{parse_msgs_per_sec:>15,.0f}".format(**result))
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'python': sys.version, 'results': results}, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Deterministic generator of synthetic .bin captures in the exchange's tick-by-tick layout
+(log_parser's StreamHeader + payloads), for the benchmarks and for trying the pipeline
+without a real capture. The same arguments always give byte-identical captures.
+
+The messages follow a per-token order book: new orders around a random walking price,
+modifies and cancels of live orders, trades between live bids and asks, the same for the
+spread messages, and heartbeats carrying the last seq_no of their stream.
+
+    python benchmarks/capture_generator.py capture.bin --messages 1000000 --tokens 200
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'plugins')))
+
+from log_parser import DECODERS, HEADER_SIZE  # noqa: E402
+
+HEADER = struct.Struct('<hhic')
+# share of every kind of message, need not add up to 1
+DEFAULT_MIX = {
+    'order': 0.70,
+    'trade': 0.20,
+    'spread': 0.08,
+    'heartbeat': 0.02,
+}
+TIMESTAMP_START = 1530000000000000  # microseconds
+WRITE_BATCH = 10000  # no. of messages packed before hitting the file
+
+
+class _Token(object):
+    def __init__(self, price):
+        self.price = price
+        self.bids = []  # [order_id, price, quantity]
+        self.asks = []
+
+
+class CaptureGenerator(object):
+    """
+    Generates the messages of a synthetic capture
+    :param tokens: no. of instruments
+    :param streams: no. of stream_ids, a token always goes to the same stream
+    :param mix: share of 'order', 'trade', 'spread' and 'heartbeat' messages, see DEFAULT_MIX
+    :param gap_rate: share of seq_nos skipped, to exercise the integrity checks
+    :param seed: seed of the random generator
+    """
+
+    def __init__(self, tokens=100, streams=4, mix=None, gap_rate=0.0, seed=0):
+        self.random = random.Random(seed)
+        self.tokens = [_Token(self.random.randint(100, 500000)) for _ in range(tokens)]
+        self.spreads = [_Token(self.random.randint(1, 5000)) for _ in range(max(1, tokens // 10))]
+        self.streams = streams
+        self.gap_rate = gap_rate
+        mix = mix or DEFAULT_MIX
+        self.kinds = sorted(mix)
+        total = float(sum(mix.values()))
+        self.thresholds = []
+        cumulative = 0.0
+        for kind in self.kinds:
+            cumulative += mix[kind] / total
+            self.thresholds.append(cumulative)
+        self.seq_nos = [0] * streams
+        self.timestamp = TIMESTAMP_START
+        self.next_order_id = 1
+        self.order_layout = DECODERS[b'N'].layout
+        self.trade_layout = DECODERS[b'T'].layout
+        self.heartbeat_layout = DECODERS[b'Z'].layout
+
+    def _seq_no(self, stream_id):
+        self.seq_nos[stream_id] += 1
+        if self.gap_rate and self.random.random() < self.gap_rate:
+            self.seq_nos[stream_id] += self.random.randint(1, 10)
+        return self.seq_nos[stream_id]
+
+    def _message(self, msg_type, stream_id, payload):
+        return HEADER.pack(HEADER_SIZE + len(payload), stream_id, self._seq_no(stream_id), msg_type) + payload
+
+    def _order(self, index, book, msg_types):
+        rnd = self.random
+        stream_id = index % self.streams
+        book.price = max(1, book.price + rnd.randint(-5, 5))
+        side = rnd.random() < 0.5
+        orders = book.bids if side else book.asks
+        roll = rnd.random()
+        if not orders or roll < 0.5 or len(orders) > 200:
+            if len(orders) > 200:
+                orders.pop(rnd.randrange(len(orders)))
+            order = [float(self.next_order_id), book.price + (rnd.randint(-20, 0) if side else rnd.randint(0, 20)),
+                     rnd.randint(1, 100) * 25]
+            self.next_order_id += 1
+            orders.append(order)
+            msg_type = msg_types[0]
+        elif roll < 0.75:
+            order = orders[rnd.randrange(len(orders))]
+            order[1] += rnd.randint(-2, 2)
+            order[2] = rnd.randint(1, 100) * 25
+            msg_type = msg_types[2]
+        else:
+            order = orders.pop(rnd.randrange(len(orders)))
+            msg_type = msg_types[1]
+        payload = self.order_layout.pack(self.timestamp, order[0], index, b'B' if side else b'S', order[1], order[2])
+        return self._message(msg_type, stream_id, payload)
+
+    def _trade(self, index, book, msg_type):
+        rnd = self.random
+        stream_id = index % self.streams
+        if book.bids and book.asks:
+            bid = book.bids[rnd.randrange(len(book.bids))]
+            ask = book.asks[rnd.randrange(len(book.asks))]
+            quantity = min(bid[2], ask[2])
+            for orders, order in ((book.bids, bid), (book.asks, ask)):
+                order[2] -= quantity
+                if not order[2]:
+                    orders.remove(order)
+            buy_order_id, sell_order_id = bid[0], ask[0]
+        else:
+            buy_order_id, sell_order_id, quantity = 0.0, 0.0, rnd.randint(1, 100) * 25
+        payload = self.trade_layout.pack(self.timestamp, buy_order_id, sell_order_id, index, book.price, quantity)
+        return self._message(msg_type, stream_id, payload)
+
+    def _heartbeat(self):
+        stream_id = self.random.randrange(self.streams)
+        payload = self.heartbeat_layout.pack(self.seq_nos[stream_id])
+        return self._message(b'Z', stream_id, payload)
+
+    def message(self):
+        """
+        :return: bytes of the next message
+        """
+        rnd = self.random
+        self.timestamp += rnd.randint(0, 50)
+        roll = rnd.random()
+        for kind, threshold in zip(self.kinds, self.thresholds):
+            if roll < threshold:
+                break
+        if kind == 'heartbeat':
+            return self._heartbeat()
+        if kind == 'spread':
+            index = rnd.randrange(len(self.spreads))
+            book = self.spreads[index]
+            if rnd.random() < 0.8:
+                return self._order(index, book, (b'G', b'J', b'H'))
+            return self._trade(index, book, b'K')
+        index = rnd.randrange(len(self.tokens))
+        if kind == 'trade':
+            return self._trade(index, self.tokens[index], b'T')
+        return self._order(index, self.tokens[index], (b'N', b'X', b'M'))
+
+
+def generate_capture(filename, messages=None, size=None, **kwargs):
+    """
+    Writes a synthetic capture to `filename`
+    :param messages: no. of messages to write
+    :param size: bytes to write (at least), when `messages` is not given
+    :param kwargs: CaptureGenerator arguments
+    :return: (no. of messages, bytes) written
+    """
+    if messages is None and size is None:
+        raise ValueError("Either messages or size is needed")
+    generator = CaptureGenerator(**kwargs)
+    count = written = 0
+    with open(filename, 'wb') as outfile:
+        while (messages is None or count < messages) and (size is None or written < size):
+            batch = []
+            for _ in range(WRITE_BATCH if messages is None else min(WRITE_BATCH, messages - count)):
+                batch.append(generator.message())
+            data = b''.join(batch)
+            outfile.write(data)
+            count += len(batch)
+            written += len(data)
+    return count, written
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Writes a synthetic .bin capture")
+    arg_parser.add_argument('filename')
+    arg_parser.add_argument('--messages', type=int, help="no. of messages")
+    arg_parser.add_argument('--size-mb', type=float, help="size of the capture, when --messages is not given")
+    arg_parser.add_argument('--tokens', type=int, default=100)
+    arg_parser.add_argument('--streams', type=int, default=4)
+    arg_parser.add_argument('--mix', help="e.g. order=0.7,trade=0.2,spread=0.08,heartbeat=0.02")
+    arg_parser.add_argument('--gap-rate', type=float, default=0.0)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args(argv)
+
+    mix = None
+    if args.mix:
+        mix = dict((kind, float(share)) for kind, share in (item.split('=') for item in args.mix.split(',')))
+    size = int(args.size_mb * 1024 * 1024) if args.size_mb else None
+    if args.messages is None and size is None:
+        arg_parser.error("one of --messages and --size-mb is needed")
+    count, written = generate_capture(args.filename, messages=args.messages, size=size, tokens=args.tokens,
+                                      streams=args.streams, mix=mix, gap_rate=args.gap_rate, seed=args.seed)
+    sys.stderr.write("{}: {} messages, {} bytes\n".format(args.filename, count, written))
+
+
+if __name__ == '__main__':
+    main()
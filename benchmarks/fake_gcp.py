@@ -0,0 +1,340 @@
+"""
+In-process stand-ins for the google.cloud.storage bucket/blob APIs and the compute `discovery`
+client, covering what the plugins use, with a configurable network latency and bandwidth and
+VM provisioning time. Everything is kept in memory and every call is accounted, so that the
+pipeline can be run and timed locally (see pipeline_benchmark.py).
+
+    fake = FakeGcp(latency=0.05, bandwidth_mbps=200, vm_boot_seconds=20)
+    fake.install()  # patches storage.Client and discovery.build
+
+When google-cloud-storage / google-api-python-client are not installed, `install` registers
+bare modules for them so that the plugins can be imported.
+"""
+import base64
+import hashlib
+import sys
+import threading
+import time
+import types
+
+MB = 1024 * 1024
+
+
+class FakeGcp(object):
+    """
+    Shared state of the fakes: buckets, instances, operations and the accounting
+    :param latency: seconds added to every request
+    :param bandwidth_mbps: MB/sec of every transfer, None for unlimited
+    :param vm_boot_seconds: seconds before an instance insert/delete operation is DONE
+    """
+
+    def __init__(self, latency=0.0, bandwidth_mbps=None, vm_boot_seconds=0.0):
+        self.latency = latency
+        self.bandwidth_mbps = bandwidth_mbps
+        self.vm_boot_seconds = vm_boot_seconds
+        self.buckets = {}  # bucket name -> {blob name: _Stored}
+        self.instances = {}  # instance name -> instance resource
+        self.operations = {}  # operation name -> (done at, operation resource)
+        self.lock = threading.RLock()
+        self.stats = {
+            'requests': 0,
+            'bytes_downloaded': 0,
+            'bytes_uploaded': 0,
+            'instances_created': 0,
+            'instances_deleted': 0,
+        }
+        self._generation = 0
+        self._operation_no = 0
+
+    def request(self, nbytes=0, direction=None):
+        """
+        Accounts a request transferring `nbytes`, sleeping for its latency and transfer time
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            if direction:
+                self.stats[direction] += nbytes
+        delay = self.latency
+        if self.bandwidth_mbps and nbytes:
+            delay += nbytes / (self.bandwidth_mbps * float(MB))
+        if delay:
+            time.sleep(delay)
+
+    def bucket_store(self, bucket_name):
+        with self.lock:
+            return self.buckets.setdefault(bucket_name, {})
+
+    def put(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        """
+        Stores a blob without accounting it, for seeding the inputs
+        """
+        with self.lock:
+            self._generation += 1
+            self.bucket_store(bucket_name)[blob_name] = _Stored(data, self._generation, content_type,
+                                                                content_encoding)
+
+    def get(self, bucket_name, blob_name):
+        return self.bucket_store(bucket_name)[blob_name].data
+
+    def storage_client(self, *args, **kwargs):
+        return _Client(self)
+
+    def build(self, service_name, version, *args, **kwargs):
+        if service_name != 'compute':
+            raise ValueError("Only the compute service is faked, not {}".format(service_name))
+        return _Compute(self)
+
+    def operation(self, kind, target):
+        with self.lock:
+            self._operation_no += 1
+            name = 'operation-{}'.format(self._operation_no)
+            resource = {'name': name, 'operationType': kind, 'targetLink': target, 'status': 'RUNNING'}
+            self.operations[name] = (time.time() + self.vm_boot_seconds, resource)
+            return dict(resource)
+
+    def preempt(self, name):
+        """
+        Stops an instance the way GCE preempts it
+        """
+        with self.lock:
+            self.instances[name]['status'] = 'TERMINATED'
+
+    def install(self):
+        """
+        Points google.cloud.storage.Client and googleapiclient.discovery.build to the fakes
+        """
+        storage = _module('google.cloud.storage')
+        discovery = _module('googleapiclient.discovery')
+        storage.Client = self.storage_client
+        discovery.build = self.build
+
+
+def _module(name):
+    try:
+        __import__(name)
+    except ImportError:
+        parent = None
+        parts = name.split('.')
+        for i in range(len(parts)):
+            module_name = '.'.join(parts[:i + 1])
+            module = sys.modules.get(module_name)
+            if module is None:
+                module = sys.modules[module_name] = types.ModuleType(module_name)
+                module.__path__ = []
+            if parent is not None:
+                setattr(parent, parts[i], module)
+            parent = module
+    return sys.modules[name]
+
+
+class _Stored(object):
+    def __init__(self, data, generation, content_type=None, content_encoding=None):
+        self.data = data
+        self.generation = generation
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+class _Client(object):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_bucket(self, bucket_name):
+        self.fake.request()
+        return _Bucket(self.fake, bucket_name)
+
+    def bucket(self, bucket_name):
+        return _Bucket(self.fake, bucket_name)
+
+
+class _Bucket(object):
+    def __init__(self, fake, name):
+        self.fake = fake
+        self.name = name
+
+    def list_blobs(self, prefix=None, max_results=None):
+        fake = self.fake
+        with fake.lock:
+            names = sorted(name for name in fake.bucket_store(self.name) if not prefix or name.startswith(prefix))
+        fake.request()
+        if max_results is not None:
+            names = names[:max_results]
+        return [self.blob(name) for name in names]
+
+    def blob(self, blob_name, chunk_size=None):
+        return _Blob(self, blob_name, chunk_size)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        return blob if blob.exists() else None
+
+    def delete_blob(self, blob_name):
+        self.fake.request()
+        with self.fake.lock:
+            del self.fake.bucket_store(self.name)[blob_name]
+
+
+class _Blob(object):
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_encoding = None
+        self.content_type = None
+
+    def __repr__(self):
+        return '<Blob: {}, {}>'.format(self.bucket.name, self.name)
+
+    def _stored(self):
+        stored = self.bucket.fake.bucket_store(self.bucket.name).get(self.name)
+        if stored is None:
+            raise IOError("404 No such object: {}/{}".format(self.bucket.name, self.name))
+        return stored
+
+    @property
+    def size(self):
+        stored = self.bucket.fake.bucket_store(self.bucket.name).get(self.name)
+        return len(stored.data) if stored else None
+
+    @property
+    def generation(self):
+        stored = self.bucket.fake.bucket_store(self.bucket.name).get(self.name)
+        return stored.generation if stored else None
+
+    @property
+    def md5_hash(self):
+        stored = self.bucket.fake.bucket_store(self.bucket.name).get(self.name)
+        return stored.md5_hash if stored else None
+
+    def exists(self):
+        self.bucket.fake.request()
+        return self.size is not None
+
+    def reload(self):
+        self.bucket.fake.request()
+        self._stored()
+
+    def download_as_string(self, start=None, end=None):
+        data = self._stored().data
+        if start is not None or end is not None:
+            data = data[start or 0:(end + 1) if end is not None else None]  # `end` is inclusive
+        self.bucket.fake.request(len(data), 'bytes_downloaded')
+        return data
+
+    def download_to_file(self, file_obj, start=None, end=None):
+        data = self._stored().data[start or 0:(end + 1) if end is not None else None]
+        chunk_size = self.chunk_size or len(data) or 1
+        for pos in range(0, len(data), chunk_size):
+            # one ranged request per chunk, the way ChunkedDownload does it
+            chunk = data[pos:pos + chunk_size]
+            self.bucket.fake.request(len(chunk), 'bytes_downloaded')
+            file_obj.write(chunk)
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as file_obj:
+            self.download_to_file(file_obj)
+
+    def upload_from_string(self, data, content_type=None):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.bucket.fake.request(len(data), 'bytes_uploaded')
+        self.bucket.fake.put(self.bucket.name, self.name, data, content_type or self.content_type,
+                             self.content_encoding)
+
+    def upload_from_file(self, file_obj, content_type=None):
+        self.upload_from_string(file_obj.read(), content_type)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, 'rb') as file_obj:
+            self.upload_from_file(file_obj, content_type)
+
+
+class _Request(object):
+    def __init__(self, fake, handler):
+        self.fake = fake
+        self.handler = handler
+
+    def execute(self, *args, **kwargs):
+        self.fake.request()
+        return self.handler()
+
+
+class _Compute(object):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def images(self):
+        return _Images(self.fake)
+
+    def instances(self):
+        return _Instances(self.fake)
+
+    def zoneOperations(self):
+        return _ZoneOperations(self.fake)
+
+
+class _Images(object):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def getFromFamily(self, project, family):
+        link = 'projects/{}/global/images/family/{}'.format(project, family)
+        return _Request(self.fake, lambda: {'selfLink': link})
+
+
+class _Instances(object):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def insert(self, project, zone, body):
+        def handler():
+            with self.fake.lock:
+                self.fake.instances[body['name']] = dict(body, status='PROVISIONING', zone=zone)
+                self.fake.stats['instances_created'] += 1
+            return self.fake.operation('insert', body['name'])
+        return _Request(self.fake, handler)
+
+    def delete(self, project, zone, instance):
+        def handler():
+            with self.fake.lock:
+                if self.fake.instances.pop(instance, None) is None:
+                    raise Exception("404 instance {} not found".format(instance))
+                self.fake.stats['instances_deleted'] += 1
+            return self.fake.operation('delete', instance)
+        return _Request(self.fake, handler)
+
+    def list(self, project, zone):
+        def handler():
+            with self.fake.lock:
+                return {'items': [dict(instance, status='TERMINATED' if instance['status'] == 'TERMINATED'
+                                       else 'RUNNING') for instance in self.fake.instances.values()]}
+        return _Request(self.fake, handler)
+
+    def start(self, project, zone, instance):
+        def handler():
+            with self.fake.lock:
+                if instance not in self.fake.instances:
+                    raise Exception("404 instance {} not found".format(instance))
+                self.fake.instances[instance]['status'] = 'STAGING'
+            return self.fake.operation('start', instance)
+        return _Request(self.fake, handler)
+
+
+class _ZoneOperations(object):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get(self, project, zone, operation):
+        def handler():
+            with self.fake.lock:
+                done_at, resource = self.fake.operations[operation]
+                resource = dict(resource)
+                if time.time() >= done_at:
+                    resource['status'] = 'DONE'
+                    instance = self.fake.instances.get(resource['targetLink'])
+                    if instance is not None:
+                        instance['status'] = 'RUNNING'
+            return resource
+        return _Request(self.fake, handler)
+
@@ -0,0 +1,98 @@
+"""
+Import time guard of the plugins: every process of the deployment (scheduler, webserver, workers)
+imports gce_conf_operator through the GcePlugin, so its cost is paid on every start and DAG parse.
+
+Runs `python -X importtime` (python 3.7+) in a fresh process for every module, with the airflow
+modules it builds on imported first (they are paid for anyway), and reports the cumulative import
+time of the module and the heaviest modules it pulled in. Fails (exit status 1) if a module pulls in
+one of the heavy dependencies only the running operators need (HEAVY), or takes over --max-ms.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --module gce_conf_operator --module taskers --max-ms 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PLUGINS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'plugins'))
+
+# imported by airflow before the plugins anyway, not counted
+AIRFLOW_MODULES = ('logging', 'json', 'socket', 'tempfile', 'airflow.models', 'airflow.plugins_manager',
+                   'airflow.utils.decorators', 'airflow.operators.sensors')
+# to be imported only when an operator actually runs
+HEAVY = ('google.cloud.storage', 'googleapiclient', 'pymongo', 'log_parser', 'pyximport', 'Cython', 'zstandard')
+
+
+def import_profile(module, preimports=AIRFLOW_MODULES):
+    """
+    :return: (cumulative microseconds of importing `module`, {module: self microseconds} of the
+        modules imported by it)
+    """
+    code = ''.join('import {}; '.format(name) for name in preimports) + 'import {}'.format(module)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PLUGINS_DIR] + [path for path in [env.get('PYTHONPATH')] if path])
+    # run from the plugins dir, the repository root would shadow the airflow package with its airflow/ dir
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=PLUGINS_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("importing {} failed:\n{}".format(module, stderr))
+
+    # children are reported before their parent, one level of indentation deeper
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((int(self_us), int(cumulative_us), name.rstrip()[1:]))  # after the '| ' separator
+    for position, (_, cumulative_us, name) in enumerate(entries):
+        if name.strip() == module and not name.startswith(' '):
+            imported = {}
+            for self_us, _, child in reversed(entries[:position]):
+                if not child.startswith(' '):
+                    break
+                imported[child.strip()] = self_us
+            return cumulative_us, imported
+    raise RuntimeError("{} not found in the -X importtime output:\n{}".format(module, stderr))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', action='append', help="plugin module to check (default: gce_conf_operator)")
+    parser.add_argument('--max-ms', type=float, default=30.0, help="budget of the cumulative import time")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per module, the fastest one is reported")
+    parser.add_argument('--top', type=int, default=10, help="no. of the heaviest imported modules to list")
+    parser.add_argument('--output', help="save the results as json")
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        sys.exit("-X importtime needs python 3.7+")
+
+    failed = False
+    results = {}
+    for module in args.module or ['gce_conf_operator']:
+        cumulative_us, imported = min((import_profile(module) for _ in range(args.repeat)), key=lambda run: run[0])
+        heavy = [prefix for prefix in HEAVY
+                 if any(name == prefix or name.startswith(prefix + '.') for name in imported)]
+        over_budget = cumulative_us / 1000.0 > args.max_ms
+        failed = failed or bool(heavy) or over_budget
+        results[module] = {'ms': cumulative_us / 1000.0, 'modules': len(imported), 'heavy': heavy}
+
+        print("{}: {:.1f} ms, {} modules{}".format(module, cumulative_us / 1000.0, len(imported),
+                                                   ' (over the {:.0f} ms budget)'.format(args.max_ms)
+                                                   if over_budget else ''))
+        for name, self_us in sorted(imported.items(), key=lambda item: -item[1])[:args.top]:
+            print("    {:>8.1f} ms  {}".format(self_us / 1000.0, name))
+        if heavy:
+            print("    imports heavy dependencies at import time: {}".format(', '.join(heavy)))
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
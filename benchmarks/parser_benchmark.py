@@ -0,0 +1,158 @@
+"""
+Benchmark of log_parser: msgs/sec, MB/sec and peak RSS of every decoding engine
+(log_parser.engines()) with every output mode, on a synthetic capture (capture_generator).
+Every run is a separate process, so that the peak RSS is its own.
+
+    python benchmarks/parser_benchmark.py --messages 1000000
+    python benchmarks/parser_benchmark.py --capture real.bin --engines native --modes decode,json
+
+Results are printed as a table, and saved as json with --output for comparing machines or commits.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PLUGINS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'plugins'))
+sys.path.insert(0, PLUGINS_DIR)
+
+import log_parser  # noqa: E402
+
+MODES = ('decode', 'json', 'json-gzip', 'json-zstd', 'index', 'partition', 'book', 'bars', 'integrity')
+
+
+class _Counter(object):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, offset, header, record):
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+def run(engine, mode, capture, work_dir):
+    """
+    Parses `capture` once with the given engine and output mode
+    :return: result dict
+    """
+    from bars import BarAggregator
+    from integrity import IntegrityChecker
+    from order_book import BookEngine
+    from partitioned_store import PartitionWriter
+
+    counter = _Counter()
+    save_filename = os.path.join(work_dir, 'out.json')
+    log_parser.engine_scan(engine)  # the native loop is loaded (and built the first time) out of the timing
+    start = time.time()
+    if mode == 'decode':
+        parser = log_parser.StreamParser([counter], engine=engine)
+    elif mode.startswith('json'):
+        compression = mode.split('-')[1] if '-' in mode else None
+        parser = log_parser.open_stream(save_filename + log_parser.COMPRESSION_SUFFIXES[compression],
+                                        compression=compression, sinks=[counter], engine=engine)
+    else:
+        sink = {
+            'index': lambda: log_parser.IndexBuilder(os.path.join(work_dir, 'out.idx')),
+            'partition': lambda: PartitionWriter(os.path.join(work_dir, 'partitions'), 'out'),
+            'book': lambda: BookEngine(os.path.join(work_dir, 'out.book.jsonl'), snapshot_interval=1000000),
+            'bars': lambda: BarAggregator(os.path.join(work_dir, 'out.bars.csv'), 60000000),
+            'integrity': lambda: None,
+        }[mode]()
+        integrity = IntegrityChecker(os.path.join(work_dir, 'out.integrity.json')) if mode == 'integrity' else None
+        parser = log_parser.StreamParser([counter] + ([sink] if sink else []), integrity=integrity, engine=engine)
+    with open(capture, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(log_parser.READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+    parser.close()
+    seconds = time.time() - start
+
+    size = os.path.getsize(capture)
+    return {
+        'engine': engine,
+        'mode': mode,
+        'messages': counter.count,
+        'bytes': size,
+        'seconds': seconds,
+        'msgs_per_sec': counter.count / seconds if seconds else 0.0,
+        'mb_per_sec': size / 1048576.0 / seconds if seconds else 0.0,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,  # KB on linux
+    }
+
+
+def _run_in_process(engine, mode, capture):
+    work_dir = tempfile.mkdtemp(prefix='parser_benchmark_')
+    try:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', engine, mode,
+                                          capture, work_dir])
+    except subprocess.CalledProcessError as e:
+        return {'engine': engine, 'mode': mode, 'error': 'exit code {}'.format(e.returncode)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmarks the log_parser engines and output modes")
+    arg_parser.add_argument('--capture', help="capture to parse, a synthetic one is generated if not given")
+    arg_parser.add_argument('--messages', type=int, default=500000, help="messages of the synthetic capture")
+    arg_parser.add_argument('--tokens', type=int, default=100)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--engines', help="comma separated, defaults to all the available ones")
+    arg_parser.add_argument('--modes', default=','.join(MODES), help="comma separated, from " + ', '.join(MODES))
+    arg_parser.add_argument('--repeat', type=int, default=1, help="runs per engine and mode, the best is kept")
+    arg_parser.add_argument('--output', help="json file to save the results to")
+    arg_parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        engine, mode, capture, work_dir = args.child
+        print(json.dumps(run(engine, mode, capture, work_dir)))
+        return
+
+    temp_dir = None
+    capture = args.capture
+    if not capture:
+        from capture_generator import generate_capture
+        temp_dir = tempfile.mkdtemp(prefix='parser_benchmark_')
+        capture = os.path.join(temp_dir, 'capture.bin')
+        count, size = generate_capture(capture, messages=args.messages, tokens=args.tokens, seed=args.seed)
+        sys.stderr.write("Generated {}: {} messages, {:.1f} MB\n".format(capture, count, size / 1048576.0))
+
+    available = log_parser.engines()
+    engines = args.engines.split(',') if args.engines else sorted(available)
+    missing = [engine for engine in engines if engine not in available]
+    if missing:
+        arg_parser.error("engines not available here: {}".format(', '.join(missing)))
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            for engine in engines:
+                runs = [_run_in_process(engine, mode, capture) for _ in range(args.repeat)]
+                ok = [result for result in runs if 'error' not in result]
+                results.append(min(ok, key=lambda result: result['seconds']) if ok else runs[0])
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print("{:<8} {:<10} {:>12} {:>10} {:>10} {:>13}".format(
+        'engine', 'mode', 'msgs/sec', 'MB/sec', 'seconds', 'peak RSS MB'))
+    for result in results:
+        if 'error' in result:
+            print("{:<8} {:<10} {}".format(result['engine'], result['mode'], result['error']))
+            continue
+        print("{engine:<8} {mode:<10} {msgs_per_sec:>12,.0f} {mb_per_sec:>10.2f} {seconds:>10.2f} "
+              "{peak_rss_mb:>13.1f}".format(**result))
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'python': sys.version, 'results': results}, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+Runs the process_dag pipeline (SyncOperator -> SetupOperator, UnzipOperator -> WorkerOperators
+-> CompletionOperator, or SyncOperator -> LocalOperator with --local) in a single process against the fake storage and compute of fake_gcp,
+and reports the timing of every stage and the critical path.
+
+The tasks are laid out as in dags/run_script.py. Every task runs in its own thread as soon as
+its upstream tasks succeeded: operators through `execute`, sensors through `poke` every
+--poke-interval seconds until they return True (or --sensor-timeout). XComs are kept in memory.
+Workers being threads, their parsing shares one CPU (GIL); the figures are meant for the
+orchestration, transfers and VM provisioning, and for comparing changes to them.
+
+    python benchmarks/pipeline_benchmark.py --files 8 --messages 200000 --workers 4 \
+        --latency 0.02 --bandwidth-mbps 100 --vm-boot-seconds 5
+
+Needs airflow (the operators' base classes); the google libraries are replaced by fake_gcp.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGINS_DIR = os.path.normpath(os.path.join(BENCHMARKS_DIR, '..', 'airflow', 'plugins'))
+sys.path.insert(0, PLUGINS_DIR)
+
+from fake_gcp import FakeGcp  # noqa: E402
+
+SUCCESS = 'success'
+FAILED = 'failed'
+UPSTREAM_FAILED = 'upstream_failed'
+TIMED_OUT = 'timed_out'
+
+
+class _XComStore(object):
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def push(self, task_id, key, value):
+        with self.lock:
+            self.values[(task_id, key)] = json.loads(json.dumps(value))  # xcoms are serialized
+
+    def pull(self, task_id, key):
+        with self.lock:
+            value = self.values.get((task_id, key))
+        return json.loads(json.dumps(value))
+
+
+class _SharedState(object):
+    """
+    In memory replacement of shared_state.py (airflow Variables)
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def locked(self, key, default=None):
+        with self.lock:
+            state = self.read(key)
+            state = state if state is not None else (default if default is not None else {})
+            yield state
+            self.write(key, state)
+
+    def read(self, key):
+        with self.lock:
+            return json.loads(self.values[key]) if key in self.values else None
+
+    def write(self, key, state):
+        with self.lock:
+            self.values[key] = json.dumps(state)
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def install(self):
+        import shared_state
+        for name in ('locked', 'read', 'write', 'delete'):
+            setattr(shared_state, name, getattr(self, name))
+
+
+class _TaskInstance(object):
+    """
+    The part of airflow's TaskInstance used by taskers.xcom_push/xcom_pull
+    """
+
+    def __init__(self, store, task_id):
+        self.store = store
+        self.task_id = task_id
+
+    def xcom_push(self, key, value):
+        self.store.push(self.task_id, key, value)
+
+    def xcom_pull(self, key=None, task_ids=None):
+        if isinstance(task_ids, (list, tuple)):
+            return [self.store.pull(task_id, key) for task_id in task_ids]
+        return self.store.pull(task_ids or self.task_id, key)
+
+
+class _DagRun(object):
+    def __init__(self, conf):
+        self.conf = conf
+
+
+class _Run(object):
+    """
+    Timing and state of a task in the run
+    """
+
+    def __init__(self, task, upstream):
+        self.task = task
+        self.upstream = upstream
+        self.state = None
+        self.start = self.end = None
+        self.pokes = 0
+        self.error = None
+        self.metrics = None
+        self.done = threading.Event()
+
+
+def build_tasks(workers, spare_tasks=0, slots=1, local=False):
+    """
+    :param workers: NO_OF_INSTANCES
+    :param slots: task slots per instance
+    :param local: the branch of the local execution mode (sync_task -> local_task), else the gce one
+    :return: {task_id: (operator, [upstream task_ids])} laid out as in dags/run_script.py
+    """
+    from gce_conf_operator import SyncOperator, SetupOperator, UnzipOperator, WorkerOperator, \
+        SpeculativeWorkerOperator, CompletionOperator, LocalOperator
+
+    instance_info = {'instances': ['worker-bench{}'.format(i) for i in range(workers)]}
+    sync_task = SyncOperator(op_param={'instance_info': instance_info, 'worker_tasks': workers * slots},
+                             task_id='sync_task')
+    if local:
+        return {
+            'sync_task': (sync_task, []),
+            'local_task': (LocalOperator(op_param={'processes': workers * slots}, task_id='local_task'),
+                           ['sync_task']),
+        }
+    tasks = {
+        'sync_task': (sync_task, []),
+        'setup_task': (SetupOperator(op_param={}, task_id='setup_task'), ['sync_task']),
+        'unzip_task': (UnzipOperator(op_param={}, task_id='unzip_task'), ['sync_task']),
+        'completion_task': (CompletionOperator(op_param={'spare_tasks': spare_tasks}, task_id='completion_task'),
+                            ['setup_task']),
+    }
+    for slot_no in range(workers * slots):
+        worker_id = 'worker_task' + str(slot_no)
+        tasks[worker_id] = (WorkerOperator(op_param={'number': slot_no}, task_id=worker_id),
+                            ['setup_task', 'unzip_task'])
+    for spare_no in range(spare_tasks):
+        spare_id = 'spare_task' + str(spare_no)
+        tasks[spare_id] = (SpeculativeWorkerOperator(op_param={}, task_id=spare_id), ['unzip_task'])
+    return tasks
+
+
+def run_pipeline(tasks, poke_interval=0.2, sensor_timeout=600, conf=None):
+    """
+    Runs the tasks, each in a thread started when its upstream tasks succeeded
+    :param conf: the DAG run conf, the user inputs of the run
+    :return: {task_id: _Run}, start time of the run
+    """
+    from airflow.operators.sensors import BaseSensorOperator
+
+    store = _XComStore()
+    dag_run = _DagRun(conf)
+    runs = dict((task_id, _Run(task, upstream)) for task_id, (task, upstream) in tasks.items())
+    t0 = time.time()
+
+    def run_task(task_id):
+        run = runs[task_id]
+        for upstream_id in run.upstream:
+            runs[upstream_id].done.wait()
+        if any(runs[upstream_id].state != SUCCESS for upstream_id in run.upstream):
+            run.state = UPSTREAM_FAILED
+            run.done.set()
+            return
+        context = {'ti': _TaskInstance(store, task_id), 'dag_run': dag_run, 'run_id': 'benchmark'}
+        run.start = time.time() - t0
+        try:
+            if isinstance(run.task, BaseSensorOperator):
+                run.state = TIMED_OUT
+                while time.time() - t0 - run.start < sensor_timeout:
+                    run.pokes += 1
+                    if run.task.poke(context):
+                        run.state = SUCCESS
+                        break
+                    time.sleep(poke_interval)
+            else:
+                run.task.execute(context)
+                run.state = SUCCESS
+        except Exception as e:
+            run.state = FAILED
+            run.error = '{}: {}'.format(type(e).__name__, e)
+        run.end = time.time() - t0
+        run.metrics = store.pull(task_id, 'metrics')  # see gce_conf_operator.with_metrics
+        run.done.set()
+
+    threads = [threading.Thread(target=run_task, args=(task_id,)) for task_id in sorted(runs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return runs, t0
+
+
+@contextmanager
+def _thread_pool():
+    # the fake storage lives in this process, the local mode's worker processes would not see it
+    import multiprocessing
+    import multiprocessing.dummy
+    process_pool, multiprocessing.Pool = multiprocessing.Pool, multiprocessing.dummy.Pool
+    try:
+        yield
+    finally:
+        multiprocessing.Pool = process_pool
+
+
+@contextmanager
+def _no_context():
+    yield
+
+
+def critical_path(runs):
+    """
+    :return: task_ids of the chain of the latest finishing upstream tasks ending at the last task
+    """
+    finished = [task_id for task_id, run in runs.items() if run.end is not None]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda task_id: runs[task_id].end)]
+    while True:
+        upstream = [task_id for task_id in runs[path[-1]].upstream if runs[task_id].end is not None]
+        if not upstream:
+            break
+        path.append(max(upstream, key=lambda task_id: runs[task_id].end))
+    return list(reversed(path))
+
+
+def _make_inputs(fake, work_dir, files, messages, tokens, zip_blob, bucket_name):
+    from capture_generator import generate_capture
+    capture_dir = os.path.join(work_dir, 'captures')
+    os.makedirs(capture_dir)
+    zip_path = os.path.join(work_dir, 'captures.zip')
+    total = 0
+    with zipfile.ZipFile(zip_path, 'w') as zip_file:
+        for i in range(files):
+            path = os.path.join(capture_dir, 'capture_{:03d}.bin'.format(i))
+            count, size = generate_capture(path, messages=messages, tokens=tokens, seed=i)
+            total += size
+            zip_file.write(path, os.path.basename(path))
+    with open(zip_path, 'rb') as zip_file:
+        fake.put(bucket_name, zip_blob + '/captures.zip', zip_file.read())
+    shutil.rmtree(capture_dir)
+    return total
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Times the process_dag pipeline against fake GCS/GCE")
+    arg_parser.add_argument('--files', type=int, default=4, help="no. of captures in the input zip")
+    arg_parser.add_argument('--messages', type=int, default=100000, help="messages per capture")
+    arg_parser.add_argument('--tokens', type=int, default=100)
+    arg_parser.add_argument('--workers', type=int, default=2, help="NO_OF_INSTANCES")
+    arg_parser.add_argument('--machine-type', default='n1-standard-1',
+                            help="of the instances, which run a worker task per vCPU")
+    arg_parser.add_argument('--autoscale', type=int, metavar='TARGET_SECONDS',
+                            help="size the fleet (up to --workers) for this duration, see plugins/autoscale.py")
+    arg_parser.add_argument('--speculative', type=int, default=0, metavar='SPARE_TASKS',
+                            help="spare worker tasks for the speculative duplicates of the stragglers")
+    arg_parser.add_argument('--preemptible', action='store_true',
+                            help="preemptible workers, checkpointing their processing (see plugins/checkpoints.py)")
+    arg_parser.add_argument('--local', action='store_true',
+                            help="local execution mode, --workers x vCPUs worker threads on this host and no instances")
+    arg_parser.add_argument('--checkpoint-bytes', type=int, default=64 * 1024 * 1024)
+    arg_parser.add_argument('--latency', type=float, default=0.01, help="seconds per request")
+    arg_parser.add_argument('--bandwidth-mbps', type=float, default=100.0, help="MB/sec per transfer")
+    arg_parser.add_argument('--vm-boot-seconds', type=float, default=2.0)
+    arg_parser.add_argument('--poke-interval', type=float, default=0.2)
+    arg_parser.add_argument('--sensor-timeout', type=float, default=600)
+    arg_parser.add_argument('--streaming', action='store_true')
+    arg_parser.add_argument('--compression', choices=['gzip', 'zstd'])
+    arg_parser.add_argument('--check-integrity', action='store_true')
+    arg_parser.add_argument('--profile', choices=['sample', 'cprofile'], help="profile the worker tasks")
+    arg_parser.add_argument('--blob-cache', action='store_true', help="keep the local blob cache enabled")
+    arg_parser.add_argument('--output', help="json file to save the results to")
+    arg_parser.add_argument('--log-level', default='WARNING', help="of the operators' logs, e.g. INFO")
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s %(threadName)s %(name)s %(levelname)s %(message)s')
+
+    work_dir = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    home = os.path.join(work_dir, 'home')
+    airflow_home = os.path.join(work_dir, 'airflow_home')
+    os.makedirs(os.path.join(airflow_home, 'dags'))
+    with open(os.path.join(airflow_home, 'dags', 'placeholder.py'), 'w') as placeholder:
+        placeholder.write('# synced by SyncOperator\n')
+    os.makedirs(home)
+    # the workers keep their files under ~, the sync task uploads the current directory
+    os.environ['HOME'] = home
+    os.environ['BLOB_CACHE_DIR'] = os.path.join(home, '.blob_cache')
+    os.environ['USER_INPUTS_CACHE'] = os.path.join(work_dir, 'user_inputs.json')
+    if not args.blob_cache:
+        os.environ['BLOB_CACHE_MAX_BYTES'] = '0'
+    cwd = os.getcwd()
+    os.chdir(airflow_home)
+
+    fake = FakeGcp(latency=args.latency, bandwidth_mbps=args.bandwidth_mbps, vm_boot_seconds=args.vm_boot_seconds)
+    fake.install()
+    _SharedState().install()
+    try:
+        import helper_functions
+        import user_inputs
+        from constants import BUCKET_NAME
+        helper_functions.get_airflow_configs = lambda: ''  # no configs database here
+
+        zip_blob, bin_data_source_blob = 'bench_zip', 'bench_bin'
+        input_bytes = _make_inputs(fake, work_dir, args.files, args.messages, args.tokens, zip_blob, BUCKET_NAME)
+        conf = {
+            'NO_OF_INSTANCES': args.workers,
+            'BIN_DATA_SOURCE_BLOB': bin_data_source_blob,
+            'ZIP_BLOB': zip_blob,
+            'STREAMING': args.streaming,
+            'COMPRESSION': args.compression,
+            'CHECK_INTEGRITY': args.check_integrity,
+            'PROFILE': args.profile,
+            'AUTOSCALE': args.autoscale is not None,
+            'TARGET_SECONDS': args.autoscale or 3600,
+            'SPECULATIVE_TASKS': args.speculative,
+            'PREEMPTIBLE': args.preemptible,
+            'MACHINE_TYPE': args.machine_type,
+            'CHECKPOINT_BYTES': args.checkpoint_bytes,
+            # the branch is chosen here (run_pipeline has no skipped tasks) rather than by the input size
+            'EXECUTION_MODE': 'local' if args.local else 'gce',
+        }
+        import autoscale
+        tasks = build_tasks(args.workers, args.speculative, autoscale.slots_per_instance(user_inputs.normalize(conf)),
+                            local=args.local)
+        with _thread_pool() if args.local else _no_context():
+            runs, _ = run_pipeline(tasks, args.poke_interval, args.sensor_timeout, conf)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    path = critical_path(runs)
+    print("{:<24} {:<16} {:>8} {:>8} {:>9} {:>6}".format('task', 'state', 'start', 'end', 'duration', 'pokes'))
+    for task_id in sorted(runs, key=lambda task_id: (runs[task_id].start is None, runs[task_id].start, task_id)):
+        run = runs[task_id]
+        timing = '{:>8.2f} {:>8.2f} {:>9.2f}'.format(run.start, run.end, run.end - run.start) \
+            if run.end is not None else '{:>8} {:>8} {:>9}'.format('-', '-', '-')
+        print("{:<24} {:<16} {} {:>6}{}".format(task_id + (' *' if task_id in path else ''), run.state, timing,
+                                                run.pokes or '', '  ' + run.error if run.error else ''))
+    total = max(run.end for run in runs.values() if run.end is not None)
+    print("\ncritical path (*): {}".format(' -> '.join(path)))
+    print("total: {:.2f}s, input: {:.1f} MB, {}".format(total, input_bytes / 1048576.0, json.dumps(fake.stats)))
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({
+                'args': vars(args),
+                'total_seconds': total,
+                'critical_path': path,
+                'stats': fake.stats,
+                'tasks': dict((task_id, {'state': run.state, 'start': run.start, 'end': run.end,
+                                         'pokes': run.pokes, 'error': run.error, 'metrics': run.metrics})
+                              for task_id, run in runs.items()),
+            }, outfile, indent=2)
+    return 0 if all(run.state == SUCCESS for run in runs.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
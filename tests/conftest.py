@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the plugins are imported the way airflow loads them (plugins folder on the path), the
+# synthetic captures come from benchmarks/capture_generator.py
+for folder in (os.path.join(ROOT, 'airflow', 'plugins'), os.path.join(ROOT, 'benchmarks')):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
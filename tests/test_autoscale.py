@@ -0,0 +1,71 @@
+import unittest
+
+from autoscale import fleet_slots, plan, slots_per_instance, vcpus
+
+MB = 1000 * 1000
+
+
+class VcpusTest(unittest.TestCase):
+    def test_predefined_types(self):
+        self.assertEqual(vcpus('n1-standard-4'), 4)
+        self.assertEqual(vcpus('n1-highcpu-16'), 16)
+        self.assertEqual(vcpus('f1-micro'), 1)
+
+    def test_custom_types(self):
+        self.assertEqual(vcpus('custom-4-16384'), 4)
+        self.assertEqual(vcpus('n2-custom-8-32768'), 8)
+        self.assertEqual(vcpus('custom-2-15360-ext'), 2)
+
+
+class SlotsTest(unittest.TestCase):
+    def test_slots_per_instance(self):
+        self.assertEqual(slots_per_instance({'AUTOSCALE': False, 'MACHINE_TYPE': 'custom-6-23040'}), 6)
+        self.assertEqual(slots_per_instance({'AUTOSCALE': True, 'MACHINE_TYPE': 'n1-standard-1',
+                                             'MACHINE_TYPES': ['n1-standard-2', 'n1-standard-8']}), 8)
+        self.assertEqual(slots_per_instance({'AUTOSCALE': True, 'MACHINE_TYPE': 'n1-standard-4',
+                                             'MACHINE_TYPES': None}), 1)
+
+    def test_a_worker_task_per_slot(self):
+        self.assertEqual(fleet_slots(['i0', 'i1', 'i2'], 'n1-standard-4', 16), (['i0', 'i1', 'i2'], 12))
+
+    def test_fewer_worker_tasks_than_slots(self):
+        # the DAG was parsed with smaller machines: only the instances the worker tasks fill
+        self.assertEqual(fleet_slots(['i0', 'i1', 'i2'], 'n1-standard-4', 5), (['i0', 'i1'], 5))
+        self.assertEqual(fleet_slots(['i0', 'i1', 'i2'], 'n1-standard-4', 4), (['i0'], 4))
+
+
+class PlanTest(unittest.TestCase):
+    # 4 MB/s per core over 1000s of parsing (the target minus the boot): 4000 MB per core
+    kwargs = {'target_seconds': 1240, 'mbps_per_core': 4.0, 'boot_seconds': 240}
+
+    def test_unknown_quota(self):
+        fleet_plan = plan(40000 * MB, max_instances=20, cpu_quota=None, **self.kwargs)
+        self.assertEqual((fleet_plan['instances'], fleet_plan['machine_type']), (10, 'n1-standard-1'))
+        self.assertEqual(fleet_plan['estimated_seconds'], 1240)
+
+    def test_capped_by_the_quota(self):
+        fleet_plan = plan(40000 * MB, max_instances=20, cpu_quota=6, **self.kwargs)
+        self.assertEqual(fleet_plan['instances'], 6)
+
+    def test_larger_type_when_the_instances_do_not_fit(self):
+        fleet_plan = plan(40000 * MB, max_instances=4, machine_types=['n1-standard-1', 'n1-standard-4'],
+                          **self.kwargs)
+        self.assertEqual((fleet_plan['instances'], fleet_plan['machine_type'], fleet_plan['cores']),
+                         (3, 'n1-standard-4', 12))
+
+    def test_fewer_files_than_slots(self):
+        # 10 cores needed but 5 files: 2 instances of 4 slots, not 3 or 5
+        fleet_plan = plan(40000 * MB, max_instances=4, machine_types=['n1-standard-4'], files=5, **self.kwargs)
+        self.assertEqual(fleet_plan['instances'], 2)
+
+    def test_floor(self):
+        fleet_plan = plan(1 * MB, max_instances=4, min_instances=2, files=1, **self.kwargs)
+        self.assertEqual(fleet_plan['instances'], 2)
+
+    def test_unknown_machine_types(self):
+        with self.assertRaises(ValueError):
+            plan(MB, max_instances=4, machine_types=['custom-4-16384'], **self.kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+from bars import BarAggregator
+
+Header = namedtuple('Header', 'stream_id seq_no msg_type')
+
+
+def _trade(timestamp, price, quantity, token=1):
+    return Header(0, 0, b'T'), {'msg_type': b'T', 'token': token, 'timestamp': timestamp, 'price': price,
+                                'quantity': quantity}
+
+
+class BarAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.save_filename = os.path.join(self.work_dir, 'bars.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def bars(self, trades, interval=100):
+        aggregator = BarAggregator(self.save_filename, interval)
+        for header, record in trades:
+            aggregator.add(0, header, record)
+        aggregator.add(0, Header(0, 0, b'N'), {})  # not a trade, ignored
+        aggregator.close()
+        with open(self.save_filename) as bars_file:
+            return [dict((key, float(value)) for key, value in row.items()) for row in csv.DictReader(bars_file)]
+
+    def test_ohlcv(self):
+        bars = self.bars([_trade(10, 100, 1), _trade(20, 110, 3), _trade(30, 90, 1), _trade(40, 95, 5),
+                          _trade(150, 120, 2), _trade(15, 200, 1, token=2)])
+        self.assertEqual([(bar['token'], bar['bar_start']) for bar in bars], [(1, 0), (1, 100), (2, 0)])
+        first = bars[0]
+        self.assertEqual((first['open'], first['high'], first['low'], first['close']), (100, 110, 90, 95))
+        self.assertEqual((first['volume'], first['trades']), (10, 4))
+        self.assertAlmostEqual(first['vwap'], (100 + 110 * 3 + 90 + 95 * 5) / 10.0)
+        self.assertEqual((bars[1]['open'], bars[1]['volume'], bars[1]['trades']), (120, 2, 1))
+
+    def test_late_trades_in_the_running_bar(self):
+        # the trades at 50 and 99 arrive once the bar starting at 100 runs
+        bars = self.bars([_trade(10, 100, 1), _trade(120, 105, 1), _trade(50, 80, 2), _trade(99, 130, 1),
+                          _trade(130, 110, 1)])
+        self.assertEqual([bar['bar_start'] for bar in bars], [0, 100])
+        self.assertEqual(bars[0]['trades'], 1)
+        late = bars[1]
+        self.assertEqual((late['open'], late['high'], late['low'], late['close']), (105, 130, 80, 110))
+        self.assertEqual((late['volume'], late['trades']), (5, 4))
+        self.assertAlmostEqual(late['vwap'], (105 + 80 * 2 + 130 + 110) / 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
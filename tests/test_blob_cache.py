@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blob_cache import BlobCache, CACHE_DISK_SHARE
+
+
+class _Blob(object):
+    def __init__(self, name, data, generation=1):
+        self.name = name
+        self.data = data
+        self.generation = generation
+        self.md5_hash = None
+        self.size = len(data)
+
+    def download_to_file(self, file_obj):
+        file_obj.write(self.data)
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as file_obj:
+            self.download_to_file(file_obj)
+
+
+class BlobCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache = BlobCache(os.path.join(self.work_dir, 'cache'), max_bytes=150)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def fetch(self, blob):
+        return self.cache.fetch(blob, os.path.join(self.work_dir, 'out'))
+
+    def test_hit(self):
+        blob = _Blob('a', b'x' * 100)
+        self.assertFalse(self.fetch(blob))
+        self.assertTrue(self.fetch(blob))
+        with open(os.path.join(self.work_dir, 'out'), 'rb') as out:
+            self.assertEqual(out.read(), blob.data)
+
+    def test_evicts_the_least_recently_used(self):
+        first, second = _Blob('a', b'x' * 100), _Blob('b', b'y' * 100)
+        self.fetch(first)
+        self.fetch(second)
+        self.assertIsNone(self.cache.get(first))
+        self.assertIsNotNone(self.cache.get(second))
+
+    def test_entries_being_read_are_not_evicted(self):
+        first, second = _Blob('a', b'x' * 100), _Blob('b', b'y' * 100)
+        self.fetch(first)
+        with self.cache.reading(first) as path:
+            self.fetch(second)  # over max_bytes, but `first` is being read
+            with open(path, 'rb') as cached:
+                self.assertEqual(cached.read(), first.data)
+        self.assertIsNotNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))  # evicted in its place to fit in max_bytes
+
+    def test_fetched_file_is_a_link(self):
+        blob = _Blob('a', b'x' * 100)
+        self.fetch(blob)
+        out = os.path.join(self.work_dir, 'out')
+        self.assertTrue(os.path.samefile(out, self.cache.get(blob)))
+        with self.cache.reading(blob) as path:
+            self.fetch(_Blob('a', b'z' * 100, generation=2))  # replaced, the entry of the first one is intact
+            with open(path, 'rb') as cached:
+                self.assertEqual(cached.read(), blob.data)
+        with open(out, 'rb') as replaced:
+            self.assertEqual(replaced.read(), b'z' * 100)
+
+    def test_eviction_removes_the_lock_files(self):
+        first, second = _Blob('a', b'x' * 100), _Blob('b', b'y' * 100)
+        self.fetch(first)
+        self.fetch(second)
+        self.assertEqual(os.listdir(self.cache.locks), [BlobCache.key(second)])
+
+    def test_entries_not_removed_stay_accounted(self):
+        first, second, third = _Blob('a', b'x' * 60), _Blob('b', b'y' * 60), _Blob('c', b'z' * 60)
+        self.fetch(first)
+        self.fetch(second)
+        with self.cache.reading(first):
+            self.fetch(third)  # `first` is left, `second` is evicted in its place
+        self.assertIsNotNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+
+    def test_capacity_from_the_free_disk_space(self):
+        cache = BlobCache(os.path.join(self.work_dir, 'sized'), max_bytes=None)
+        stat = os.statvfs(cache.root)
+        self.assertEqual(cache.capacity(), int(stat.f_bavail * stat.f_frsize * CACHE_DISK_SHARE))
+        self.assertGreater(cache.capacity(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from capture_generator import generate_capture
+from capture_index import CaptureIndex, build_index, read_messages, _Collector
+from log_parser import StreamParser
+
+
+def _all_messages(filename):
+    collector = _Collector()
+    parser = StreamParser([collector], name=filename)
+    with open(filename, 'rb') as infile:
+        parser.feed(infile.read())
+    parser.close()
+    return collector.records
+
+
+class MultiStreamCaptureIndexTest(unittest.TestCase):
+    """
+    The synthetic captures interleave 4 streams, each with its own seq_nos
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.work_dir, 'capture.bin')
+        generate_capture(cls.filename, messages=20000, tokens=20, streams=4, seed=1)
+        cls.index = build_index(cls.filename, every=64)
+        cls.messages = _all_messages(cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def expected(self, stream_id, start_seq_no, end_seq_no):
+        return [record for record_stream, record in self.messages
+                if record_stream == stream_id and start_seq_no <= record['seq_no'] <= end_seq_no]
+
+    def test_streams(self):
+        self.assertEqual(self.index.streams(), [0, 1, 2, 3])
+        self.assertEqual(CaptureIndex.load(self.filename + '.idx').streams(), [0, 1, 2, 3])
+
+    def test_read_seq_no_range_per_stream(self):
+        for stream_id in self.index.streams():
+            for start_seq_no, end_seq_no in ((1, 50), (100, 200), (2000, 2100), (4000, 4500)):
+                expected = self.expected(stream_id, start_seq_no, end_seq_no)
+                self.assertTrue(expected)
+                got = list(read_messages(self.filename, self.index, start_seq_no, end_seq_no, stream_id=stream_id))
+                self.assertEqual(got, expected)
+
+    def test_seek_is_before_the_message(self):
+        for stream_id in self.index.streams():
+            offset = self.index.seek_seq_no(3000, stream_id)
+            got = list(read_messages(self.filename, self.index, 3000, 3000, stream_id=stream_id))
+            self.assertEqual([record['seq_no'] for record in got], [3000])
+            self.assertGreater(offset, 0)
+
+    def test_seq_no_range_needs_the_stream(self):
+        with self.assertRaises(ValueError):
+            list(read_messages(self.filename, self.index, 100, 200))
+        with self.assertRaises(ValueError):
+            self.index.seek_seq_no(100)
+
+
+class SingleStreamCaptureIndexTest(unittest.TestCase):
+    def test_read_seq_no_range(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(work_dir, 'capture.bin')
+            generate_capture(filename, messages=5000, tokens=10, streams=1, seed=2)
+            index = build_index(filename, every=32)
+            got = list(read_messages(filename, index, 1000, 1100))
+            self.assertEqual([record['seq_no'] for record in got], list(range(1000, 1101)))
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_truncated_last_message(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(work_dir, 'capture.bin')
+            count, size = generate_capture(filename, messages=1000, tokens=5, streams=1, seed=2)
+            with open(filename, 'r+b') as capture:
+                capture.truncate(size - 3)  # the capture was cut in the middle of its last message
+            index = build_index(filename, every=32)
+            got = list(read_messages(filename, index, 990))
+            self.assertEqual([record['seq_no'] for record in got], list(range(990, 1001)))
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
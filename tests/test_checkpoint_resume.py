@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from capture_generator import generate_capture
+from fake_gcp import FakeGcp
+
+BIN_DATA_SOURCE_BLOB = 'resume_bin'
+CHECKPOINT_BYTES = 64 * 1024
+
+
+class _Preempted(Exception):
+    pass
+
+
+def _connection_reset(data):
+    raise IOError("connection reset")
+
+
+class WorkerResumeTest(unittest.TestCase):
+    """
+    A worker preempted partway through a file resumes it from its last checkpoint, with the
+    integrity checks on (CHECK_INTEGRITY is on by default), to the same outputs as a clean run
+    """
+    streaming = False
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = os.path.join(self.work_dir, 'home')
+        self.fake = FakeGcp()
+        self.fake.install()
+
+        import blob_cache
+        import checkpoints
+        import log_parser
+        import taskers
+        from constants import BUCKET_NAME
+        self.blob_cache, self.checkpoints, self.log_parser, self.taskers = blob_cache, checkpoints, log_parser, taskers
+        self.bucket_name = BUCKET_NAME
+        self.cache_max_bytes, blob_cache.CACHE_MAX_BYTES = blob_cache.CACHE_MAX_BYTES, 0
+        self.add_part = checkpoints.FileCheckpoint.add_part
+        self.open_stream = log_parser.open_stream
+
+        capture = os.path.join(self.work_dir, 'capture.bin')
+        generate_capture(capture, messages=30000, tokens=20, streams=4, gap_rate=0.01, seed=5)
+        with open(capture, 'rb') as capture_file:
+            self.fake.put(BUCKET_NAME, BIN_DATA_SOURCE_BLOB + '/capture.bin', capture_file.read())
+
+    def tearDown(self):
+        self.checkpoints.FileCheckpoint.add_part = self.add_part
+        self.log_parser.open_stream = self.open_stream
+        self.blob_cache.CACHE_MAX_BYTES = self.cache_max_bytes
+        if self.home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.home
+        shutil.rmtree(self.work_dir)
+
+    def run_worker(self, **kwargs):
+        kwargs.setdefault('streaming', self.streaming)
+        self.taskers.worker_task(0, 1, BIN_DATA_SOURCE_BLOB, check_integrity=True, **kwargs)
+        prefix = 'processed/' + BIN_DATA_SOURCE_BLOB + '/'
+        return dict((name, self.fake.get(self.bucket_name, name))
+                    for name in self.fake.bucket_store(self.bucket_name) if name.startswith(prefix))
+
+    def test_resume_with_integrity_checks(self):
+        expected = self.run_worker()
+        summary = json.loads(expected['processed/resume_bin/capture.integrity.json'].decode('utf-8'))
+        self.assertFalse(summary['ok'])  # the gaps before the checkpoint must be carried over
+
+        parts = []
+
+        def add_part(checkpoint, *args, **kwargs):
+            if len(parts) == 3:
+                raise _Preempted()
+            self.add_part(checkpoint, *args, **kwargs)
+            parts.append(checkpoint.state['offset'])
+
+        self.checkpoints.FileCheckpoint.add_part = add_part
+        with self.assertRaises(_Preempted):
+            self.run_worker(checkpoint_run='run', checkpoint_bytes=CHECKPOINT_BYTES)
+        self.checkpoints.FileCheckpoint.add_part = self.add_part
+
+        offsets = []
+
+        def open_stream(*args, **kwargs):
+            offsets.append(kwargs.get('offset'))
+            return self.open_stream(*args, **kwargs)
+
+        self.log_parser.open_stream = open_stream
+        for name in expected:
+            del self.fake.bucket_store(self.bucket_name)[name]
+        resumed = self.run_worker(checkpoint_run='run', checkpoint_bytes=CHECKPOINT_BYTES)
+        self.assertEqual(offsets, [parts[-1]])
+        self.assertGreater(parts[-1], 0)
+        self.assertEqual(sorted(resumed), sorted(expected))
+        self.assertEqual(self.outputs(resumed), self.outputs(expected))
+
+    def outputs(self, outputs):
+        # the trailer's heartbeat went through the checkpoint's json, its keys may be reordered
+        return dict((name, json.loads(data.decode('utf-8'))) for name, data in outputs.items())
+
+
+class StreamingWorkerResumeTest(WorkerResumeTest):
+    """
+    The same, parsing from the download stream (STREAMING), resumed with a ranged download
+    """
+    streaming = True
+
+    def test_same_outputs_as_parsing_the_downloaded_files(self):
+        self.assertEqual(self.outputs(self.run_worker()), self.outputs(self.run_worker(streaming=False)))
+
+    def test_parser_closed_on_a_failed_download(self):
+        parsers = []
+
+        def open_stream(*args, **kwargs):
+            parser = self.open_stream(*args, **kwargs)
+            parsers.append(parser)
+            parser.write = _connection_reset  # the download fails at its first chunk
+            return parser
+
+        self.log_parser.open_stream = open_stream
+        with self.assertRaises(IOError):
+            self.run_worker()
+        self.assertTrue(parsers[0].sinks[0].outfile.closed)
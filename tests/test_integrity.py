@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+from integrity import IntegrityChecker
+
+Header = namedtuple('Header', 'stream_id seq_no msg_type')
+
+
+def _check(checker, seq_nos, stream_id=0):
+    for seq_no in seq_nos:
+        last = checker.last_seq[stream_id]
+        if seq_no == last + 1 and last != -1:
+            checker.last_seq[stream_id] = seq_no  # advanced by the parser's loop, not checked
+        else:
+            checker.check(0, Header(stream_id, seq_no, b'N'), {})
+
+
+class IntegrityCheckerTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def summary(self, checker):
+        checker.save_filename = os.path.join(self.work_dir, 'integrity.json')
+        checker.close()
+        with open(checker.save_filename) as summary_file:
+            return json.load(summary_file)['streams']['0']
+
+    def test_late_messages_fill_the_gaps(self):
+        checker = IntegrityChecker()
+        _check(checker, [1, 2, 6, 4, 3, 7, 10, 8])
+        summary = self.summary(checker)
+        self.assertEqual((summary['gaps'], summary['missing'], summary['filled']), (2, 2, 3))  # 5 and 9 missing
+        self.assertEqual((summary['out_of_order'], summary['messages']), (3, 8))
+
+    def test_late_duplicates_are_not_fills(self):
+        checker = IntegrityChecker()
+        _check(checker, [1, 2, 3, 5, 2, 4, 4])
+        summary = self.summary(checker)
+        self.assertEqual((summary['missing'], summary['filled'], summary['out_of_order']), (0, 1, 3))
+        self.assertEqual(summary['messages'], 7)
+
+    def test_open_gaps_restored(self):
+        checker = IntegrityChecker()
+        _check(checker, [1, 5, 3])
+        resumed = IntegrityChecker()
+        resumed.restore(json.loads(json.dumps(checker.state())))
+        _check(resumed, [2, 4, 6])
+        summary = self.summary(resumed)
+        self.assertEqual((summary['missing'], summary['filled'], summary['messages']), (0, 3, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fake_gcp import FakeGcp
+from pipeline_benchmark import _make_inputs, _thread_pool
+
+ZIP_BLOB = 'local_zip'
+BIN_DATA_SOURCE_BLOB = 'local_bin'
+
+
+class LocalTaskTest(unittest.TestCase):
+    """
+    The local execution mode unzips the input and parses it on this host, to the outputs of the
+    worker tasks of the instances
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = os.path.join(self.work_dir, 'home')
+        self.fake = FakeGcp()
+        self.fake.install()
+
+        import blob_cache
+        import taskers
+        from constants import BUCKET_NAME
+        self.blob_cache, self.taskers, self.bucket_name = blob_cache, taskers, BUCKET_NAME
+        self.cache_max_bytes, blob_cache.CACHE_MAX_BYTES = blob_cache.CACHE_MAX_BYTES, 0
+        self.input_bytes = _make_inputs(self.fake, self.work_dir, 3, 5000, 20, ZIP_BLOB, BUCKET_NAME)
+
+    def tearDown(self):
+        self.blob_cache.CACHE_MAX_BYTES = self.cache_max_bytes
+        if self.home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.home
+        shutil.rmtree(self.work_dir)
+
+    def outputs(self):
+        return dict((name, self.fake.get(self.bucket_name, name))
+                    for name in self.fake.bucket_store(self.bucket_name) if name.startswith('processed/'))
+
+    def test_same_outputs_as_the_worker_tasks(self):
+        # the fake storage lives in this process, the pool runs threads
+        with _thread_pool():
+            self.taskers.local_task(ZIP_BLOB, BIN_DATA_SOURCE_BLOB, {}, processes=2)
+        bin_files = [name for name in self.fake.bucket_store(self.bucket_name)
+                     if name.startswith(BIN_DATA_SOURCE_BLOB + '/')]
+        self.assertEqual(len(bin_files), 3)
+        local = self.outputs()
+        self.assertTrue(local)
+
+        for name in local:
+            del self.fake.bucket_store(self.bucket_name)[name]
+        for instance_no in range(3):
+            self.taskers.worker_task(instance_no, 3, BIN_DATA_SOURCE_BLOB)
+        self.assertEqual(self.outputs(), local)
+
+    def test_input_bytes(self):
+        inputs = {'BIN_DATA_SOURCE_BLOB': BIN_DATA_SOURCE_BLOB, 'ZIP_BLOB': ZIP_BLOB}
+        self.assertGreater(self.taskers.input_bytes(inputs), 0)  # estimated from the zip
+        self.taskers.unzip_to_bucket(ZIP_BLOB, BIN_DATA_SOURCE_BLOB)
+        self.assertEqual(self.taskers.input_bytes(inputs), self.input_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def test_timer_and_counters(self):
+        collected = metrics.Metrics()
+        for seconds in (0.5, 2.0, 1.0):
+            collected.add_time('worker.parse', seconds)
+        with collected.timer('worker.upload'):
+            pass
+        collected.incr('worker.files')
+        collected.incr('worker.bytes', 100)
+        collected.incr('worker.bytes', 20)
+        as_dict = collected.as_dict()
+        self.assertEqual(as_dict['timers']['worker.parse'], {'count': 3, 'seconds': 3.5, 'max_seconds': 2.0})
+        self.assertEqual(as_dict['timers']['worker.upload']['count'], 1)
+        self.assertEqual(as_dict['counters'], {'worker.files': 1, 'worker.bytes': 120})
+
+    def test_timer_records_a_failed_block(self):
+        collected = metrics.Metrics()
+        with self.assertRaises(ValueError):
+            with collected.timer('worker.parse'):
+                raise ValueError()
+        self.assertEqual(collected.timers['worker.parse'][0], 1)
+
+    def test_merge(self):
+        first, second = metrics.Metrics(), metrics.Metrics()
+        first.add_time('worker.parse', 1.0)
+        first.incr('worker.files', 2)
+        second.add_time('worker.parse', 3.0)
+        second.add_time('worker.upload', 0.5)
+        second.incr('worker.files')
+        first.merge(second)
+        self.assertEqual(first.timers, {'worker.parse': [2, 4.0, 3.0], 'worker.upload': [1, 0.5, 0.5]})
+        self.assertEqual(first.counters, {'worker.files': 3})
+
+    def test_collect_nests_and_merges_into_the_enclosing_block(self):
+        with metrics.collect() as outer:
+            metrics.incr('outer')
+            with metrics.collect() as inner:
+                metrics.incr('inner')
+                with metrics.timer('inner.stage'):
+                    pass
+            self.assertEqual(inner.counters, {'inner': 1})
+            self.assertIs(metrics.current(), outer)
+        self.assertEqual(outer.counters, {'outer': 1, 'inner': 1})
+        self.assertEqual(outer.timers['inner.stage'][0], 1)
+        self.assertIs(metrics.current(), metrics.default)
+
+    def test_collect_is_per_thread(self):
+        other = []
+        with metrics.collect() as collected:
+            thread = threading.Thread(target=lambda: other.append(metrics.current()))
+            thread.start()
+            thread.join()
+            metrics.incr('worker.files')
+        self.assertIs(other[0], metrics.default)
+        self.assertEqual(collected.counters, {'worker.files': 1})
+
+    def test_timed(self):
+        @metrics.timed('decorated')
+        def decorated(value):
+            """doc"""
+            return value * 2
+
+        with metrics.collect() as collected:
+            self.assertEqual(decorated(2), 4)
+        self.assertEqual(collected.timers['decorated'][0], 1)
+        self.assertEqual((decorated.__name__, decorated.__doc__), ('decorated', 'doc'))
+
+    def test_formats(self):
+        collected = metrics.Metrics()
+        collected.add_time('worker.parse', 1.5)
+        collected.incr('worker.files', 2)
+        self.assertEqual(collected.to_statsd(prefix='p'), ['p.worker.parse:1500|ms', 'p.worker.files:2|c'])
+        text = collected.to_prometheus(prefix='p', labels={'task_id': 'worker_0'})
+        self.assertIn('p_worker_parse_seconds_count{task_id="worker_0"} 1\n', text)
+        self.assertIn('p_worker_parse_seconds_sum{task_id="worker_0"} 1.5\n', text)
+        self.assertIn('p_worker_files_total{task_id="worker_0"} 2\n', text)
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.textfile_dir, metrics.METRICS_TEXTFILE_DIR = metrics.METRICS_TEXTFILE_DIR, self.work_dir
+        self.statsd_host, metrics.STATSD_HOST = metrics.STATSD_HOST, None
+
+    def tearDown(self):
+        metrics.METRICS_TEXTFILE_DIR = self.textfile_dir
+        metrics.STATSD_HOST = self.statsd_host
+        shutil.rmtree(self.work_dir)
+
+    def test_textfile(self):
+        task_metrics, totals = metrics.Metrics(), metrics.Metrics()
+        task_metrics.incr('sensor.pokes')
+        totals.incr('sensor.pokes', 5)
+        metrics.export(task_metrics, labels={'task_id': 'completion', 'dag_id': 'my dag'}, totals=totals)
+        self.assertEqual(os.listdir(self.work_dir), ['my_dag_completion.prom'])
+        with open(os.path.join(self.work_dir, 'my_dag_completion.prom')) as prom_file:
+            self.assertIn('_sensor_pokes_total{dag_id="my dag",task_id="completion"} 5\n', prom_file.read())
+
+    def test_failures_are_not_raised(self):
+        metrics.METRICS_TEXTFILE_DIR = os.path.join(self.work_dir, 'missing')
+        metrics.export(metrics.Metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+from order_book import BookEngine
+
+Header = namedtuple('Header', 'stream_id seq_no msg_type')
+
+
+def _message(stream_id, seq_no, msg_type, order_id, token=1, price=100):
+    record = {'msg_type': msg_type, 'seq_no': seq_no, 'timestamp': seq_no, 'token': token,
+              'order_id': order_id, 'order_type': b'B', 'price': price, 'quantity': 10}
+    return Header(stream_id, seq_no, msg_type), record
+
+
+class BookEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def run_engine(self, messages, **kwargs):
+        engine = BookEngine(os.path.join(self.work_dir, 'book.jsonl'), **kwargs)
+        for header, record in messages:
+            engine.add(0, header, record)
+        engine.close()
+        return engine
+
+    def test_applied_in_seq_no_order_by_default(self):
+        # the cancel of the order arrives before the order
+        engine = self.run_engine([_message(0, 2, b'X', 1), _message(0, 1, b'N', 1)])
+        self.assertEqual(engine.unknown_orders, 0)
+        self.assertEqual(engine.books[1].top()[0], None)
+
+    def test_streams_reordered_apart(self):
+        # stream 1's seq_nos are much lower than stream 0's, they must not hold stream 0 back
+        messages = [_message(0, 1000, b'N', 1, token=1), _message(1, 5, b'X', 2, token=2),
+                    _message(0, 1001, b'X', 1, token=1), _message(1, 4, b'N', 2, token=2)]
+        engine = self.run_engine(messages, reorder_window=1)
+        self.assertEqual(engine.unknown_orders, 0)
+        self.assertEqual(engine.books[1].top()[0], None)
+        self.assertEqual(engine.books[2].top()[0], None)
+
+    def test_no_reordering(self):
+        engine = self.run_engine([_message(0, 2, b'X', 1), _message(0, 1, b'N', 1)], reorder_window=0)
+        self.assertEqual(engine.unknown_orders, 1)
+
+    def snapshots(self):
+        with open(os.path.join(self.work_dir, 'book.jsonl')) as snapshots_file:
+            return [json.loads(line) for line in snapshots_file]
+
+    def test_snapshots_on_top_changes(self):
+        messages = [_message(0, 1, b'N', 1, price=100), _message(0, 2, b'N', 2, price=99),
+                    _message(0, 3, b'N', 3, price=101), _message(0, 4, b'X', 2, price=99)]
+        self.run_engine(messages, reorder_window=0)
+        # the orders at 99, under the best bid, leave the top as it is
+        self.assertEqual([(snapshot['seq_no'], snapshot['bid']) for snapshot in self.snapshots()],
+                         [(1, 100), (3, 101)])
+
+    def test_snapshot_interval(self):
+        messages = [_message(0, seq_no, b'N', seq_no, price=100 + seq_no) for seq_no in range(1, 11)]
+        self.run_engine(messages, reorder_window=0, snapshot_interval=4)
+        self.assertEqual([snapshot['seq_no'] for snapshot in self.snapshots()], [1, 5, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Checks that the native decoding loop of log_parser (log_parser_speedups.pyx) gives exactly
+the records of the python one: same offsets, headers, records, unknown msg_types and
+integrity summaries, for every chunking of the captures. The native checks are skipped where
+the native engine is not available (Cython not installed).
+"""
+import logging
+import os
+import random
+import struct
+import sys
+import unittest
+
+import log_parser
+from integrity import IntegrityChecker
+
+HEADER = struct.Struct('<hhic')
+ORDER = struct.Struct('<qdicii')
+TRADE = struct.Struct('<qddiii')
+HEARTBEAT = struct.Struct('<i')
+CHUNK_SIZES = (1, 7, 19, 64, 4096, 1 << 20)
+
+
+class _Collector(object):
+    def __init__(self):
+        self.records = []
+
+    def add(self, offset, header, record):
+        self.records.append((offset, header.msg_len, header.stream_id, header.seq_no, header.msg_type,
+                             sorted(record.items())))
+
+    def close(self):
+        pass
+
+
+def _message(msg_type, stream_id, seq_no, payload):
+    return HEADER.pack(HEADER.size + len(payload), stream_id, seq_no, msg_type) + payload
+
+
+def make_capture(messages, seed=0):
+    """
+    Random capture mixing every registered layout, gaps, duplicates, out of order
+    messages, unknown msg_types and short payloads
+    """
+    rnd = random.Random(seed)
+    seq_nos = {}
+    out = []
+    for _ in range(messages):
+        stream_id = rnd.randint(0, 3)
+        seq_no = seq_nos.get(stream_id, rnd.randint(0, 1000)) + 1
+        roll = rnd.random()
+        if roll < 0.02:
+            seq_no += rnd.randint(1, 5)
+        elif roll < 0.04:
+            seq_no -= rnd.randint(0, 3)
+        seq_nos[stream_id] = max(seq_no, seq_nos.get(stream_id, seq_no))
+        timestamp = 1500000000000 + len(out)
+        kind = rnd.random()
+        if kind < 0.5:
+            payload = ORDER.pack(timestamp, rnd.random() * 1e9, rnd.randint(1, 50), rnd.choice([b'B', b'S']),
+                                 rnd.randint(1, 10000), rnd.randint(1, 500))
+            msg_type = rnd.choice([b'N', b'M', b'X'])
+        elif kind < 0.85:
+            payload = TRADE.pack(timestamp, rnd.random() * 1e9, rnd.random() * 1e9, rnd.randint(1, 50),
+                                 rnd.randint(1, 10000), rnd.randint(1, 500))
+            msg_type = b'T'
+        elif kind < 0.95:
+            payload = HEARTBEAT.pack(seq_nos[stream_id] + rnd.randint(0, 1))
+            msg_type = b'Z'
+        else:
+            payload = os.urandom(rnd.randint(0, 40)) if rnd.random() < 0.5 else b'\0' * 8
+            msg_type = rnd.choice([b'Q', b'\xff', b'\0'])
+        if rnd.random() < 0.01:
+            payload = payload[:rnd.randint(0, len(payload))]  # short payload
+        out.append(_message(msg_type, stream_id, seq_no, payload))
+    return b''.join(out)
+
+
+def run(engine, data, chunk_size, integrity=True):
+    collector = _Collector()
+    checker = IntegrityChecker() if integrity else None
+    parser = log_parser.StreamParser([collector], integrity=checker, engine=engine)
+    for start in range(0, len(data), chunk_size):
+        parser.feed(data[start:start + chunk_size])
+    parser.close()
+    return collector.records, parser.counter, parser.unknown_msg_types, checker and checker.summary
+
+
+class ParserParityTest(unittest.TestCase):
+    engine = 'python'
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.engine not in log_parser.engines():
+            raise unittest.SkipTest("{} engine not available".format(cls.engine))
+
+    def setUp(self):
+        logging.disable(logging.WARNING)  # the integrity issues of the random captures are expected
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def check(self, data, chunk_sizes=CHUNK_SIZES):
+        expected = run('python', data, len(data) or 1)
+        for chunk_size in chunk_sizes:
+            self.assertEqual(run(self.engine, data, chunk_size), expected,
+                             "engine {}, chunk size {}".format(self.engine, chunk_size))
+
+    def test_empty(self):
+        self.check(b'')
+
+    def test_mixed(self):
+        self.check(make_capture(20000))
+
+    def test_truncated_tail(self):
+        self.check(make_capture(3000, seed=1)[:-5])
+
+    def test_header_only_tail(self):
+        self.check(make_capture(3000, seed=2) + HEADER.pack(40, 1, 5, b'N'))
+
+    def test_field_subset(self):
+        # decoders extracting a subset of the fields go through MessageDecoder.decode
+        saved = dict(log_parser.DECODERS)
+        log_parser.register_message_type([b'T'], log_parser.TradePayload, ['token', 'price', 'quantity'])
+        log_parser.register_message_type([b'Q'], log_parser.HeartBeatPayload)
+        try:
+            self.check(make_capture(5000, seed=3))
+        finally:
+            log_parser.DECODERS.clear()
+            log_parser.DECODERS.update(saved)
+
+
+class NativeParserParityTest(ParserParityTest):
+    engine = 'native'
+
+
+class NativeEngineLoadingTest(unittest.TestCase):
+    def test_unavailable_native_loop_is_logged(self):
+        saved = sys.modules.get('log_parser_speedups')
+        sys.modules['log_parser_speedups'] = None  # its import fails, prebuilt or built
+        try:
+            with self.assertLogs('log_parser', level='WARNING') as logs:
+                self.assertIsNone(log_parser._load_native_engine())
+        finally:
+            if saved is None:
+                del sys.modules['log_parser_speedups']
+            else:
+                sys.modules['log_parser_speedups'] = saved
+        self.assertIn('python engine', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
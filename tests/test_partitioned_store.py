@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from capture_generator import generate_capture
+from capture_index import _Collector
+from log_parser import StreamParser, _json_default
+from partitioned_store import PartitionWriter, LocalReader, GcsReader, query, bucket_path, manifest_path
+
+
+class _CountingReader(object):
+    def __init__(self, reader):
+        self.reader = reader
+        self.reads = 0
+
+    def manifests(self):
+        return self.reader.manifests()
+
+    def read(self, path, offset, length):
+        self.reads += 1
+        return self.reader.read(path, offset, length)
+
+
+class PartitionedStoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        capture = os.path.join(cls.work_dir, 'capture.bin')
+        generate_capture(capture, messages=20000, tokens=20, streams=2, seed=4)
+        cls.root = os.path.join(cls.work_dir, 'store')
+        cls.writer = PartitionWriter(cls.root, 'capture', buckets=8, row_group_size=256)
+        collector = _Collector()
+        with StreamParser([cls.writer, collector]) as parser, open(capture, 'rb') as infile:
+            parser.feed(infile.read())
+        # the rows as stored (json), for comparing with the query results
+        cls.rows = [json.loads(json.dumps(record, default=_json_default)) for _, record in collector.records
+                    if 'token' in record]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def expected(self, token=None, msg_types=None, start_timestamp=None, end_timestamp=None):
+        return sorted((row for row in self.rows
+                       if (token is None or row['token'] == token)
+                       and (msg_types is None or row['msg_type'] in msg_types)
+                       and (start_timestamp is None or row['timestamp'] >= start_timestamp)
+                       and (end_timestamp is None or row['timestamp'] <= end_timestamp)),
+                      key=lambda row: (row['timestamp'], row['seq_no'], row['msg_type']))
+
+    def query(self, reader, **kwargs):
+        return sorted(query(reader, **kwargs), key=lambda row: (row['timestamp'], row['seq_no'], row['msg_type']))
+
+    def test_manifest_row_groups(self):
+        with open(os.path.join(self.root, manifest_path('capture'))) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest['buckets'], 8)
+        self.assertEqual(sum(group['rows'] for groups in manifest['row_groups'].values() for group in groups),
+                         len(self.rows))
+        for bucket, groups in manifest['row_groups'].items():
+            path = os.path.join(self.root, bucket_path('capture', bucket))
+            # the row groups follow each other to the end of the bucket file
+            self.assertEqual([group['offset'] for group in groups],
+                             [sum(group['length'] for group in groups[:i]) for i in range(len(groups))])
+            self.assertEqual(sum(group['length'] for group in groups), os.path.getsize(path))
+            self.assertTrue(all(int(bucket) == token % 8 for group in groups for token in group['tokens']))
+        self.assertEqual(self.writer.paths()[-1], os.path.join(self.root, manifest_path('capture')))
+
+    def test_queries(self):
+        timestamps = sorted(row['timestamp'] for row in self.rows)
+        start, end = timestamps[len(timestamps) // 3], timestamps[len(timestamps) // 2]
+        for kwargs in ({'token': 3}, {'msg_types': ['T']}, {'start_timestamp': start, 'end_timestamp': end},
+                       {'token': 7, 'msg_types': ['N', 'X'], 'start_timestamp': start}):
+            expected = self.expected(**kwargs)
+            self.assertTrue(expected, kwargs)
+            self.assertEqual(self.query(LocalReader(self.root), **kwargs), expected, kwargs)
+
+    def test_only_the_matching_row_groups_are_read(self):
+        with open(os.path.join(self.root, manifest_path('capture'))) as manifest_file:
+            manifest = json.load(manifest_file)
+        groups = manifest['row_groups'][str(3 % 8)]
+        reader = _CountingReader(LocalReader(self.root))
+        list(query(reader, token=3))
+        self.assertEqual(reader.reads, sum(1 for group in groups if 3 in group['tokens']))
+
+        first = min(row['timestamp'] for row in self.rows)
+        reader = _CountingReader(LocalReader(self.root))
+        list(query(reader, end_timestamp=first))
+        self.assertEqual(reader.reads, sum(1 for groups in manifest['row_groups'].values() for group in groups
+                                           if group['min_timestamp'] <= first))
+        self.assertLessEqual(reader.reads, len(manifest['row_groups']))
+
+    def test_gcs_reader_ranged_reads(self):
+        from fake_gcp import FakeGcp
+        fake = FakeGcp()
+        fake.install()
+        for path in self.writer.paths():
+            with open(path, 'rb') as stored:
+                fake.put('bucket', 'store/' + os.path.relpath(path, self.root).replace(os.sep, '/'), stored.read())
+        reader = GcsReader('store', 'bucket')
+        self.assertEqual(self.query(reader, token=5, msg_types=['T']), self.expected(token=5, msg_types=['T']))
+
+
+if __name__ == '__main__':
+    unittest.main()
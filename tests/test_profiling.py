@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import profiling
+
+
+def _busy(seconds):
+    import time
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class ProfileModeTest(unittest.TestCase):
+    def setUp(self):
+        self.environ = os.environ.pop('WORKER_PROFILE', None)
+
+    def tearDown(self):
+        os.environ.pop('WORKER_PROFILE', None)
+        if self.environ is not None:
+            os.environ['WORKER_PROFILE'] = self.environ
+
+    def test_modes(self):
+        self.assertIsNone(profiling.profile_mode())
+        self.assertEqual(profiling.profile_mode('cprofile'), 'cprofile')
+        self.assertIsNone(profiling.profile_mode('unknown'))
+        os.environ['WORKER_PROFILE'] = 'sample'
+        self.assertEqual(profiling.profile_mode(), 'sample')
+        self.assertEqual(profiling.profile_mode('cprofile'), 'cprofile')  # the DAG's first
+
+
+class ProfiledTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_off(self):
+        with profiling.profiled(None, 'worker', save_root=self.work_dir) as paths:
+            pass
+        self.assertEqual(paths, [])
+        self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_sample(self):
+        with profiling.profiled('sample', 'worker', save_root=self.work_dir) as paths:
+            _busy(0.2)
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(paths[0].endswith('.folded'))
+        with open(paths[0]) as folded:
+            lines = folded.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('_busy (test_profiling.py' in line for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+    def test_cprofile_saved_on_errors(self):
+        with self.assertRaises(ValueError):
+            with profiling.profiled('cprofile', 'worker', save_root=os.path.join(self.work_dir, 'new')) as paths:
+                _busy(0.01)
+                raise ValueError()
+        self.assertEqual([os.path.splitext(path)[1] for path in paths], ['.prof', '.txt'])
+        with open(paths[1]) as summary:
+            self.assertIn('_busy', summary.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
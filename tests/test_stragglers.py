@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from taskers import aggregate_progress, find_stragglers
+
+
+def _report(bytes_per_sec, eta_seconds, done=False, **kwargs):
+    report = {'bytes': 100, 'total_bytes': 1000, 'messages': 10, 'msgs_per_sec': bytes_per_sec / 10.0,
+              'bytes_per_sec': bytes_per_sec, 'eta_seconds': eta_seconds, 'done': done}
+    report.update(kwargs)
+    return report
+
+
+class AggregateProgressTest(unittest.TestCase):
+    def test_eta_once_every_worker_reported(self):
+        now = time.time()
+        reports = [_report(100.0, 50.0, reported_at=now - 20), _report(100.0, 10.0, reported_at=now), None]
+        progress = aggregate_progress(reports, 3)
+        self.assertEqual((progress['workers_reporting'], progress['workers_done']), (2, 0))
+        self.assertEqual((progress['bytes'], progress['total_bytes'], progress['bytes_per_sec']), (200, 2000, 200.0))
+        self.assertIsNone(progress['eta_seconds'])
+
+        progress = aggregate_progress(reports[:2], 2)
+        self.assertAlmostEqual(progress['eta_seconds'], 30.0, delta=1.0)  # as of its report, 20s ago
+        self.assertIsNotNone(progress['finish_at'])
+
+    def test_done_workers_do_not_count_in_the_throughput(self):
+        progress = aggregate_progress([_report(100.0, 0.0, done=True), _report(50.0, 10.0)], 2)
+        self.assertEqual((progress['workers_done'], progress['bytes_per_sec']), (1, 50.0))
+
+
+class FindStragglersTest(unittest.TestCase):
+    def test_slow_worker_with_enough_to_go(self):
+        reports = [_report(100.0, 60.0), _report(100.0, 60.0), _report(20.0, 600.0), None]
+        self.assertEqual(find_stragglers(reports, slowdown=2.0, min_seconds=120), [2])
+
+    def test_nearly_done_or_done_workers_are_not_duplicated(self):
+        now = time.time()
+        reports = [_report(100.0, 60.0), _report(100.0, 60.0), _report(20.0, 600.0, reported_at=now - 500),
+                   _report(20.0, 0.0, done=True)]
+        self.assertEqual(find_stragglers(reports, slowdown=2.0, min_seconds=120), [])
+
+    def test_not_slow_enough(self):
+        reports = [_report(100.0, 60.0), _report(100.0, 60.0), _report(60.0, 600.0)]
+        self.assertEqual(find_stragglers(reports, slowdown=2.0, min_seconds=120), [])
+
+    def test_needs_a_fleet_to_compare_with(self):
+        self.assertEqual(find_stragglers([_report(20.0, 600.0), None], slowdown=2.0, min_seconds=120), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
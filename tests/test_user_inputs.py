@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import user_inputs
+
+
+class _Unreachable(Exception):
+    pass
+
+
+class UserInputsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'user_inputs.json')
+        self.fetch_latest = user_inputs.fetch_latest
+        self.cache = user_inputs.USER_INPUTS_CACHE
+        self.fetches = 0
+        self.document = {'NO_OF_INSTANCES': 4, 'STREAMING': True}
+
+    def tearDown(self):
+        user_inputs.fetch_latest = self.fetch_latest
+        user_inputs.USER_INPUTS_CACHE = self.cache
+        shutil.rmtree(self.work_dir)
+
+    def database(self, up=True):
+        def fetch_latest():
+            self.fetches += 1
+            if not up:
+                raise _Unreachable("no database")
+            return dict(self.document)
+        user_inputs.fetch_latest = fetch_latest
+
+    def write_cache(self, document, age):
+        with open(self.path, 'w') as cache_file:
+            json.dump(document, cache_file)
+        mtime = time.time() - age
+        os.utime(self.path, (mtime, mtime))
+
+    def test_fresh_cache_is_not_refreshed(self):
+        self.database()
+        self.write_cache({'NO_OF_INSTANCES': 2}, age=10)
+        self.assertEqual(user_inputs.cached(self.path, ttl=60)['NO_OF_INSTANCES'], 2)
+        self.assertEqual(self.fetches, 0)
+
+    def test_stale_cache_is_refreshed(self):
+        self.database()
+        self.write_cache({'NO_OF_INSTANCES': 2}, age=120)
+        inputs = user_inputs.cached(self.path, ttl=60)
+        self.assertEqual((inputs['NO_OF_INSTANCES'], inputs['STREAMING']), (4, True))
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(user_inputs.cached(self.path, ttl=60)['NO_OF_INSTANCES'], 4)
+        self.assertEqual(self.fetches, 1)
+
+    def test_stale_cache_while_the_database_is_down(self):
+        self.database(up=False)
+        self.write_cache({'NO_OF_INSTANCES': 2}, age=120)
+        self.assertEqual(user_inputs.cached(self.path, ttl=60)['NO_OF_INSTANCES'], 2)
+        # kept for another ttl before retrying the database
+        self.assertEqual(user_inputs.cached(self.path, ttl=60)['NO_OF_INSTANCES'], 2)
+        self.assertEqual(self.fetches, 1)
+
+    def test_defaults_without_cache_nor_database(self):
+        self.database(up=False)
+        self.assertEqual(user_inputs.cached(self.path, ttl=60), user_inputs.normalize(None))
+        self.assertEqual(user_inputs.cached(self.path, ttl=60), user_inputs.normalize(None))
+        self.assertEqual(self.fetches, 1)
+        self.database()
+        self.write_cache({}, age=120)
+        self.assertEqual(user_inputs.cached(self.path, ttl=60)['NO_OF_INSTANCES'], 4)
+
+    def test_run_conf_overrides_the_cached_inputs(self):
+        self.database(up=False)
+        user_inputs.USER_INPUTS_CACHE = self.path
+        self.write_cache({'NO_OF_INSTANCES': 2, 'STREAMING': True}, age=120)
+        inputs = user_inputs.resolve({'STREAMING': False})
+        self.assertEqual((inputs['NO_OF_INSTANCES'], inputs['STREAMING']), (2, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
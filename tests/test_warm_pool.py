@@ -0,0 +1,66 @@
+import socket
+import time
+import unittest
+
+import shared_state
+import warm_pool
+from pipeline_benchmark import _SharedState
+
+SHARED_STATE_FUNCTIONS = ('locked', 'read', 'write', 'delete')
+
+
+class WarmPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict((name, getattr(shared_state, name)) for name in SHARED_STATE_FUNCTIONS)
+        _SharedState().install()
+        self.hostname = socket.gethostname()
+
+    def tearDown(self):
+        for name, function in self.saved.items():
+            setattr(shared_state, name, function)
+
+    def pool(self):
+        return shared_state.read(warm_pool.POOL_VARIABLE) or {}
+
+    def test_release_parks_up_to_the_pool_size(self):
+        to_delete = warm_pool.release(['worker-1', 'worker-2', 'worker-3'], 'n1-standard-1', 'v1', pool_size=2)
+        self.assertEqual(to_delete, ['worker-3'])
+        self.assertEqual(sorted(self.pool()), ['worker-1', 'worker-2'])
+        # the pool is full
+        self.assertEqual(warm_pool.release(['worker-4'], 'n1-standard-1', 'v1', pool_size=2), ['worker-4'])
+
+    def test_no_pool(self):
+        self.assertEqual(warm_pool.release(['worker-1'], 'n1-standard-1', 'v1', pool_size=0), ['worker-1'])
+        self.assertEqual(self.pool(), {})
+
+    def test_own_instance_is_never_deleted(self):
+        to_delete = warm_pool.release(['worker-1', self.hostname], 'n1-standard-1', 'v1', pool_size=1)
+        self.assertEqual(to_delete, [])
+        self.assertEqual(self.pool()[self.hostname]['idle_since'], 0)  # parked for the next reaping
+        self.assertEqual(warm_pool.acquire(2, 'n1-standard-1', 'v1'), ['worker-1'])  # not the one to be deleted
+        self.assertEqual(warm_pool.expire(3600), [])  # not by the task running on it
+
+    def test_acquire_matching_instances_latest_first(self):
+        warm_pool.release(['worker-1'], 'n1-standard-1', 'v1', pool_size=5)
+        time.sleep(0.01)
+        warm_pool.release(['worker-2'], 'n1-standard-1', 'v1', pool_size=5)
+        warm_pool.release(['worker-3'], 'n1-standard-4', 'v1', pool_size=5)
+        warm_pool.release(['worker-4'], 'n1-standard-1', 'v2', pool_size=5)
+        warm_pool.release(['worker-5'], 'n1-standard-1', 'v1', pool_size=5, preemptible=True)
+        self.assertEqual(warm_pool.acquire(1, 'n1-standard-1', 'v1'), ['worker-2'])
+        self.assertEqual(warm_pool.acquire(5, 'n1-standard-1', 'v1'), ['worker-1'])
+        self.assertEqual(warm_pool.acquire(5, 'n1-standard-1', 'v1', preemptible=True), ['worker-5'])
+        self.assertEqual(sorted(self.pool()), ['worker-3', 'worker-4'])
+
+    def test_expire(self):
+        warm_pool.release(['worker-1', 'worker-2'], 'n1-standard-1', 'v1', pool_size=5)
+        with shared_state.locked(warm_pool.POOL_VARIABLE) as pool:
+            pool['worker-1']['idle_since'] = time.time() - 7200
+        warm_pool.release(['worker-3'], 'n1-standard-1', 'v2', pool_size=5)
+        self.assertEqual(warm_pool.expire(3600), ['worker-1'])
+        self.assertEqual(sorted(warm_pool.expire(3600, version='v1')), ['worker-3'])
+        self.assertEqual(sorted(self.pool()), ['worker-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()